@@ -0,0 +1,684 @@
+"""梵音音频下载器性能基准
+
+用合成的测试文档测量各处理阶段的吞吐量，结果以 JSON 输出，便于比较不同版本。
+合成阶段使用本地模拟的 TTS 服务器，不访问 Google；每项测量在独立子进程中运行，
+以便统计峰值内存。
+
+    python benchmark.py extract --pages 1200 --processes 1 2 4 8
+    python benchmark.py extract --format docx --pages 1200
+    python benchmark.py extract --pages 300 --commentary-pages 3 --images
+    python benchmark.py extract --input 5梵汉对照手机版-….pdf --expected sample_items.json --processes 1
+    python benchmark.py synthesize --pages 100 --workers 1 4 16 --latency 0.2
+    python benchmark.py synthesize --throttle-rate 20 --error-rate 0.02
+    python benchmark.py synthesize --pages 120 --workers 16 --latency 0.05 --throttle-rate 10
+    python benchmark.py startup --runs 10
+    python benchmark.py postprocess --clips 400 --processes 1 2 4
+    python benchmark.py --output new.json --baseline old.json synthesize
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import 梵音音频下载 as converter
+
+
+# 与 batch_text_to_speech 的字体约定一致：YaHei 为标题，Times/Arial 为罗马音译咒语，其余为注释
+TITLE_FONT = "MicrosoftYaHei"
+MANTRA_FONT = "Times-Roman"
+COMMENT_FONT = "SimSun"
+
+SAMPLE_MANTRA = "om mani padme hum tadyatha om gate gate paragate parasamgate bodhi svaha"
+SAMPLE_COMMENT = "commentary line that the extractor must skip"
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path, pages, mantras_per_page=3, comment_lines=20, span_mantra_across_pages=True,
+                        commentary_pages=0, images=False):
+    """生成测试用PDF
+
+    每页包含 mantras_per_page 段 "标题 + 咒语"，并穿插 comment_lines 行注释文字。
+    span_mantra_across_pages 为 True 时每页开头先续写上一页的咒语，用于验证跨页拼接。
+    commentary_pages 为每个咒语页之后插入的纯注释页数，images 为 True 时每页放一张灰度图片，
+    用于模拟图文混排的真实文档。
+    直接写出PDF对象，不依赖任何第三方库；字体不嵌入，只用 BaseFont 名称区分。
+    """
+    objects = []
+
+    def add(data):
+        objects.append(data)
+        return len(objects)
+
+    fonts = [TITLE_FONT, MANTRA_FONT, COMMENT_FONT]
+    font_ids = [add(f"<< /Type /Font /Subtype /Type1 /BaseFont /{name} /Encoding /WinAnsiEncoding >>".encode())
+                for name in fonts]
+    xobjects = ""
+    if images:
+        pixels = bytes(range(256)) * 256
+        image_id = add(b"<< /Type /XObject /Subtype /Image /Width 256 /Height 256 /ColorSpace /DeviceGray "
+                       b"/BitsPerComponent 8 /Length %d >>\nstream\n" % len(pixels) + pixels + b"\nendstream")
+        xobjects = f" /XObject << /Im0 {image_id} 0 R >>"
+    pages_id = add(b"")
+    page_ids = []
+    mantra_index = 0
+
+    def add_page(lines):
+        # 与常见的PDF生成工具一样，每页的资源字典只列出本页用到的字体
+        used_fonts = sorted({font_index for font_index, _ in lines})
+        resources = ("<< /Font << " + " ".join(f"/F{index} {font_ids[index]} 0 R" for index in used_fonts)
+                     + f" >>{xobjects} >>")
+        y = 800
+        ops = ["q 200 0 0 200 360 600 cm /Im0 Do Q"] if images else []
+        for font_index, text in lines:
+            ops.append(f"BT /F{font_index} 9 Tf 40 {y} Td ({_pdf_escape(text)}) Tj ET")
+            y = y - 11 if y > 60 else 800
+        content = "\n".join(ops).encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_ids.append(add(f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+                            f"/Resources {resources} /Contents {content_id} 0 R >>".encode()))
+
+    for page_index in range(pages):
+        lines = []
+        if span_mantra_across_pages and page_index > 0:
+            lines.append((1, "svaha"))
+        for _ in range(mantras_per_page):
+            mantra_index += 1
+            lines.append((0, f"M{page_index + 1}.{mantra_index} Mantra {mantra_index}"))
+            lines.append((1, SAMPLE_MANTRA))
+            lines.extend((2, SAMPLE_COMMENT) for _ in range(comment_lines // max(1, mantras_per_page)))
+        add_page(lines)
+        for _ in range(commentary_pages):
+            add_page([(2, SAMPLE_COMMENT)] * 60)
+
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>".encode()
+    catalog_id = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, data in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + data + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_offset)
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+
+def _docx_run(font, text):
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return (f'<w:r><w:rPr><w:rFonts w:ascii="{font}" w:hAnsi="{font}" w:eastAsia="{font}"/></w:rPr>'
+            f'<w:t xml:space="preserve">{text}</w:t></w:r>')
+
+
+def write_synthetic_docx(path, pages, mantras_per_page=3, comment_lines=20):
+    """生成测试用DOCX
+
+    内容与 write_synthetic_pdf 相同 (每 "页" 为 mantras_per_page 段 "标题 + 咒语" 加注释段落)，
+    字体写在每个 run 的 rFonts 上：Microsoft YaHei 为标题，Arial 为咒语，宋体为注释。
+    直接写出 WordprocessingML，不依赖 python-docx。
+    """
+    header = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+              '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+    mantra_index = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _DOCX_RELS)
+        # 逐页写入，生成上百MB的文档时内存也不随之增长
+        with archive.open("word/document.xml", "w", force_zip64=True) as document:
+            document.write(header.encode("utf-8"))
+            for page_index in range(pages):
+                runs = []
+                for _ in range(mantras_per_page):
+                    mantra_index += 1
+                    runs.append(_docx_run("Microsoft YaHei", f"M{page_index + 1}.{mantra_index} Mantra {mantra_index}"))
+                    runs.append(_docx_run("Arial", SAMPLE_MANTRA))
+                    runs.extend(_docx_run("SimSun", SAMPLE_COMMENT)
+                                for _ in range(comment_lines // max(1, mantras_per_page)))
+                document.write("".join(f"<w:p>{run}</w:p>" for run in runs).encode("utf-8"))
+            document.write(b"</w:body></w:document>")
+    return path
+
+
+def write_synthetic_document(path_prefix, file_format, pages, commentary_pages=0, images=False):
+    if file_format == "docx":
+        return write_synthetic_docx(path_prefix + ".docx", pages)
+    return write_synthetic_pdf(path_prefix + ".pdf", pages, commentary_pages=commentary_pages, images=images)
+
+
+# 一个 MPEG-1 Layer III 128kbps/44.1kHz 的静音帧 (417 字节)，模拟服务器按文本长度返回若干帧
+SILENT_MP3_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+
+
+class FakeTTSServer:
+    """本地模拟的 Google 翻译 batchexecute 接口
+
+    按 GTTSBackend 的请求格式解析文本，固定延迟后返回与真实接口同格式的应答。
+    throttle_rate 为每秒放行的请求数 (令牌桶)，超出时返回 429 和 Retry-After；
+    error_rate 为随机返回 500 的比例。用法：
+
+        with FakeTTSServer(latency=0.2) as server:
+            backend = converter.GTTSBackend(base_url=server.url)
+    """
+
+    def __init__(self, latency=0.05, throttle_rate=None, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.counts = {"ok": 0, "throttled": 0, "errors": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = throttle_rate or 0
+        self._refilled_at = time.monotonic()
+        self._server = None
+
+    def _admit(self):
+        """返回本次请求的状态码"""
+        with self._lock:
+            if self.throttle_rate:
+                now = time.monotonic()
+                self._tokens = min(self.throttle_rate, self._tokens + (now - self._refilled_at) * self.throttle_rate)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    self.counts["throttled"] += 1
+                    return 429
+                self._tokens -= 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                return 500
+            self.counts["ok"] += 1
+            return 200
+
+    @staticmethod
+    def _parse_text(body):
+        """从 f.req=... 表单中取出待合成文本"""
+        payload = urllib.parse.parse_qs(body)["f.req"][0]
+        return json.loads(json.loads(payload)[0][0][1])[0]
+
+    @staticmethod
+    def render_audio_response(audio):
+        encoded = base64.b64encode(audio).decode("ascii")
+        payload = json.dumps([["wrb.fr", "jQ1olc", json.dumps([encoded]), None, None, None, "generic"]],
+                             separators=(",", ":"))
+        return (")]}'\n\n" + payload + "\n").encode("utf-8")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, data=b"", headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                status = server._admit()
+                if status == 429:
+                    self._reply(429, headers=[("Retry-After", "1")])
+                    return
+                if status != 200:
+                    self._reply(status)
+                    return
+                text = server._parse_text(body)
+                time.sleep(server.latency)
+                audio = SILENT_MP3_FRAME * max(1, len(text) // 10)
+                self._reply(200, server.render_audio_response(audio))
+
+        return Handler
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _peak_rss_mb():
+    """当前进程及其已结束子进程的峰值常驻内存 (MB)；不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+def _measure_extract(doc_path, processes):
+    started = time.perf_counter()
+    items = list(converter.iter_document_items(doc_path, extract_processes=processes))
+    elapsed = time.perf_counter() - started
+    return {"seconds": elapsed, "items": items}
+
+
+def _measure_synthesize(doc_path, output_dir, tts_url, workers, lang="ro"):
+    started = time.perf_counter()
+    first_audio = []
+    extracted = {}
+
+    def on_progress(current, total, stage):
+        if stage == "extract":
+            extracted["current"] = current
+        else:
+            extracted["mantras"] = total
+            if current and not first_audio:
+                first_audio.append(time.perf_counter() - started)
+
+    backend = converter.GTTSBackend(pool_size=workers, base_url=tts_url)
+    limiter = converter.RateLimiter(max_concurrency=workers)
+    audio_paths = converter.batch_text_to_speech(doc_path, output_dir, on_progress, max_workers=workers,
+                                                 lang=lang, backend=backend, limiter=limiter)
+    elapsed = time.perf_counter() - started
+    backend.close()
+    return {
+        "seconds": elapsed,
+        "mantras": len(audio_paths),
+        "expected_mantras": extracted.get("mantras", 0),
+        "time_to_first_audio": first_audio[0] if first_audio else None,
+        "limiter": limiter.stats(),
+    }
+
+
+def _child_main(function_name, kwargs_json):
+    """在子进程中运行一项测量，把结果和峰值内存以 JSON 写到标准输出"""
+    result = globals()[function_name](**json.loads(kwargs_json))
+    result["peak_rss_mb"], result["peak_child_rss_mb"] = _peak_rss_mb()
+    sys.stdout.write("\n" + json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def _run_in_child(function_name, **kwargs):
+    """在新的解释器中运行测量函数，避免前一项测量的内存和缓存影响下一项"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, "-c", "import sys, benchmark; benchmark._child_main(sys.argv[1], sys.argv[2])",
+               function_name, json.dumps(kwargs)]
+    completed = subprocess.run(command, cwd=repo_dir, capture_output=True, text=True, encoding="utf-8")
+    if completed.returncode != 0:
+        raise RuntimeError(f"{function_name} 运行失败:\n{completed.stderr}")
+    # 依赖库可能向标准输出打印提示，结果总在最后一行
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _count_units(doc_path):
+    """PDF 返回页数，DOCX 返回段落数，与解析进度的单位一致"""
+    if doc_path.lower().endswith(".pdf"):
+        import fitz
+        with fitz.open(doc_path) as doc:
+            return len(doc)
+    count = 0
+    tail = b""
+    with zipfile.ZipFile(doc_path) as archive, archive.open("word/document.xml") as document:
+        for chunk in iter(lambda: document.read(1 << 20), b""):
+            data = tail + chunk
+            count += data.count(b"<w:p>") + data.count(b"<w:p ")
+            # 保留不足一个标签长度的尾部，与下一块拼接后再计数，避免标签被切断时漏数
+            tail = data[-4:]
+    return count
+
+
+def compare_items(items, expected):
+    """与基准条目列表比较：标题及顺序必须一致，咒语文本可以在基准之后接续 (跨页咒语)
+
+    返回不一致之处的描述列表，最多列出前10处。
+    """
+    problems = []
+    if len(items) != len(expected):
+        problems.append(f"条目数 {len(items)}，基准为 {len(expected)}")
+    for index, ((title, text), (expected_title, expected_text)) in enumerate(zip(items, expected)):
+        if title != expected_title:
+            problems.append(f"第{index + 1}条标题为 {title!r}，基准为 {expected_title!r}")
+        elif not text.startswith(expected_text):
+            problems.append(f"第{index + 1}条 {title!r} 的咒语文本与基准不符")
+    return problems[:10]
+
+
+def bench_extract(doc_path, process_counts, expected=None):
+    """测量不同进程数下的解析速度，并校验各模式结果一致；DOCX 只支持单进程
+
+    expected 为基准条目列表时，每行的 expected_mismatches 列出与基准不一致之处。
+    """
+    pages = _count_units(doc_path)
+    if not doc_path.lower().endswith(".pdf"):
+        process_counts = [1]
+
+    results = []
+    baseline = None
+    for processes in process_counts:
+        measured = _run_in_child("_measure_extract", doc_path=doc_path, processes=processes)
+        elapsed = measured["seconds"]
+        items = [tuple(item) for item in measured["items"]]
+        if baseline is None:
+            baseline = items
+        results.append({
+            "processes": processes,
+            "pages": pages,
+            "items": len(items),
+            "seconds": round(elapsed, 3),
+            "pages_per_sec": round(pages / elapsed, 1) if elapsed else None,
+            "speedup": round(results[0]["seconds"] / elapsed, 2) if results else 1.0,
+            "matches_serial": items == baseline,
+            **({"expected_mismatches": compare_items(items, expected)} if expected is not None else {}),
+            "peak_rss_mb": measured["peak_rss_mb"],
+            "peak_child_rss_mb": measured["peak_child_rss_mb"],
+        })
+    return results
+
+
+def bench_synthesize(doc_path, worker_counts, work_dir, latency, throttle_rate=None, error_rate=0.0):
+    """对本地模拟服务器做端到端批量转换，测量咒语/秒和首个音频的延迟
+
+    failed 为合成失败的咒语数；服务器限流时 throughput_vs_limit 为吞吐量与限额之比，
+    限流器自行找到限额时应接近 1 且没有失败。
+    """
+    results = []
+    for workers in worker_counts:
+        with FakeTTSServer(latency=latency, throttle_rate=throttle_rate, error_rate=error_rate) as server:
+            output_dir = tempfile.mkdtemp(dir=work_dir)
+            measured = _run_in_child("_measure_synthesize", doc_path=doc_path, output_dir=output_dir,
+                                     tts_url=server.url, workers=workers)
+            counts = dict(server.counts)
+        elapsed = measured["seconds"]
+        results.append({
+            "workers": workers,
+            "mantras": measured["mantras"],
+            "seconds": round(elapsed, 3),
+            "mantras_per_sec": round(measured["mantras"] / elapsed, 2) if elapsed else None,
+            "failed": measured["expected_mantras"] - measured["mantras"],
+            "throughput_vs_limit": (round(measured["mantras"] / elapsed / throttle_rate, 2)
+                                    if throttle_rate and elapsed else None),
+            "time_to_first_audio_ms": (round(measured["time_to_first_audio"] * 1000, 1)
+                                       if measured["time_to_first_audio"] is not None else None),
+            "peak_rss_mb": measured["peak_rss_mb"],
+            "server": counts,
+            "limiter": measured["limiter"],
+        })
+    return results
+
+
+def write_synthetic_clips(clip_dir, count, sample_rate=24000, seed=0):
+    """生成 count 个音量和首尾静音各不相同的 MP3 片段 (需要 numpy 和 lameenc 或 ffmpeg)"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    os.makedirs(clip_dir, exist_ok=True)
+    paths = []
+    for index in range(count):
+        # 模拟语音：几个音节长短不一的调幅正弦波，整体电平在 -35 到 -10 dBFS 之间随机
+        voiced = []
+        for _ in range(rng.integers(3, 8)):
+            t = np.arange(int(sample_rate * rng.uniform(0.15, 0.4))) / sample_rate
+            envelope = np.sin(np.pi * t / t[-1])
+            voiced.append(envelope * np.sin(2 * np.pi * rng.uniform(120, 300) * t))
+            voiced.append(np.zeros(int(sample_rate * rng.uniform(0.02, 0.08))))
+        signal = np.concatenate([np.zeros(int(sample_rate * rng.uniform(0.1, 1.0)))] + voiced
+                                + [np.zeros(int(sample_rate * rng.uniform(0.1, 1.0)))])
+        signal *= 10 ** (rng.uniform(-35, -10) / 20) / np.sqrt(np.mean(signal ** 2) * 2)
+        pcm = (np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes()
+        path = os.path.join(clip_dir, f"clip{index:05d}.mp3")
+        with open(path, "wb") as f:
+            f.write(converter.encode_mp3(pcm, sample_rate))
+        paths.append(path)
+    return paths
+
+
+def _loudness_spread(paths):
+    """各片段响度 (dBFS) 的范围和标准差"""
+    import numpy as np
+    levels = []
+    for path in paths:
+        with open(path, "rb") as f:
+            sample_rate, pcm = converter.decode_mp3(f.read())
+        levels.append(converter.measure_loudness(np.frombuffer(pcm, dtype="<i2") / 32768.0, sample_rate))
+    return {"min": round(min(levels), 1), "max": round(max(levels), 1), "stdev": round(statistics.pstdev(levels), 2)}
+
+
+def _measure_postprocess(clip_dir, output_dir, cache_dir, processes, batch_size):
+    """冷缓存和热缓存各处理一遍，并抽样比较处理前后的响度分布"""
+    clips = sorted(os.path.join(clip_dir, name) for name in os.listdir(clip_dir))
+    pairs = [(path, os.path.join(output_dir, os.path.basename(path))) for path in clips]
+    processor = converter.AudioPostProcessor(processes=processes, batch_size=batch_size,
+                                             cache=converter.ProcessedCache(cache_dir))
+    try:
+        started = time.perf_counter()
+        processed = processor.process_files(pairs)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        processor.process_files(pairs)
+        warm = time.perf_counter() - started
+    finally:
+        processor.close()
+    sample = clips[:20]
+    return {
+        "clips": len(clips),
+        "processed": len(processed),
+        "seconds": cold,
+        "warm_seconds": warm,
+        "loudness_before": _loudness_spread(sample),
+        "loudness_after": _loudness_spread([processed[path] for path in sample if path in processed]),
+    }
+
+
+def bench_postprocess(clip_count, process_counts, batch_size, work_dir):
+    """后处理 (解码、NumPy 裁剪静音和响度归一化、重新编码) 的吞吐量随进程数的变化"""
+    clip_dir = os.path.join(work_dir, "clips")
+    write_synthetic_clips(clip_dir, clip_count)
+    results = []
+    for processes in process_counts:
+        measured = _run_in_child("_measure_postprocess", clip_dir=clip_dir,
+                                 output_dir=tempfile.mkdtemp(dir=work_dir), cache_dir=tempfile.mkdtemp(dir=work_dir),
+                                 processes=processes, batch_size=batch_size)
+        elapsed = measured["seconds"]
+        results.append({
+            "processes": processes,
+            "clips": measured["clips"],
+            "processed": measured["processed"],
+            "seconds": round(elapsed, 3),
+            "clips_per_sec": round(measured["clips"] / elapsed, 1) if elapsed else None,
+            "speedup": round(results[0]["seconds"] / elapsed, 2) if results else 1.0,
+            "cached_clips_per_sec": (round(measured["clips"] / measured["warm_seconds"], 1)
+                                     if measured["warm_seconds"] else None),
+            "loudness_before": measured["loudness_before"],
+            "loudness_after": measured["loudness_after"],
+            "peak_rss_mb": measured["peak_rss_mb"],
+            "peak_child_rss_mb": measured["peak_child_rss_mb"],
+        })
+    return results
+
+
+STARTUP_COMMANDS = {
+    # 只导入模块：库接口的启动开销
+    "import": [sys.executable, "-c", "import 梵音音频下载"],
+    # 命令行解析：convert 子命令开始工作之前的开销
+    "cli_help": [sys.executable, "梵音音频下载.py", "convert", "--help"],
+    # 对照：一次性导入全部重量级依赖时的开销
+    "eager_imports": [sys.executable, "-c", "import fitz, docx, gtts, requests"],
+}
+
+
+def bench_startup(runs):
+    """测量冷启动耗时 (子进程墙钟时间)"""
+    repo_dir = os.path.dirname(os.path.abspath(converter.__file__))
+    results = {}
+    for name, command in STARTUP_COMMANDS.items():
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            completed = subprocess.run(command, cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - started)
+            if completed.returncode != 0:
+                break
+        results[name] = {
+            "ok": completed.returncode == 0,
+            "median_ms": round(statistics.median(timings) * 1000, 1),
+            "min_ms": round(min(timings) * 1000, 1),
+            "runs": len(timings),
+        }
+    return results
+
+
+# 用于回归比较的指标：(报告中的列表名, 区分各行的键, 指标名)，均为越大越好
+REGRESSION_METRICS = [
+    ("extract", "processes", "pages_per_sec"),
+    ("synthesize", "workers", "mantras_per_sec"),
+    ("postprocess", "processes", "clips_per_sec"),
+]
+
+
+def compare_reports(report, baseline, tolerance):
+    """与基线报告比较吞吐量，返回低于基线超过 tolerance 比例的指标列表"""
+    regressions = []
+    for section, key, metric in REGRESSION_METRICS:
+        previous = {row[key]: row for row in baseline.get(section, [])}
+        for row in report.get(section, []):
+            old = previous.get(row[key], {}).get(metric)
+            new = row.get(metric)
+            if old and new is not None and new < old * (1 - tolerance):
+                regressions.append({"section": section, key: row[key], "metric": metric,
+                                    "baseline": old, "current": new, "ratio": round(new / old, 3)})
+    return regressions
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="梵音音频下载器性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = subparsers.add_parser("extract", help="文档解析吞吐量随进程数的变化")
+    extract_parser.add_argument("--pdf", "--input", dest="input", help="使用已有PDF/DOCX，不指定时生成合成文档")
+    extract_parser.add_argument("--format", choices=["pdf", "docx"], default="pdf", help="合成文档格式")
+    extract_parser.add_argument("--pages", type=int, default=1200, help="合成文档的咒语页数")
+    extract_parser.add_argument("--commentary-pages", type=int, default=0, help="每个咒语页之后的纯注释页数 (仅PDF)")
+    extract_parser.add_argument("--images", action="store_true", help="每页放一张图片 (仅PDF)")
+    extract_parser.add_argument("--processes", type=int, nargs="+",
+                                default=sorted({1, 2, 4, os.cpu_count() or 1}), help="要测试的进程数")
+    extract_parser.add_argument("--expected", help="基准条目列表 (JSON)，解析结果与之不符时返回非零")
+    synthesize_parser = subparsers.add_parser("synthesize", help="对本地模拟TTS服务器的端到端转换吞吐量")
+    synthesize_parser.add_argument("--input", help="使用已有PDF/DOCX，不指定时生成合成文档")
+    synthesize_parser.add_argument("--format", choices=["pdf", "docx"], default="pdf", help="合成文档格式")
+    synthesize_parser.add_argument("--pages", type=int, default=50, help="合成文档页数 (每页3段咒语)")
+    synthesize_parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16], help="要测试的并发数")
+    synthesize_parser.add_argument("--latency", type=float, default=0.2, help="模拟服务器每次请求的延迟 (秒)")
+    synthesize_parser.add_argument("--throttle-rate", type=float, help="模拟服务器每秒放行的请求数，超出返回429")
+    synthesize_parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务器随机返回500的比例")
+    postprocess_parser = subparsers.add_parser("postprocess", help="音频后处理 (静音裁剪和响度归一化) 的吞吐量")
+    postprocess_parser.add_argument("--clips", type=int, default=400, help="合成的测试片段数")
+    postprocess_parser.add_argument("--processes", type=int, nargs="+",
+                                    default=sorted({1, 2, 4, os.cpu_count() or 1}), help="要测试的进程数")
+    postprocess_parser.add_argument("--batch", type=int, default=converter.DEFAULT_POSTPROCESS_BATCH,
+                                    help="每次分发给进程的片段数")
+    startup_parser = subparsers.add_parser("startup", help="模块导入和命令行的冷启动耗时")
+    startup_parser.add_argument("--runs", type=int, default=10, help="每项重复次数")
+    parser.add_argument("--output", help="把JSON报告写入文件")
+    parser.add_argument("--baseline", help="与之前的JSON报告比较，吞吐量下降超过容差时返回非零")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐量下降比例，默认0.1")
+
+    args = parser.parse_args(argv)
+    report = {"environment": _environment(), "command": args.command}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.command in ("extract", "synthesize"):
+            doc_path = args.input or write_synthetic_document(os.path.join(work_dir, "synthetic"),
+                                                              args.format, args.pages,
+                                                              getattr(args, "commentary_pages", 0),
+                                                              getattr(args, "images", False))
+            report["document"] = {"path": os.path.basename(doc_path), "pages": _count_units(doc_path)}
+        if args.command == "extract":
+            expected = None
+            if args.expected:
+                with open(args.expected, encoding="utf-8") as f:
+                    expected = [tuple(item) for item in json.load(f)]
+            report["extract"] = bench_extract(doc_path, args.processes, expected)
+        elif args.command == "synthesize":
+            report["synthesize"] = bench_synthesize(doc_path, args.workers, work_dir, args.latency,
+                                                    args.throttle_rate, args.error_rate)
+        elif args.command == "postprocess":
+            report["postprocess"] = bench_postprocess(args.clips, args.processes, args.batch, work_dir)
+        elif args.command == "startup":
+            report["startup"] = bench_startup(args.runs)
+
+    # 有咒语合成失败或解析结果与基准不符时返回非零，长时间限流测试和样例PDF回归检查可以直接用作检查
+    exit_code = 1 if any(row.get("failed") for row in report.get("synthesize", [])) else 0
+    if any(row.get("expected_mismatches") for row in report.get("extract", [])):
+        exit_code = 1
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare_reports(report, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else exit_code
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,551 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import os
 import time
-import requests
-from docx import Document
-import fitz  # PyMuPDF
+
+_STARTUP_STARTED = time.perf_counter()
+
+try:
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+except ImportError:  # 无图形环境的服务器上只能使用命令行和库接口
+    tk = ttk = filedialog = messagebox = None
+import os
+import sys
+import argparse
 import re
-from gtts import gTTS
-from typing import *
 import logging
-from PIL import Image, ImageTk
+import logging.handlers
 import json
-import winreg
-import urllib.request
+import base64
+import urllib.parse
+import contextlib
+import random
+import email.utils
+import hashlib
+import inspect
+import hmac
+import secrets
+import shutil
+import threading
+import unicodedata
+import queue
+import collections
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+import itertools
+import multiprocessing
+import zipfile
+import sqlite3
 import socket
+import socketserver
+import signal
+import subprocess
+import tempfile
+import warnings
+from xml.etree import ElementTree
+
+
+# 同时进行的音频合成请求数上限
+DEFAULT_MAX_WORKERS = 4
+# 默认合成后端名称，参与缓存键计算
+DEFAULT_BACKEND = "gtts"
+# 可选的合成后端：gtts (在线，Google 翻译) 和 espeak (离线，espeak-ng)
+BACKEND_CHOICES = ("gtts", "espeak")
+# espeak-ng 的默认语音 (梵语)、语速 (每分钟词数) 和 MP3 码率 (kbps)
+DEFAULT_ESPEAK_VOICE = "sa"
+DEFAULT_ESPEAK_RATE = 140
+DEFAULT_ESPEAK_BITRATE = 64
+# 单次合成请求的超时 (秒)
+DEFAULT_TTS_TIMEOUT = 30
+DEFAULT_CACHE_DIR = "audio_cache"
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+
+def normalize_text(text):
+    """规范化文本 (Unicode NFC + 合并空白)，用于计算缓存键"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _temp_path(path):
+    """同目录下的临时文件名，写完后用 os.replace 原子地替换目标文件"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+
+def _link_or_copy(src, dst):
+    """优先硬链接，跨设备或不支持时退回复制；目标文件原子替换"""
+    tmp_path = _temp_path(dst)
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# 日志文件、单个日志文件的大小上限和保留的旧文件数，以及指标名前缀
+LOG_FILE = "audio_converter.log"
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+METRICS_PREFIX = "audio_converter_"
+
+
+class JsonLogFormatter(logging.Formatter):
+    """每条日志输出一行 JSON：时间、级别、消息，以及调用时通过 extra 传入的字段"""
+
+    _RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "message": record.getMessage()}
+        entry.update((key, value) for key, value in vars(record).items() if key not in self._RESERVED)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, log_file=None, json_format=False):
+    """配置根日志：默认 INFO 级别 (环境变量 AUDIO_CONVERTER_LOG_LEVEL 可改)，日志文件按大小轮转"""
+    level = (level or os.environ.get("AUDIO_CONVERTER_LOG_LEVEL") or "INFO").upper()
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_BYTES,
+                                                             backupCount=LOG_FILE_BACKUPS, encoding='utf-8'))
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JsonLogFormatter())
+    logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s', handlers=handlers)
+
+
+class Metrics:
+    """进程内的计数器和直方图 (线程安全)
+
+    inc() 累加计数器，observe() 记录耗时等数值的分布；名称加标签 (关键字参数) 确定一条序列。
+    snapshot() 返回可写成 JSON 的摘要，to_prometheus() 输出 Prometheus 文本格式。
+    """
+
+    # 直方图的默认分桶上界 (秒)
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._counters = collections.defaultdict(float)
+            self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                     'count': 0, 'sum': 0.0, 'min': value, 'max': value}
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = min(histogram['min'], value)
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """记录 with 块的耗时 (秒)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _series_name(name, labels):
+        return name + ("{" + ",".join(f"{key}={value}" for key, value in labels) + "}" if labels else "")
+
+    def snapshot(self):
+        """{计数器: 值}、{直方图: 次数、总和、平均、最小、最大、各分桶计数} 和运行时长"""
+        with self._lock:
+            counters = {self._series_name(name, labels): value for (name, labels), value in self._counters.items()}
+            histograms = {}
+            for (name, labels), histogram in self._histograms.items():
+                histograms[self._series_name(name, labels)] = {
+                    'count': histogram['count'],
+                    'sum': round(histogram['sum'], 6),
+                    'mean': round(histogram['sum'] / histogram['count'], 6),
+                    'min': round(histogram['min'], 6),
+                    'max': round(histogram['max'], 6),
+                    'buckets': {str(bound): count for bound, count in zip(histogram['buckets'], histogram['counts'])},
+                }
+            return {'started_at': self.started_at, 'elapsed_seconds': round(time.time() - self.started_at, 3),
+                    'counters': dict(sorted(counters.items())), 'histograms': dict(sorted(histograms.items()))}
+
+    def write_json(self, path):
+        tmp_path = _temp_path(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _prometheus_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                   for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 (0.0.4)"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(value, counts=list(value['counts'])))
+                                for key, value in self._histograms.items())
+        declared = set()
+        for (name, labels), value in counters:
+            metric = METRICS_PREFIX + name
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{self._prometheus_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            metric = METRICS_PREFIX + name
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} histogram")
+                declared.add(metric)
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative += count
+                lines.append(f"{metric}_bucket{self._prometheus_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{metric}_bucket{self._prometheus_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{metric}_sum{self._prometheus_labels(labels)} {histogram['sum']:g}")
+            lines.append(f"{metric}_count{self._prometheus_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的指标：解析、合成、缓存等各处都记录到这里
+metrics = Metrics()
+
+
+def serve_metrics(port, host="127.0.0.1", registry=None):
+    """在后台线程提供 /metrics (Prometheus 文本格式) 和 /metrics.json，返回 HTTP 服务器对象"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    registry = registry or metrics
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.snapshot(), ensure_ascii=False), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logging.debug("指标请求: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"指标服务: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class AudioCache:
+    """按内容寻址的持久化音频缓存
+
+    键为规范化文本、语言和后端名称的 SHA-256，值为 MP3 文件。
+    缓存总大小超过 max_bytes 时按最近使用时间 (mtime) 淘汰最旧的条目。
+    """
+
+    # 指标中的缓存名称
+    METRIC_NAME = "audio"
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._iter_entries())
+
+    @staticmethod
+    def make_key(text, lang, backend=DEFAULT_BACKEND):
+        """计算缓存键"""
+        payload = json.dumps([normalize_text(text), lang, backend], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp3")
+
+    def _iter_entries(self):
+        """遍历缓存条目，返回 (路径, 大小, mtime)
+
+        只查看以键的前两位命名的子目录，缓存目录下的其他内容 (如分段缓存、解析缓存) 不计入。
+        """
+        for prefix in os.listdir(self.cache_dir):
+            directory = os.path.join(self.cache_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith('.mp3'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def fetch(self, text, lang, backend, dest_path):
+        """命中时把缓存音频链接或复制到 dest_path 并返回 True，未命中返回 False"""
+        path = self._entry_path(self.make_key(text, lang, backend))
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size == 0:
+            with self._lock:
+                self.misses += 1
+            metrics.inc("cache_misses_total", cache=self.METRIC_NAME)
+            return False
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        _link_or_copy(path, dest_path)
+        try:
+            os.utime(path)  # 更新最近使用时间
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+        metrics.inc("cache_hits_total", cache=self.METRIC_NAME)
+        return True
+
+    def get_bytes(self, text, lang, backend):
+        """命中时返回缓存的音频字节，未命中返回 None"""
+        path = self._entry_path(self.make_key(text, lang, backend))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # 更新最近使用时间
+        except OSError:
+            data = b''
+        with self._lock:
+            if not data:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += len(data)
+        metrics.inc("cache_hits_total" if data else "cache_misses_total", cache=self.METRIC_NAME)
+        return data or None
+
+    def store(self, text, lang, backend, src_path):
+        """把已生成的音频存入缓存"""
+        self._store_with(text, lang, backend, lambda tmp_path: shutil.copyfile(src_path, tmp_path))
+
+    def put_bytes(self, text, lang, backend, data):
+        """把音频字节存入缓存"""
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._store_with(text, lang, backend, write)
+
+    def _store_with(self, text, lang, backend, write):
+        path = self._entry_path(self.make_key(text, lang, backend))
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = _temp_path(path)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"写入音频缓存失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        size = os.path.getsize(path)
+        metrics.inc("bytes_written_total", size, target=f"{self.METRIC_NAME}_cache")
+        with self._lock:
+            self._total_bytes += size
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """按 LRU 淘汰条目，直到总大小不超过上限"""
+        with self._lock:
+            entries = sorted(self._iter_entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError as e:
+                    logging.warning(f"淘汰缓存条目失败: {str(e)}")
+            self._total_bytes = total
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class ChunkCache(AudioCache):
+    """分段音频缓存：比整段缓存低一级，键为规范化的短语分段
+
+    值为去掉标签和元数据帧后的 MP3 帧序列，可以直接与其他分段在帧级别拼接。
+    许多咒语共用 "oṃ ... svāhā"、"tadyathā ..." 之类的固定短语，整段缓存无法命中这些重叠，
+    分段缓存的每次命中都省去一次合成请求。
+    """
+
+    DIR_NAME = "chunks"
+    METRIC_NAME = "chunks"
+
+    def stats(self):
+        stats = super().stats()
+        stats['requests_saved'] = stats['hits']
+        stats['requests_made'] = stats['misses']
+        return stats
+
+
+class ProcessedCache(AudioCache):
+    """后处理结果缓存：键为原始音频的 SHA-256 和处理参数，值为处理后的 MP3
+
+    原始音频和参数都未变时直接取用，不再解码和计算。
+    """
+
+    DIR_NAME = "processed"
+    METRIC_NAME = "processed"
+
+    def get_processed(self, audio_hash, settings_key):
+        return self.get_bytes(audio_hash, settings_key, "postprocess")
+
+    def put_processed(self, audio_hash, settings_key, data):
+        self.put_bytes(audio_hash, settings_key, "postprocess", data)
+
+
+def text_hash(text):
+    """规范化文本的 SHA-256"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class BatchManifest:
+    """输出目录下的运行清单 (manifest.jsonl)
+
+    每行一条 JSON 记录：条目编号、标题、文件名、文本哈希、状态、字节数和耗时。
+    同一条目以最后一行为准；重新运行时跳过已完成且文件校验通过的条目。
+    """
+
+    FILE_NAME = "manifest.jsonl"
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.path = os.path.join(folder_path, self.FILE_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 崩溃时写了一半的行
+                    self.entries[entry['id']] = entry
+        self._fp = open(self.path, 'a', encoding='utf-8')
+
+    def is_done(self, item_id, text, audio_path, lang='ro'):
+        """条目已完成、文本和语言未变且音频文件大小与记录一致"""
+        entry = self.entries.get(item_id)
+        if not entry or entry.get('status') != 'done':
+            return False
+        if entry.get('text_hash') != text_hash(text) or entry.get('lang', 'ro') != lang:
+            return False
+        if entry.get('file') != os.path.basename(audio_path):
+            return False
+        try:
+            return os.path.getsize(audio_path) == entry.get('bytes') > 0
+        except OSError:
+            return False
+
+    def record(self, item_id, title, file_name, text, lang, status, size, started_at, finished_at, error=None):
+        """追加一条记录并立即落盘"""
+        entry = {
+            'id': item_id,
+            'title': title,
+            'file': file_name,
+            'text_hash': text_hash(text),
+            'lang': lang,
+            'status': status,
+            'bytes': size,
+            'started_at': round(started_at, 3),
+            'finished_at': round(finished_at, 3),
+            'elapsed': round(finished_at - started_at, 3),
+        }
+        if error:
+            entry['error'] = error
+        with self._lock:
+            self.entries[item_id] = entry
+            self._fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._fp.flush()
+
+    def close(self):
+        """关闭清单，并把重复记录压缩为每个条目一行"""
+        with self._lock:
+            if self._fp is None:
+                return
+            self._fp.close()
+            self._fp = None
+            tmp_path = _temp_path(self.path)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for item_id in sorted(self.entries):
+                    f.write(json.dumps(self.entries[item_id], ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
 
 
 def get_system_proxy():
-    """获取系统代理设置"""
+    """获取系统代理设置 (Windows 注册表优先，其次环境变量)"""
     try:
-        reg_path = r'Software\Microsoft\Windows\CurrentVersion\Internet Settings'
-        reg_key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, reg_path, 0, winreg.KEY_ALL_ACCESS)
-        proxy_enable, _ = winreg.QueryValueEx(reg_key, 'ProxyEnable')
-        if proxy_enable:
-            proxy_server, _ = winreg.QueryValueEx(reg_key, 'ProxyServer')
-            if proxy_server:
-                if ':' in proxy_server:
-                    host, port = proxy_server.split(':')
-                    return host.strip(), port.strip()
+        if sys.platform == 'win32':
+            import winreg
+            reg_path = r'Software\Microsoft\Windows\CurrentVersion\Internet Settings'
+            reg_key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, reg_path, 0, winreg.KEY_READ)
+            proxy_enable, _ = winreg.QueryValueEx(reg_key, 'ProxyEnable')
+            if proxy_enable:
+                proxy_server, _ = winreg.QueryValueEx(reg_key, 'ProxyServer')
+                if proxy_server:
+                    if ':' in proxy_server:
+                        host, port = proxy_server.split(':')
+                        return host.strip(), port.strip()
         http_proxy = os.environ.get('HTTP_PROXY') or os.environ.get('http_proxy')
         https_proxy = os.environ.get('HTTPS_PROXY') or os.environ.get('https_proxy')
         if http_proxy:
@@ -50,231 +568,3443 @@ def get_system_proxy():
     return None, None
 
 
-def batch_text_to_speech(file_path, folder_path, progress_callback=None):
-    """批量转换Word和PDF文件中的纯梵文段落为音频"""
-    input_filename = os.path.splitext(os.path.basename(file_path))[0]
-    folder_path = os.path.join(folder_path, input_filename)
+# 系统代理解析结果的有效期 (秒)
+DEFAULT_PROXY_TTL = 60
+
+
+class ProxyResolver:
+    """系统代理的解析结果缓存
+
+    读取注册表和环境变量的结果保留 ttl 秒，多个线程、多次合成共用，不在每次请求时重新读取。
+    resolve() 返回 "http://host:port"，没有系统代理时返回 None。
+    """
+
+    def __init__(self, ttl=DEFAULT_PROXY_TTL):
+        self.ttl = ttl
+        self._value = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._expires:
+                host, port = get_system_proxy()
+                self._value = f"http://{host}:{port}" if host and port else None
+                self._expires = now + self.ttl
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._expires = 0.0
+
+
+system_proxy_resolver = ProxyResolver()
+
+
+# 标题字体中的编号和卍字符, 如 "M1.2 卍 大悲咒"
+TITLE_PATTERN = re.compile(r"^(M\d+\.\d+)?\s*(卍\s*)*(.*)$")
+# 多进程解析PDF时每个任务处理的最大页数
+PARALLEL_EXTRACT_CHUNK_PAGES = 16
+# 解析线程与合成线程池之间的队列长度
+DEFAULT_QUEUE_SIZE = 32
+# 解析结果的格式版本：字体规则、文本提取方式或标题/咒语状态机改变时递增，使解析缓存失效
+PARSER_VERSION = "3"
+
+
+class FontClassifier:
+    """按字体名称区分标题与罗马音译咒语，PDF 和 Word 共用
+
+    规则为正则表达式 (re.search)，构造时预编译；PDF 子集字体名的 "ABCDEF+" 前缀先去掉再匹配。
+    每个字体名只匹配一次，结果缓存。默认规则：名称含 YaHei 为标题，以 Arial 或 Times 开头为咒语。
+    """
+
+    SUBSET_PREFIX = re.compile(r"^[A-Z]{6}\+")
+
+    def __init__(self, title_patterns=("YaHei",), mantra_patterns=("^Arial", "^Times")):
+        self.title_patterns = tuple(title_patterns)
+        self.mantra_patterns = tuple(mantra_patterns)
+        self._title = self._compile(self.title_patterns)
+        self._mantra = self._compile(self.mantra_patterns)
+        self._cache = {}
+        # 规则的标识，写入解析缓存的键中，规则变化时旧的解析结果失效
+        self.signature = json.dumps([self.title_patterns, self.mantra_patterns], ensure_ascii=False)
+
+    @staticmethod
+    def _compile(patterns):
+        return re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+    def classify(self, font_name):
+        """返回 'title'、'mantra'，其他字体返回 None"""
+        if not font_name:
+            return None
+        kind = self._cache.get(font_name, False)
+        if kind is not False:
+            return kind
+        name = self.SUBSET_PREFIX.sub("", font_name)
+        if self._title is not None and self._title.search(name):
+            kind = 'title'
+        elif self._mantra is not None and self._mantra.search(name):
+            kind = 'mantra'
+        else:
+            kind = None
+        self._cache[font_name] = kind
+        return kind
+
+
+DEFAULT_FONT_CLASSIFIER = FontClassifier()
+
+
+class _PdfFontIndex:
+    """文档级的字体分类索引：判断页面是否用到标题或罗马音译字体，不解析文本
+
+    页面的字体表 (page.get_fonts()) 由其资源字典决定，多数文档的页面共用同一个资源对象，
+    因此按资源字典缓存判断结果，每种资源组合只读取一次字体表。
+    """
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self._relevant = {}
+
+    def page_is_relevant(self, page):
+        resources = page.parent.xref_get_key(page.xref, "Resources")
+        relevant = self._relevant.get(resources)
+        if relevant is None:
+            relevant = any(self.classifier.classify(font[3]) for font in page.get_fonts())
+            # 资源字典为空或继承自父节点时无法据此区分页面，不缓存
+            if resources[0] != "null":
+                self._relevant[resources] = relevant
+        return relevant
+
+
+def _iter_page_spans(page, classifier=DEFAULT_FONT_CLASSIFIER, font_index=None):
+    """读取单页的 (字体类型, 文本)，只保留标题和罗马音译字体的文本
+
+    字体表中没有相关字体的页面 (纯中文注释页等) 直接跳过；其余页面提取文本时不输出图片块。
+    """
+    font_index = font_index or _PdfFontIndex(classifier)
+    if not font_index.page_is_relevant(page):
+        return
+    import fitz  # PyMuPDF
+    # 在默认选项的基础上不输出图片块，否则每张图片的像素数据都会被复制出来
+    flags = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+    for block in page.get_text("dict", flags=flags)["blocks"]:
+        for line in block.get("lines", ()):
+            for span in line["spans"]:
+                kind = classifier.classify(span["font"])
+                if kind:
+                    yield kind, span["text"].strip()
+
+
+def _extract_pdf_page_range(file_path, start, stop, classifier=DEFAULT_FONT_CLASSIFIER):
+    """子进程任务：打开独立的 fitz 文档，返回 [start, stop) 各页的分类文本"""
+    import fitz  # PyMuPDF
+    pdf_document = fitz.open(file_path)
+    try:
+        font_index = _PdfFontIndex(classifier)
+        return [list(_iter_page_spans(pdf_document[page_index], classifier, font_index))
+                for page_index in range(start, stop)]
+    finally:
+        pdf_document.close()
+
+
+def _iter_pdf_pages_parallel(file_path, page_indices, processes, classifier=DEFAULT_FONT_CLASSIFIER):
+    """多进程解析PDF的指定页：连续页合并为页段分发给进程池，按页码顺序生成 (页码, 分类文本)"""
+    chunk_pages = max(1, min(PARALLEL_EXTRACT_CHUNK_PAGES, len(page_indices) // (processes * 4)))
+    ranges = []
+    for page_index in page_indices:
+        if ranges and ranges[-1][1] == page_index and ranges[-1][1] - ranges[-1][0] < chunk_pages:
+            ranges[-1][1] = page_index + 1
+        else:
+            ranges.append([page_index, page_index + 1])
+    page_ranges = iter(ranges)
+    logging.info(f"多进程解析PDF: {processes} 个进程，每段最多 {chunk_pages} 页")
+    executor = ProcessPoolExecutor(max_workers=processes)
+    try:
+        pending = collections.deque()
+        # 只预先提交有限的页段，保持内存占用与文档大小无关
+        for start, stop in itertools.islice(page_ranges, processes * 2):
+            pending.append((start, executor.submit(_extract_pdf_page_range, file_path, start, stop, classifier)))
+        while pending:
+            start, future = pending.popleft()
+            pages = future.result()
+            for next_start, next_stop in itertools.islice(page_ranges, 1):
+                pending.append((next_start, executor.submit(_extract_pdf_page_range, file_path, next_start, next_stop,
+                                                            classifier)))
+            for offset, page_spans in enumerate(pages):
+                yield start + offset, page_spans
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _pdf_page_fingerprint(page, parser_key):
+    """页面内容流和字体表的哈希：二者不变时解析结果不变，计算成本远低于提取文本"""
+    digest = hashlib.sha256(parser_key.encode('utf-8'))
+    digest.update(page.read_contents())
+    digest.update(repr(page.get_fonts()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _iter_pdf_spans(file_path, progress_callback=None, processes=1, extraction_cache=None,
+                    classifier=DEFAULT_FONT_CLASSIFIER):
+    """逐页读取PDF，生成 (页码, span序号, 字体类型, 文本)
+
+    processes > 1 时多进程解析。传入 extraction_cache 时先计算各页指纹，
+    未变化的页直接取缓存结果，只解析新增或修改过的页。
+    """
+    import fitz  # PyMuPDF
+    pdf_document = fitz.open(file_path)
+    extracted = None
+    try:
+        total_pages = len(pdf_document)
+        logging.info(f"开始处理PDF文件: {file_path}")
+        fingerprints = None
+        cached_pages = {}
+        if extraction_cache is not None:
+            parser_key = _parser_key(classifier)
+            fingerprints = [_pdf_page_fingerprint(page, parser_key) for page in pdf_document]
+            cached_pages = extraction_cache.get_pages(fingerprints)
+        missing = [page_index for page_index in range(total_pages)
+                   if fingerprints is None or fingerprints[page_index] not in cached_pages]
+        if fingerprints is not None:
+            logging.info(f"解析缓存: {total_pages - len(missing)} 页未变化，需解析 {len(missing)} 页")
+
+        if processes > 1 and len(missing) > PARALLEL_EXTRACT_CHUNK_PAGES:
+            extracted = _iter_pdf_pages_parallel(file_path, missing, processes, classifier)
+        else:
+            font_index = _PdfFontIndex(classifier)
+            extracted = ((page_index, list(_iter_page_spans(pdf_document[page_index], classifier, font_index)))
+                         for page_index in missing)
+
+        new_pages = {}
+        for page_index in range(total_pages):
+            if fingerprints is not None and fingerprints[page_index] in cached_pages:
+                page_spans = cached_pages[fingerprints[page_index]]
+                metrics.inc("pages_total", format="pdf", source="cache")
+            else:
+                logging.debug("处理第 %d 页", page_index + 1, extra={"page": page_index + 1})
+                _, page_spans = next(extracted)
+                metrics.inc("pages_total", format="pdf", source="parsed")
+                if fingerprints is not None:
+                    new_pages[fingerprints[page_index]] = page_spans
+            for span_index, (kind, text) in enumerate(page_spans):
+                yield page_index, span_index, kind, text
+            if progress_callback:
+                progress_callback(page_index + 1, total_pages)
+        if new_pages:
+            extraction_cache.put_pages(new_pages)
+    finally:
+        if extracted is not None:
+            extracted.close()
+        pdf_document.close()
+
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+
+
+class _DocxFontResolver:
+    """按 Word 的继承规则解析 run 的西文字体 (w:ascii)
+
+    优先级：run 的直接格式 → 字符样式链 → 段落样式链 (未指定时为默认段落样式) → 文档默认格式。
+    每一级的 asciiTheme 通过主题字体表解析。每个样式的解析结果只计算一次。
+    """
+
+    def __init__(self, archive):
+        self.styles = {}
+        self.default_paragraph_style = None
+        self.default_font = None
+        self.theme_fonts = {}
+        self._style_cache = {}
+        names = set(archive.namelist())
+        if "word/theme/theme1.xml" in names:
+            theme = ElementTree.fromstring(archive.read("word/theme/theme1.xml"))
+            for kind in ("major", "minor"):
+                latin = theme.find(f".//{_A_NS}{kind}Font/{_A_NS}latin")
+                if latin is not None:
+                    self.theme_fonts[kind] = latin.get("typeface")
+        if "word/styles.xml" in names:
+            styles = ElementTree.fromstring(archive.read("word/styles.xml"))
+            defaults = styles.find(f"{_W_NS}docDefaults/{_W_NS}rPrDefault/{_W_NS}rPr")
+            self.default_font = self.font_of(defaults)
+            for style in styles.iter(f"{_W_NS}style"):
+                style_id = style.get(f"{_W_NS}styleId")
+                based_on = style.find(f"{_W_NS}basedOn")
+                self.styles[style_id] = (
+                    based_on.get(f"{_W_NS}val") if based_on is not None else None,
+                    self.font_of(style.find(f"{_W_NS}rPr")),
+                )
+                if style.get(f"{_W_NS}type") == "paragraph" and style.get(f"{_W_NS}default") in ("1", "true", "on"):
+                    self.default_paragraph_style = style_id
+
+    def font_of(self, rpr):
+        """rPr 元素上直接指定的西文字体，未指定时返回 None"""
+        if rpr is None:
+            return None
+        fonts = rpr.find(f"{_W_NS}rFonts")
+        if fonts is None:
+            return None
+        theme = fonts.get(f"{_W_NS}asciiTheme")
+        if theme:
+            return self.theme_fonts.get("major" if theme.startswith("major") else "minor")
+        return fonts.get(f"{_W_NS}ascii")
+
+    def style_font(self, style_id):
+        """沿 basedOn 链解析样式的字体 (结果缓存)"""
+        if style_id in self._style_cache:
+            return self._style_cache[style_id]
+        font = None
+        seen = set()
+        current = style_id
+        while current in self.styles and current not in seen:
+            seen.add(current)
+            based_on, own_font = self.styles[current]
+            if own_font:
+                font = own_font
+                break
+            current = based_on
+        self._style_cache[style_id] = font
+        return font
+
+    def run_font(self, run_props, paragraph_style):
+        font = self.font_of(run_props)
+        if font:
+            return font
+        if run_props is not None:
+            run_style = run_props.find(f"{_W_NS}rStyle")
+            if run_style is not None:
+                font = self.style_font(run_style.get(f"{_W_NS}val"))
+                if font:
+                    return font
+        return self.style_font(paragraph_style or self.default_paragraph_style) or self.default_font
+
+
+class _CountingReader:
+    """包装文件对象，记录已读取的字节数，用于报告解析进度"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _docx_run_text(run):
+    parts = []
+    for child in run:
+        if child.tag == f"{_W_NS}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{_W_NS}tab":
+            parts.append("\t")
+        elif child.tag in (f"{_W_NS}br", f"{_W_NS}cr"):
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _iter_docx_spans(file_path, progress_callback=None, classifier=DEFAULT_FONT_CLASSIFIER):
+    """流式读取Word文档正文，生成 (段落序号, run序号, 字体类型, 文本)
+
+    不经过 python-docx 的对象模型：用 iterparse 逐段解析 word/document.xml，
+    处理完的段落立即释放，内存占用与文档大小无关。progress_callback 的单位为
+    document.xml 解压后的字节数。与 python-docx 的 doc.paragraphs 一致，
+    只处理正文中的顶层段落及其直接包含的 run。
+    """
+    logging.info(f"开始处理Word文件: {file_path}")
+    with zipfile.ZipFile(file_path) as archive:
+        resolver = _DocxFontResolver(archive)
+        total_bytes = archive.getinfo("word/document.xml").file_size
+        with archive.open("word/document.xml") as raw:
+            reader = _CountingReader(raw)
+            depth = 0
+            body = None
+            paragraph_index = 0
+            for event, elem in ElementTree.iterparse(reader, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 2 and elem.tag == f"{_W_NS}body":
+                        body = elem
+                    continue
+                depth -= 1
+                if depth != 2 or body is None:
+                    continue
+                # 正文的顶层元素已完整读入
+                if elem.tag == f"{_W_NS}p":
+                    paragraph_props = elem.find(f"{_W_NS}pPr")
+                    paragraph_style = None
+                    if paragraph_props is not None:
+                        style = paragraph_props.find(f"{_W_NS}pStyle")
+                        if style is not None:
+                            paragraph_style = style.get(f"{_W_NS}val")
+                    for run_index, run in enumerate(elem.iterfind(f"{_W_NS}r")):
+                        kind = classifier.classify(resolver.run_font(run.find(f"{_W_NS}rPr"), paragraph_style))
+                        if kind:
+                            yield paragraph_index, run_index, kind, _docx_run_text(run).strip()
+                    paragraph_index += 1
+                body.clear()
+                if progress_callback:
+                    progress_callback(reader.bytes_read, total_bytes)
+    metrics.inc("pages_total", paragraph_index, format="docx", source="parsed")
+    if progress_callback:
+        progress_callback(total_bytes, total_bytes)
+
+
+def _is_marked_title(match):
+    """标题带 M 编号或卍字符时才是真正的标题，其余 YaHei 文字 (注音、编号) 不算"""
+    return bool(match and (match.group(1) or match.group(2)))
+
+
+def _assemble_items(spans, page_breaks=True):
+    """标题/咒语状态机：遇到标题字体时结算上一段咒语，罗马音译文本累加到当前标题下
+
+    spans 为 (页码, span序号, 字体类型, 文本)，生成 (标题, 咒语文本, 起始位置, 结束位置)，
+    位置为咒语首尾 span 的 (页码, span序号)。page_breaks 为 True (PDF) 时，翻页只在两种情况下保留状态：
+    上一页末尾的咒语尚未结束 (接续到下一页)，或上一页最后一个标题字体的 span 是带 M 编号或卍字符的
+    真正标题 (咒语从下一页开始)；否则与逐页解析一样清空当前标题，页首的文字不会挂到注音或编号之类的文字下。
+    Word 文档的"页码"是段落序号，状态始终保留。
+    """
+    current_title = None
+    text_to_convert = ""
+    start = end = None
+    current_page = None
+    last_title_marked = False
+    for page_index, span_index, kind, text in spans:
+        if page_breaks and page_index != current_page:
+            if current_page is not None and not text_to_convert and not last_title_marked:
+                current_title = None
+            current_page = page_index
+        if kind == 'title':
+            if text_to_convert and current_title:  # Previous mantra is complete
+                yield current_title.strip(), text_to_convert.strip(), start, end
+            # 提取标题 (处理编号和卍字符)
+            match = TITLE_PATTERN.match(text)
+            if match:
+                title_text = match.group(3).strip()  # 提取标题文本
+                if title_text:  # 仅当提取到有效标题时才更新
+                    current_title = title_text
+            if text.strip():
+                last_title_marked = _is_marked_title(match)
+            text_to_convert = ""  # Reset
+        elif current_title:
+            # 罗马音译咒语, 且已有标题
+            if not text_to_convert:
+                start = (page_index, span_index)
+            end = (page_index, span_index)
+            text_to_convert += text + " "  # 累加咒语文本, 用空格分隔
+
+    if text_to_convert and current_title:
+        yield current_title.strip(), text_to_convert.strip(), start, end
+
+
+class ExtractionCache:
+    """持久化的文档解析结果 (SQLite)
+
+    两级索引，键中都包含解析器版本和字体规则 (见 _parser_key)：
+    documents 按文件内容的 SHA-256 保存整份文档的解析条目 (标题、咒语、首尾 span 位置)，
+    文件未变时完全跳过解析；pages 按页面指纹保存PDF每页的分类文本，
+    文件部分修改时只重新解析变化的页，再由状态机把各页拼接起来。
+    """
+
+    FILE_NAME = "extraction.sqlite3"
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (file_hash TEXT, parser_version TEXT, "
+                               "items TEXT, PRIMARY KEY (file_hash, parser_version))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS pages (page_hash TEXT PRIMARY KEY, spans TEXT)")
+        self.document_hits = 0
+        self.document_misses = 0
+        self.page_hits = 0
+        self.page_misses = 0
+
+    @staticmethod
+    def file_digest(file_path):
+        """文件内容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_document(self, file_hash, parser_key):
+        """返回缓存的 [(标题, 咒语文本, 起始位置, 结束位置)]，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT items FROM documents WHERE file_hash = ? AND parser_version = ?",
+                                     (file_hash, parser_key)).fetchone()
+            if row is None:
+                self.document_misses += 1
+                metrics.inc("cache_misses_total", cache="extraction_document")
+                return None
+            self.document_hits += 1
+            metrics.inc("cache_hits_total", cache="extraction_document")
+        return [(title, text, tuple(start), tuple(end)) for title, text, start, end in json.loads(row[0])]
+
+    def put_document(self, file_hash, parser_key, items):
+        payload = json.dumps(items, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                               (file_hash, parser_key, payload))
+
+    def get_pages(self, page_hashes):
+        """批量查询页面指纹，返回 {指纹: [(字体类型, 文本)]}；页面指纹本身已包含解析版本"""
+        unique_hashes = list(dict.fromkeys(page_hashes))
+        found = {}
+        with self._lock:
+            # SQLite 对单条语句的参数个数有限制，分批查询
+            for offset in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[offset:offset + 500]
+                rows = self._conn.execute(
+                    f"SELECT page_hash, spans FROM pages WHERE page_hash IN ({','.join('?' * len(batch))})", batch)
+                for page_hash, spans in rows:
+                    found[page_hash] = [tuple(span) for span in json.loads(spans)]
+            hits = sum(1 for page_hash in page_hashes if page_hash in found)
+            self.page_hits += hits
+            self.page_misses += len(page_hashes) - hits
+        metrics.inc("cache_hits_total", hits, cache="extraction_page")
+        metrics.inc("cache_misses_total", len(page_hashes) - hits, cache="extraction_page")
+        return found
+
+    def put_pages(self, pages):
+        rows = [(page_hash, json.dumps(spans, ensure_ascii=False)) for page_hash, spans in pages.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?)", rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "document_hits": self.document_hits,
+                "document_misses": self.document_misses,
+                "page_hits": self.page_hits,
+                "page_misses": self.page_misses,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _parser_key(classifier):
+    """解析缓存键中的解析器标识：格式版本加字体规则"""
+    return f"{PARSER_VERSION}:{classifier.signature}"
+
+
+def _count_spans(spans, file_format):
+    """按字体类型统计经过的文本片段，结束时一次性计入指标"""
+    counts = collections.Counter()
+    try:
+        for span in spans:
+            counts[span[2]] += 1
+            yield span
+    finally:
+        for kind, count in counts.items():
+            metrics.inc("spans_total", count, format=file_format, kind=kind)
+
+
+def _iter_extracted_items(file_path, progress_callback=None, extract_processes=1, extraction_cache=None,
+                          classifier=DEFAULT_FONT_CLASSIFIER):
+    """解析文档并生成 (标题, 咒语文本, 起始位置, 结束位置)，按需读写解析缓存"""
+    file_hash = None
+    if extraction_cache is not None:
+        file_hash = extraction_cache.file_digest(file_path)
+        cached_items = extraction_cache.get_document(file_hash, _parser_key(classifier))
+        if cached_items is not None:
+            logging.info(f"解析缓存命中，跳过解析: {file_path}")
+            if progress_callback:
+                progress_callback(1, 1)
+            yield from cached_items
+            return
+
+    if file_path.lower().endswith('.pdf'):
+        spans = _count_spans(_iter_pdf_spans(file_path, progress_callback, extract_processes, extraction_cache,
+                                             classifier), "pdf")
+    else:
+        spans = _count_spans(_iter_docx_spans(file_path, progress_callback, classifier), "docx")
+    items = []
+    for item in _assemble_items(spans, page_breaks=file_path.lower().endswith('.pdf')):
+        if file_hash is not None:
+            items.append(item)
+        yield item
+    # 只有完整解析完的文档才写入缓存，中途取消时不会留下不完整的条目
+    if file_hash is not None:
+        extraction_cache.put_document(file_hash, _parser_key(classifier), items)
+
+
+def iter_document_items(file_path, progress_callback=None, extract_processes=1, extraction_cache=None,
+                        font_classifier=None):
+    """逐页/逐段解析文档，边解析边生成 (标题, 咒语文本)
+
+    progress_callback(current, total) 报告已解析的页数 (PDF) 或已读取的字节数 (Word)。
+    extract_processes > 1 时PDF按页段分给多个进程并行解析，结果顺序不变。
+    extraction_cache 为 ExtractionCache 时复用之前的解析结果，只解析变化的部分。
+    font_classifier 为 FontClassifier，默认使用 DEFAULT_FONT_CLASSIFIER。
+    """
+    if not file_path.lower().endswith(('.pdf', '.docx')):
+        error_msg = "不支持的文件类型，请提供 .docx 或 .pdf 文件"
+        logging.error(error_msg)
+        raise ValueError(error_msg)
+    items = _iter_extracted_items(file_path, progress_callback, extract_processes, extraction_cache,
+                                  font_classifier or DEFAULT_FONT_CLASSIFIER)
+    return ((title, text) for title, text, _, _ in items)
+
+
+_END_OF_ITEMS = object()
+
+
+class ConversionCancelled(Exception):
+    """转换被用户取消；audio_paths 为取消前已生成的音频"""
+
+    def __init__(self, audio_paths):
+        super().__init__("转换已取消")
+        self.audio_paths = audio_paths
+
+
+def _produce_items(items, item_queue, stop_event, errors):
+    """解析线程：把解析结果放入有界队列，队列满时阻塞等待合成消费"""
+    try:
+        for item in items:
+            while not stop_event.is_set():
+                try:
+                    item_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop_event.is_set():
+                return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        item_queue.put(_END_OF_ITEMS)
+
+
+def _staged_progress_callback(callback):
+    """把进度回调统一为 (current, total, stage)；只接受 (current, total) 的旧回调包装后忽略 stage"""
+    if callback is None:
+        return None
+    try:
+        inspect.signature(callback).bind(0, 0, "synthesize")
+    except TypeError:
+        return lambda current, total, stage: callback(current, total)
+    except ValueError:  # 取不到签名的内置函数等，按新接口调用
+        pass
+    return callback
+
+
+def batch_text_to_speech(file_path, folder_path, progress_callback=None, max_workers=DEFAULT_MAX_WORKERS,
+                         cache=None, queue_size=DEFAULT_QUEUE_SIZE, extract_processes=1, lang='ro', backend=None,
+                         limiter=None, cancel_event=None, pause_event=None, extraction_cache=None,
+                         font_classifier=None, chunk_cache=None, album=False, album_gap=0.0, album_max_bytes=None,
+                         postprocessor=None):
+    """批量转换Word和PDF文件中的纯梵文段落为音频
+
+    解析与合成以流水线方式进行：后台线程逐页解析文档，把 (标题, 咒语) 放入
+    长度为 queue_size 的有界队列，合成线程池同时消费，首个音频无需等待整篇文档解析完。
+    max_workers 控制同时进行的合成请求数；结果按文档顺序收集，
+    因此输出文件、audio_record.txt 和进度回调的顺序与串行模式一致。
+    cache 为 AudioCache 时，已合成过的咒语直接从缓存取出；chunk_cache 为 ChunkCache 时
+    长咒语中已合成过的短语也直接取用，只合成其余部分。
+    extract_processes > 1 时大型PDF用多进程解析；extraction_cache 为 ExtractionCache 时
+    文件未变化则跳过解析，PDF 只修改了部分页时只重新解析这些页。
+    font_classifier 为区分标题和咒语字体的 FontClassifier，默认为 YaHei 标题、Arial/Times 咒语。
+    backend 为 TTSBackend，默认使用进程内共享的 gTTS 后端，连接池按 max_workers 扩大。
+    limiter 为所有合成线程共享的 RateLimiter，默认每次运行新建一个 (并发上限 max_workers)。
+    progress_callback(current, total, stage) 中 stage 为 "extract" (PDF为已解析页数，Word为已读取的字节数)
+    或 "synthesize" (已完成/已解析出的咒语数)，总是在调用线程中回调；
+    只接受 (current, total) 两个参数的旧回调照常调用，不传 stage。
+    pause_event 置位时暂停提交新的合成任务；cancel_event 置位时放弃尚未开始的任务，
+    等在途任务结束后抛出 ConversionCancelled，清单已记录的条目下次运行时跳过。
+    album 为 True 时另外把所有咒语按文档顺序拼接成 "<输出目录>/<文件名>.mp3" 专辑 (见 AlbumWriter)，
+    段间插入 album_gap 秒静音，album_max_bytes 为每卷的大小上限。
+    postprocessor 为 AudioPostProcessor 时，全部合成完后把处理过的音频写入 "processed" 子目录
+    (原始音频保留，供断点续传校验)，进度的 stage 为 "postprocess"；专辑改用处理过的音频。
+    """
+    progress_callback = _staged_progress_callback(progress_callback)
+    input_filename = os.path.splitext(os.path.basename(file_path))[0]
+    album_writer = (AlbumWriter(os.path.join(folder_path, input_filename), gap=album_gap, max_bytes=album_max_bytes)
+                    if album else None)
+    folder_path = os.path.join(folder_path, input_filename)
+
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    try:
+        extract_events = queue.SimpleQueue()
+        items = iter_document_items(file_path, lambda current, total: extract_events.put((current, total)),
+                                    extract_processes=extract_processes, extraction_cache=extraction_cache,
+                                    font_classifier=font_classifier)
+
+        audio_paths = []
+        record_path = os.path.join(folder_path, "audio_record.txt")
+        worker_count = max(1, int(max_workers))
+        logging.info(f"合成并发数: {worker_count}")
+        backend = backend or get_default_backend()
+        backend.ensure_pool_size(worker_count)
+        limiter = limiter or RateLimiter(max_concurrency=worker_count)
+
+        item_queue = queue.Queue(maxsize=max(1, queue_size))
+        stop_event = threading.Event()
+        extract_errors = []
+        producer = threading.Thread(target=_produce_items, name="document-extractor",
+                                    args=(items, item_queue, stop_event, extract_errors), daemon=True)
+
+        manifest = BatchManifest(folder_path)
+        inflight = collections.deque()
+        used_names = set()
+        item_count = 0
+        job_count = 0
+        current_progress = 0
+
+        def report_extract_progress():
+            while not extract_events.empty():
+                current, total = extract_events.get()
+                if progress_callback:
+                    progress_callback(current, total, "extract")
+
+        album_items = []
+
+        def add_to_album(title, audio_path):
+            if album_writer is None:
+                return
+            if postprocessor is not None:
+                # 专辑要用处理过的音频，等后处理完成后再拼接
+                album_items.append((title, audio_path))
+                return
+            with open(audio_path, "rb") as f:
+                album_writer.add(title, f.read())
+
+        def finish_job(job, future, record_file):
+            nonlocal current_progress
+            item_id, title, text, audio_name, audio_path = job
+            if future is not None and future.cancelled():
+                return
+            record_file.write(f"音频文件: {audio_name}.mp3\n标题: {title}\n内容: {text}\n{'='*50}\n")
+            record_file.flush()
+
+            if future is None:
+                logging.debug("已完成，跳过: %s.mp3", audio_name)
+                metrics.inc("items_total", status="skipped")
+                audio_paths.append(audio_path)
+                add_to_album(title, audio_path)
+            else:
+                started_at = time.time()
+                try:
+                    started_at, finished_at = future.result()
+                    file_size = os.path.getsize(audio_path)
+                    manifest.record(item_id, title, f"{audio_name}.mp3", text, lang, 'done',
+                                    file_size, started_at, finished_at)
+                    audio_paths.append(audio_path)
+                    add_to_album(title, audio_path)
+                    metrics.inc("items_total", status="done")
+                    logging.debug("成功转换: %s.mp3 (大小: %d 字节)", audio_name, file_size)
+
+                except Exception as e:
+                    metrics.inc("items_total", status="failed")
+                    logging.error(f"转换失败 '{title}': {str(e)}")
+                    logging.error(f"错误详情: {e.__class__.__name__}")
+                    manifest.record(item_id, title, f"{audio_name}.mp3", text, lang, 'failed',
+                                    0, started_at, time.time(), error=str(e))
+
+            current_progress += 1
+            if progress_callback:
+                progress_callback(current_progress, job_count, "synthesize")
+
+        def finish_ready(record_file, limit):
+            """按文档顺序收尾已完成的任务；队头未完成且在途任务超过 limit 时等待队头"""
+            while inflight:
+                job, future = inflight[0]
+                if future is not None and not future.done():
+                    if len(inflight) <= limit:
+                        return
+                    wait([future], timeout=0.1)
+                    report_extract_progress()
+                    continue
+                inflight.popleft()
+                finish_job(job, future, record_file)
+
+        try:
+            with open(record_path, "w", encoding='utf-8') as record_file, \
+                    ThreadPoolExecutor(max_workers=worker_count) as executor:
+                producer.start()
+                while True:
+                    report_extract_progress()
+                    if cancel_event is not None and cancel_event.is_set():
+                        logging.info("转换已取消，等待在途任务结束")
+                        break
+                    if pause_event is not None and pause_event.is_set():
+                        finish_ready(record_file, worker_count * 2)
+                        time.sleep(0.1)
+                        continue
+                    try:
+                        item = item_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        finish_ready(record_file, worker_count * 2)
+                        continue
+                    if item is _END_OF_ITEMS:
+                        break
+
+                    title, text = item
+                    index = item_count
+                    item_count += 1
+                    if not text.strip():
+                        logging.warning(f"跳过空文本，标题: {title}")
+                        continue
+                    audio_name = _unique_audio_name(_sanitize_audio_name(title), used_names)
+                    audio_path = os.path.join(folder_path, f"{audio_name}.mp3")
+                    job = (f"{index:05d}", title, text, audio_name, audio_path)
+                    job_count += 1
+
+                    if manifest.is_done(job[0], text, audio_path, lang):
+                        future = None
+                    else:
+                        future = executor.submit(_convert_item, text, audio_path, lang, cache, backend, limiter,
+                                                 chunk_cache)
+                    inflight.append((job, future))
+                    # 在途任务数有上限，避免解析远快于合成时结果堆积在内存中
+                    finish_ready(record_file, worker_count * 2)
+
+                if cancel_event is not None and cancel_event.is_set():
+                    for _, future in inflight:
+                        if future is not None:
+                            future.cancel()
+                report_extract_progress()
+                finish_ready(record_file, 0)
+        except BaseException:
+            if album_writer is not None:
+                album_writer.abort()
+            raise
+        finally:
+            stop_event.set()
+            manifest.close()
+
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        if postprocessor is not None and audio_paths and not cancelled and not extract_errors:
+            processed_dir = os.path.join(folder_path, "processed")
+            processed = postprocessor.process_files(
+                [(path, os.path.join(processed_dir, os.path.basename(path))) for path in audio_paths],
+                lambda current, total: progress_callback(current, total, "postprocess") if progress_callback else None)
+            logging.info(f"后处理完成 {len(processed)}/{len(audio_paths)} 段: {processed_dir}")
+            for title, audio_path in album_items:
+                with open(processed.get(audio_path, audio_path), "rb") as f:
+                    album_writer.add(title, f.read())
+        if album_writer is not None:
+            # 取消时也写出已完成的部分，下次运行会重新生成完整的专辑
+            if extract_errors:
+                album_writer.abort()
+            else:
+                album_writer.close()
+        if cancelled:
+            raise ConversionCancelled(audio_paths)
+        if extract_errors:
+            raise extract_errors[0]
+
+        logging.info(f"共处理 {job_count} 段咒语，成功 {len(audio_paths)} 段")
+        logging.info(f"限流统计: {limiter.stats()}")
+        if cache is not None:
+            logging.info(f"音频缓存统计: {cache.stats()}")
+        if chunk_cache is not None:
+            logging.info(f"分段缓存统计: {chunk_cache.stats()}")
+        if extraction_cache is not None:
+            logging.info(f"解析缓存统计: {extraction_cache.stats()}")
+        return audio_paths
+
+    except ConversionCancelled:
+        raise
+    except Exception as e:
+        logging.error(f"处理文件时发生错误: {str(e)}")
+        raise
+
+
+def _sanitize_audio_name(title):
+    """标题中的路径分隔符替换为 "-"，用作音频文件名"""
+    return title.replace("/", "-").replace("\\", "-")
+
+
+def _unique_audio_name(audio_name, used_names):
+    """同名标题依次加上 (2)、(3) 后缀，避免后一段咒语覆盖前一段的音频"""
+    candidate = audio_name
+    suffix = 2
+    while candidate in used_names:
+        candidate = f"{audio_name} ({suffix})"
+        suffix += 1
+    used_names.add(candidate)
+    return candidate
+
+
+def _convert_item(text, audio_path, lang, cache=None, backend=None, limiter=None, chunk_cache=None):
+    """在工作线程中转换单段咒语，返回 (开始时间, 结束时间)"""
+    started_at = time.time()
+    logging.debug("开始转换音频: %s (%d 字符)", os.path.basename(audio_path), len(text))
+    convert_to_audio(text, audio_path, lang=lang, cache=cache, backend=backend, limiter=limiter,
+                     chunk_cache=chunk_cache)
+    return started_at, time.time()
+
+
+class ThrottledError(Exception):
+    """合成服务限流 (HTTP 429/503)，retry_after 为服务端建议的等待秒数"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value):
+    """解析 Retry-After 头：秒数或 HTTP 日期"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt, base_delay, retry_after=None, max_delay=60.0):
+    """带随机抖动的指数退避；服务端给出 Retry-After 时不早于该时间"""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    delay = random.uniform(delay / 2, delay)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+# 未指定 rate 时限流器根据限流自行确定速率：统计成功请求速率的时间窗口 (秒)、
+# 被限流时速率降为观测值的比例和速率下限 (每秒请求数)
+RATE_OBSERVE_WINDOW = 5.0
+ADAPTIVE_RATE_BACKOFF = 0.9
+ADAPTIVE_MIN_RATE = 0.5
+# 遵守 Retry-After 的限流重试不计入失败次数和重试预算，但每段文本最多重试这么多次
+MAX_THROTTLE_RETRIES = 10
+
+
+class RateLimiter:
+    """多个合成线程共享的限流器
+
+    - 令牌桶：rate 为每秒请求数上限，burst 为桶容量；
+    - AIMD 并发窗口：成功时缓慢增加，被限流时减半，在 min_concurrency 与 max_concurrency 之间；
+      令牌速率同样加性恢复、乘性回退。rate 为 None 时起初不限速，第一次被限流后以最近
+      RATE_OBSERVE_WINDOW 秒内的成功速率 (即服务端实际放行的速率) 的 90% 为起点，
+      之后每秒约加 0.5，再被限流时重新按观测值回退；低延迟时仅靠缩小并发窗口无法把每秒请求数
+      压到服务端的限额以下；
+    - 重试预算：每次成功存入 retry_ratio 个重试额度，初始 min_retries 个 (默认为并发上限的两倍，
+      足以覆盖一整轮在途请求同时失败)，耗尽后不再重试；
+    - 熔断：连续 failure_threshold 次失败时暂停所有线程 (有 Retry-After 时按其暂停)，冷却后放行一个探测请求，
+      探测成功恢复，失败则冷却时间加倍 (不超过 max_cooldown)。单次限流的 Retry-After 只决定该请求的
+      重试等待 (见 _backoff_delay)，由 AIMD 窗口减半来降速，不会暂停其他线程。
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_WORKERS, rate=None, burst=None, min_concurrency=1,
+                 retry_ratio=0.2, min_retries=None, failure_threshold=5, cooldown=5.0, max_cooldown=120.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency = float(self.max_concurrency)
+        self.max_rate = rate
+        self.rate = rate
+        self.adaptive = rate is None
+        self.burst = burst or self.max_concurrency
+        self.retry_ratio = retry_ratio
+        if min_retries is None:
+            min_retries = max(10, 2 * self.max_concurrency)
+        self.max_retry_tokens = min_retries * 10
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._retry_tokens = float(min_retries)
+        self._consecutive_failures = 0
+        self._cooldown = cooldown
+        self._open_until = 0.0
+        self._half_open = False
+        self._last_decrease = 0.0
+        self._successes = collections.deque()
+        self.counters = collections.Counter()
+
+    def _refill(self, now):
+        if self.rate:
+            # 自适应速率时桶容量不超过一秒的量，空闲后不会突发超过服务端限额
+            capacity = max(1.0, min(self.burst, self.rate)) if self.adaptive else self.burst
+            self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _observed_rate(self, now):
+        """最近 RATE_OBSERVE_WINDOW 秒内的成功请求速率；不足一秒的样本按一秒计"""
+        while self._successes and self._successes[0] < now - RATE_OBSERVE_WINDOW:
+            self._successes.popleft()
+        if not self._successes:
+            return None
+        return len(self._successes) / max(1.0, now - self._successes[0])
+
+    def _decrease_rate(self, now):
+        if not self.adaptive:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            return
+        observed = self._observed_rate(now)
+        target = observed if observed else (self.rate or self.max_concurrency) / 2
+        if self.rate is None:
+            self._refill(now)
+            self._tokens = 0.0
+        self.rate = max(ADAPTIVE_MIN_RATE, min(target, self.rate or target) * ADAPTIVE_RATE_BACKOFF)
+
+    def _wait_time(self, now):
+        """当前不能发出请求时返回需要等待的秒数 (None 表示等待其他请求结束)，可以发出时返回 0"""
+        if now < self._open_until:
+            return self._open_until - now
+        if self._half_open and self._in_flight > 0:
+            return None  # 熔断半开：只放行一个探测请求
+        if self._in_flight >= max(self.min_concurrency, int(self.concurrency)):
+            return None
+        if self.rate:
+            self._refill(now)
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+        return 0
+
+    def acquire(self):
+        """阻塞直到允许发出一个请求，返回取得许可的时刻"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait_time = self._wait_time(now)
+                if wait_time == 0:
+                    break
+                self.counters['waits'] += 1
+                self._cond.wait(timeout=1.0 if wait_time is None else min(wait_time, 1.0))
+            if self.rate:
+                self._tokens -= 1
+            self._in_flight += 1
+            return now
+
+    def release(self, outcome, acquired_at, retry_after=None):
+        """请求结束：outcome 为 'success'、'throttle' 或 'failure'"""
+        with self._cond:
+            self._in_flight -= 1
+            self.counters[outcome] += 1
+            now = time.monotonic()
+            if outcome == 'success':
+                self._consecutive_failures = 0
+                if self._half_open:
+                    self._half_open = False
+                    self._cooldown = self.base_cooldown
+                    logging.info("合成服务恢复，熔断关闭")
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self._successes.append(now)
+                if self.adaptive and self.rate:
+                    self.rate += 0.5 / self.rate
+                elif self.rate:
+                    self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+                self._retry_tokens = min(self.max_retry_tokens, self._retry_tokens + self.retry_ratio)
+            else:
+                self._consecutive_failures += 1
+                # 同一轮在途请求同时被限流时只回退一次
+                if outcome == 'throttle' and acquired_at >= self._last_decrease:
+                    self._last_decrease = now
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self._decrease_rate(now)
+                    logging.warning(f"合成服务限流，并发窗口降为 {self.concurrency:.1f}，速率降为 {self.rate:.1f}/秒")
+                if self._half_open or self._consecutive_failures >= self.failure_threshold:
+                    self._trip(now, retry_after)
+            self._cond.notify_all()
+
+    def _trip(self, now, retry_after=None):
+        """打开熔断：所有线程暂停到冷却结束"""
+        pause = self._cooldown if retry_after is None else max(retry_after, 0.1)
+        if self._half_open:
+            self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+        self._open_until = max(self._open_until, now + pause)
+        self._half_open = True
+        self.counters['trips'] += 1
+        logging.warning(f"合成服务不可用，暂停所有合成 {pause:.1f} 秒")
+
+    @contextlib.contextmanager
+    def slot(self):
+        """取得一个请求许可，并按请求结果调整限流状态"""
+        acquired_at = self.acquire()
+        try:
+            yield
+        except ThrottledError as e:
+            self.release('throttle', acquired_at, e.retry_after)
+            raise
+        except Exception:
+            self.release('failure', acquired_at)
+            raise
+        self.release('success', acquired_at)
+
+    def take_retry(self):
+        """从重试预算中取出一次重试，预算耗尽时返回 False"""
+        with self._cond:
+            if self._retry_tokens >= 1:
+                self._retry_tokens -= 1
+                self.counters['retries'] += 1
+                return True
+            self.counters['retries_denied'] += 1
+            return False
+
+    def stats(self):
+        """返回限流统计信息"""
+        with self._cond:
+            return dict(self.counters, concurrency=round(self.concurrency, 2),
+                        rate=round(self.rate, 2) if self.rate else None,
+                        retry_tokens=round(self._retry_tokens, 2))
+
+
+# 长咒语切分后每段的最大字符数，与 gTTS 单次请求的上限一致
+CHUNK_MAX_CHARS = 100
+# 单段长咒语并行合成的最大分段请求数 (总并发仍受 RateLimiter 约束)
+DEFAULT_CHUNK_WORKERS = 8
+# 可以安全断开的标点：梵文的 danda、西文和中文的句读
+_CHUNK_PUNCTUATION = re.compile(r"(?<=[।॥|.,;:!?、，。；：！？])\s*")
+# 咒语中穿插的诗节编号 (独立的数字)，按短语切分时去掉，否则同一短语会因编号不同而得到不同的分段
+_VERSE_NUMBER = re.compile(r"(?<!\S)\d+(?!\S)")
+# 常见的咒语起首词和结尾词 (去掉变音符号后比较)：起首词之前、结尾词之后断开，
+# 使 "tadyathā …"、"oṃ … svāhā" 这类套语在不同咒语中切出相同的分段
+_PHRASE_OPENERS = frozenset({"tadyatha", "om", "namo", "namah", "namas"})
+_PHRASE_CLOSERS = frozenset({"svaha", "hum", "phat"})
+
+
+def _fold_word(word):
+    """去掉变音符号、标点并转为小写，用于匹配起首词和结尾词"""
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in decomposed if c.isalnum() and not unicodedata.combining(c))
+
+
+def _split_stock_phrases(words):
+    """在起首词之前、结尾词之后把词序列断开"""
+    phrase = []
+    for word in words:
+        folded = _fold_word(word)
+        if folded in _PHRASE_OPENERS and phrase:
+            yield phrase
+            phrase = []
+        phrase.append(word)
+        if folded in _PHRASE_CLOSERS:
+            yield phrase
+            phrase = []
+    if phrase:
+        yield phrase
+
+
+def _pack_pieces(pieces, max_chars):
+    """把相邻的片段合并成不超过 max_chars 的分段"""
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_text_chunks(text, max_chars=CHUNK_MAX_CHARS, pack=True):
+    """把长文本切成不超过 max_chars 的分段，用于并行合成
+
+    优先在标点后断开，其次在空白处断开，不会把一个词切开 (超长的单词单独成段)。
+    pack 为 True 时相邻的短句合并，尽量减少分段数；为 False 时按短语切分 (供分段缓存使用)：
+    先去掉诗节编号，再在标点、咒语起首词之前和结尾词之后断开，每个短语单独成段，
+    分段边界只取决于短语本身，不同咒语中的相同短语得到相同的分段。
+    """
+    if not pack:
+        text = _VERSE_NUMBER.sub(" ", text)
+    text = " ".join(text.split())
+    if len(text) <= max_chars and pack:
+        return [text] if text else []
+    pieces = []
+    chunks = []
+    for phrase in _CHUNK_PUNCTUATION.split(text):
+        if pack:
+            pieces.extend([phrase] if len(phrase) <= max_chars else phrase.split(" "))
+        else:
+            for words in _split_stock_phrases(phrase.split()):
+                chunks.extend(_pack_pieces(words, max_chars))
+    return _pack_pieces(pieces, max_chars) if pack else chunks
+
+
+# MPEG 音频帧头的码率 (kbps) 和采样率 (Hz) 表，按 [MPEG-1, MPEG-2/2.5] 区分
+_MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _mp3_frame_length(header):
+    """解析4字节帧头，返回帧长度；不是有效帧头时返回 None"""
+    info = _mp3_frame_info(header)
+    return info[0] if info else None
+
+
+def _mp3_frame_info(header):
+    """解析4字节帧头，返回 (帧长度, 采样率, 每帧采样数)；不是有效帧头时返回 None"""
+    if header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x03   # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    layer = 4 - ((header[1] >> 1) & 0x03)    # 1, 2, 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES[(1 if version_bits == 3 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, sample_rate, 384
+    if layer == 3 and version_bits != 3:
+        return 72 * bitrate // sample_rate + padding, sample_rate, 576
+    return 144 * bitrate // sample_rate + padding, sample_rate, 1152
+
+
+def _is_vbr_info_frame(frame):
+    """LAME/Xing 的 Xing/Info 帧或 Fraunhofer 的 VBRI 帧：只含整段文件的元数据，拼接后会误导播放器"""
+    return any(tag in frame[4:40] for tag in (b"Xing", b"Info")) or frame[36:40] == b"VBRI"
+
+
+def iter_mp3_frames(data):
+    """生成 MP3 数据中的音频帧 (bytes)
+
+    跳过开头的 ID3v2 标签、结尾的 ID3v1 标签、Xing/Info/VBRI 元数据帧和帧之间的无效字节，
+    只按帧头计算长度，不解码音频。
+    """
+    start = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    position = start
+    first = True
+    while position + 4 <= end:
+        length = _mp3_frame_length(data[position:position + 4])
+        if length is None or position + length > end:
+            # 帧同步丢失：向后寻找下一个帧头
+            position = data.find(b"\xff", position + 1, end)
+            if position < 0:
+                break
+            continue
+        frame = data[position:position + length]
+        if not (first and _is_vbr_info_frame(frame)):
+            yield frame
+        first = False
+        position += length
+
+
+def concat_mp3(segments):
+    """在帧级别拼接多段 MP3：去掉各段的标签和元数据帧后直接连接，不重新编码
+
+    某段解析不出任何帧时原样保留该段 (去掉标签)，以免丢失音频。
+    """
+    output = bytearray()
+    for segment in segments:
+        frames = list(iter_mp3_frames(segment))
+        if frames:
+            output += b"".join(frames)
+        else:
+            output += segment
+    return bytes(output)
+
+
+def _silent_mp3_frame(header):
+    """与 header 同格式的静音帧：去掉 CRC 和填充位，边信息和主数据全为零，解码器输出全零采样"""
+    header = bytearray(header[:4])
+    header[1] |= 0x01
+    header[2] &= 0xFD
+    length, sample_rate, samples = _mp3_frame_info(header)
+    return bytes(header) + bytes(length - 4), samples / sample_rate
+
+
+def _id3_frame(frame_id, payload):
+    """ID3v2.3 帧：帧 ID、4字节长度 (非同步安全整数)、2字节标志和内容"""
+    return frame_id.encode("ascii") + len(payload).to_bytes(4, "big") + b"\x00\x00" + payload
+
+
+def _id3_text_frame(frame_id, text):
+    """ID3v2.3 文本帧；v2.3 不支持 UTF-8，统一用带 BOM 的 UTF-16"""
+    return _id3_frame(frame_id, b"\x01" + text.encode("utf-16") + b"\x00\x00")
+
+
+def _id3_tag(frames):
+    """组装 ID3v2.3 标签 (标签长度为同步安全整数)"""
+    body = b"".join(frames)
+    size = len(body)
+    return b"ID3\x03\x00\x00" + bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0)) + body
+
+
+# CTOC 帧的子元素数量只占1字节
+ID3_CTOC_MAX_ENTRIES = 255
+
+
+def _id3_chapter_frames(chapters, title, byte_shift=0):
+    """按 ID3v2 章节规范生成 CHAP 帧和 CTOC 目录帧
+
+    chapters 为 (标题, 开始秒, 结束秒, 开始字节, 结束字节)，字节偏移相对音频数据起点，加上 byte_shift
+    (标签长度) 后为文件内的偏移。章节超过 255 个时顶层目录下再分若干子目录。
+    """
+    frames = []
+    chapter_ids = []
+    for index, (chapter_title, start, end, start_byte, end_byte) in enumerate(chapters):
+        element_id = f"chp{index}".encode("ascii")
+        chapter_ids.append(element_id)
+        frames.append(_id3_frame("CHAP", element_id + b"\x00" + b"".join(
+            value.to_bytes(4, "big") for value in (round(start * 1000), round(end * 1000),
+                                                    start_byte + byte_shift, end_byte + byte_shift))
+            + _id3_text_frame("TIT2", chapter_title)))
+
+    def toc_frame(element_id, children, flags, toc_title=None):
+        payload = element_id + b"\x00" + bytes((flags, len(children))) + b"".join(child + b"\x00" for child in children)
+        return _id3_frame("CTOC", payload + (_id3_text_frame("TIT2", toc_title) if toc_title else b""))
+
+    # 标志位 0x01 表示子元素有序，0x02 表示顶层目录
+    if len(chapter_ids) <= ID3_CTOC_MAX_ENTRIES:
+        frames.insert(0, toc_frame(b"toc", chapter_ids, 0x03, title))
+        return frames
+    groups = [chapter_ids[i:i + ID3_CTOC_MAX_ENTRIES] for i in range(0, len(chapter_ids), ID3_CTOC_MAX_ENTRIES)]
+    group_ids = [f"toc{number}".encode("ascii") for number in range(1, len(groups) + 1)]
+    tocs = [toc_frame(b"toc", group_ids, 0x03, title)]
+    for group_id, group in zip(group_ids, groups):
+        tocs.append(toc_frame(group_id, group, 0x01))
+    return tocs + frames
+
+
+def _cue_time(seconds):
+    """CUE 时间 mm:ss:ff (每秒 75 帧)"""
+    frames = round(seconds * 75)
+    return f"{frames // 4500:02d}:{frames // 75 % 60:02d}:{frames % 75:02d}"
+
+
+def _cue_quote(text):
+    return '"' + text.replace('"', "'").replace("\n", " ") + '"'
+
+
+class AlbumWriter:
+    """把各段 MP3 按顺序在帧级别追加到一个专辑文件 (或按大小分卷的多个文件)，不重新编码
+
+    add() 每次追加一段，帧先写入临时文件，不在内存中累积整张专辑；段之间可插入 gap 秒静音
+    (用同格式的静音帧生成)。max_bytes 为每卷的大小上限，超出时从下一段开始新的一卷，
+    此时文件名为 "<base_path>_01.mp3"、"<base_path>_02.mp3"……，否则为 "<base_path>.mp3"。
+    close() 为每卷写入带 CHAP/CTOC 章节的 ID3v2.3 标签，并生成 "<base_path>.cue" (含每段的时间和字节偏移)
+    和 "<base_path>.m3u8" (VLC 可按 start-time/stop-time 直接跳到每段)。
+    """
+
+    def __init__(self, base_path, title=None, gap=0.0, max_bytes=None):
+        self.base_path = base_path
+        self.title = title or os.path.basename(base_path)
+        self.gap = max(0.0, float(gap or 0.0))
+        self.max_bytes = max_bytes
+        self.volumes = []
+        self._file = None
+        self._part_path = None
+        self._chapters = []
+        self._bytes = 0
+        self._seconds = 0.0
+        self._silence = {}
+
+    def _volume_path(self, number):
+        if self.max_bytes:
+            return f"{self.base_path}_{number:02d}.mp3"
+        return f"{self.base_path}.mp3"
+
+    def _gap_frames(self, frame):
+        """gap 秒静音对应的静音帧 (按首帧的格式)，返回 (帧数据, 时长)"""
+        key = bytes(frame[1:4])
+        if key not in self._silence:
+            silent_frame, frame_seconds = _silent_mp3_frame(frame)
+            count = round(self.gap / frame_seconds)
+            self._silence[key] = (silent_frame * count, count * frame_seconds)
+        return self._silence[key]
+
+    def add(self, title, data):
+        """追加一段 MP3 (bytes)，title 为其章节标题"""
+        frames = list(iter_mp3_frames(data))
+        if not frames:
+            logging.warning(f"专辑中跳过无法解析的音频: {title}")
+            return
+        size = sum(len(frame) for frame in frames)
+        seconds = 0.0
+        for frame in frames:
+            _, sample_rate, samples = _mp3_frame_info(frame)
+            seconds += samples / sample_rate
+        gap, gap_seconds = self._gap_frames(frames[0]) if self.gap else (b"", 0.0)
+
+        if self._file is not None and self.max_bytes and self._bytes + len(gap) + size > self.max_bytes:
+            self._finish_volume()
+        if self._file is None:
+            self._part_path = _temp_path(f"{self._volume_path(len(self.volumes) + 1)}.frames")
+            self._file = open(self._part_path, "wb")
+        elif gap:
+            self._file.write(gap)
+            self._bytes += len(gap)
+            self._seconds += gap_seconds
+
+        for frame in frames:
+            self._file.write(frame)
+        self._chapters.append((title, self._seconds, self._seconds + seconds, self._bytes, self._bytes + size))
+        self._bytes += size
+        self._seconds += seconds
+
+    def _finish_volume(self):
+        """为当前卷写入章节标签并原子地替换成最终文件"""
+        self._file.close()
+        self._file = None
+        number = len(self.volumes) + 1
+        path = self._volume_path(number)
+        title = f"{self.title} ({number})" if self.max_bytes else self.title
+        tag_frames = [_id3_text_frame("TIT2", title), _id3_text_frame("TALB", self.title)]
+        # 章节的字节偏移以文件开头为准，标签长度与偏移的取值无关，先算出长度再生成一次
+        tag_size = len(_id3_tag(tag_frames + _id3_chapter_frames(self._chapters, title)))
+        tag = _id3_tag(tag_frames + _id3_chapter_frames(self._chapters, title, byte_shift=tag_size))
+        tmp_path = _temp_path(path)
+        try:
+            with open(tmp_path, "wb") as output, open(self._part_path, "rb") as frames:
+                output.write(tag)
+                shutil.copyfileobj(frames, output, 1024 * 1024)
+            os.replace(tmp_path, path)
+        finally:
+            for leftover in (tmp_path, self._part_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        metrics.inc("bytes_written_total", len(tag) + self._bytes, target="album")
+        self.volumes.append({"path": path, "chapters": [(chapter_title, start, end, start_byte + tag_size,
+                                                         end_byte + tag_size)
+                                                        for chapter_title, start, end, start_byte, end_byte
+                                                        in self._chapters],
+                             "seconds": self._seconds, "bytes": len(tag) + self._bytes})
+        logging.info(f"专辑文件: {path} ({len(self._chapters)} 段, {self._seconds:.1f} 秒, "
+                     f"{len(tag) + self._bytes} 字节)")
+        self._chapters = []
+        self._bytes = 0
+        self._seconds = 0.0
+
+    def _write_index(self):
+        """写入 .cue 和 .m3u8 索引，返回其路径"""
+        cue_lines = [f"TITLE {_cue_quote(self.title)}"]
+        playlist_lines = ["#EXTM3U", f"#PLAYLIST:{self.title}"]
+        track = 0
+        for volume in self.volumes:
+            name = os.path.basename(volume["path"])
+            cue_lines.append(f"FILE {_cue_quote(name)} MP3")
+            for chapter_title, start, end, start_byte, end_byte in volume["chapters"]:
+                track += 1
+                cue_lines += [f"  TRACK {track:02d} AUDIO", f"    TITLE {_cue_quote(chapter_title)}",
+                              f"    REM BYTES {start_byte}-{end_byte}", f"    INDEX 01 {_cue_time(start)}"]
+                playlist_lines += [f"#EXTINF:{round(end - start)},{chapter_title}",
+                                   f"#EXTVLCOPT:start-time={start:.3f}", f"#EXTVLCOPT:stop-time={end:.3f}", name]
+        paths = []
+        for suffix, lines in ((".cue", cue_lines), (".m3u8", playlist_lines)):
+            path = self.base_path + suffix
+            tmp_path = _temp_path(path)
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            paths.append(path)
+        return paths
+
+    def close(self):
+        """完成最后一卷并写入索引，返回所有分卷的路径"""
+        if self._file is not None:
+            self._finish_volume()
+        if self.volumes:
+            self._write_index()
+        return [volume["path"] for volume in self.volumes]
+
+    def abort(self):
+        """放弃尚未完成的一卷 (已完成的分卷保留)"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self._part_path):
+                os.remove(self._part_path)
+
+
+# 代理池：连续失败多少次后暂停使用、暂停多久后重新检查 (秒)、健康检查的超时和地址
+PROXY_MAX_FAILURES = 2
+PROXY_COOLDOWN = 30.0
+PROXY_CHECK_TIMEOUT = 5.0
+DEFAULT_PROXY_CHECK_URL = "https://translate.google.com/"
+
+
+class ProxyPool:
+    """多个出口代理轮流使用，分散单个 IP 的限流
+
+    每次请求按轮询取一个可用代理。连续失败 max_failures 次的代理暂停使用，由后台线程每隔 cooldown 秒
+    经该代理访问 check_url 检查，恢复后重新加入轮询；被限流 (429/503) 的代理按 Retry-After 暂停，不需要检查。
+    所有代理都不可用时仍返回最早恢复的一个，而不是让合成停下来。
+    """
+
+    def __init__(self, proxies, check_url=DEFAULT_PROXY_CHECK_URL, max_failures=PROXY_MAX_FAILURES,
+                 cooldown=PROXY_COOLDOWN, check_timeout=PROXY_CHECK_TIMEOUT):
+        if not proxies:
+            raise ValueError("代理池至少需要一个代理")
+        self.proxies = list(dict.fromkeys(proxies))
+        self.check_url = check_url
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.check_timeout = check_timeout
+        self._state = {proxy: {'requests': 0, 'failures': 0, 'throttled': 0, 'consecutive_failures': 0,
+                               'available_at': 0.0, 'needs_check': False} for proxy in self.proxies}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._checker = None
+
+    def acquire(self):
+        """取下一个可用代理"""
+        with self._lock:
+            now = time.monotonic()
+            for offset in range(len(self.proxies)):
+                proxy = self.proxies[(self._next + offset) % len(self.proxies)]
+                state = self._state[proxy]
+                if not state['needs_check'] and state['available_at'] <= now:
+                    self._next = (self._next + offset + 1) % len(self.proxies)
+                    state['requests'] += 1
+                    return proxy
+            proxy = min(self.proxies, key=lambda item: self._state[item]['available_at'])
+            self._state[proxy]['requests'] += 1
+            return proxy
+
+    def has_available(self):
+        """当前是否有可用 (未暂停) 的代理"""
+        with self._lock:
+            now = time.monotonic()
+            return any(not state['needs_check'] and state['available_at'] <= now for state in self._state.values())
+
+    def report_success(self, proxy):
+        with self._lock:
+            self._state[proxy]['consecutive_failures'] = 0
+
+    def report_failure(self, proxy):
+        """连接失败：连续失败达到上限后暂停使用，交给后台线程检查"""
+        with self._lock:
+            state = self._state[proxy]
+            state['failures'] += 1
+            state['consecutive_failures'] += 1
+            if state['consecutive_failures'] < self.max_failures or state['needs_check']:
+                return
+            state['needs_check'] = True
+            state['available_at'] = time.monotonic() + self.cooldown
+            logging.warning(f"代理 {proxy} 连续失败 {state['consecutive_failures']} 次，暂停使用")
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_loop, name="proxy-check", daemon=True)
+                self._checker.start()
+
+    def report_throttled(self, proxy, retry_after=None):
+        """被限流：按 Retry-After (没有时按 cooldown) 暂停该代理"""
+        with self._lock:
+            state = self._state[proxy]
+            state['throttled'] += 1
+            state['available_at'] = max(state['available_at'],
+                                        time.monotonic() + (retry_after if retry_after is not None else self.cooldown))
+
+    def check(self, proxy):
+        """经代理访问 check_url；能收到 (非网关错误的) 响应即认为代理可用
+
+        保持默认的 TLS 证书校验：经第三方代理时最可能遭遇中间人，不能完成校验的代理视为不可用。
+        """
+        import requests
+        try:
+            response = requests.get(self.check_url, proxies={'http': proxy, 'https': proxy},
+                                    timeout=self.check_timeout)
+            return response.status_code not in (407, 502, 503, 504)
+        except requests.exceptions.RequestException:
+            return False
+
+    def _check_loop(self):
+        """后台检查暂停中的代理，直到没有需要检查的代理或代理池关闭"""
+        while not self._closed.is_set():
+            with self._lock:
+                now = time.monotonic()
+                due = [proxy for proxy, state in self._state.items()
+                       if state['needs_check'] and state['available_at'] <= now]
+                waiting = any(state['needs_check'] for state in self._state.values())
+                if not waiting:
+                    self._checker = None
+                    return
+            for proxy in due:
+                healthy = self.check(proxy)
+                with self._lock:
+                    state = self._state[proxy]
+                    if healthy:
+                        state.update(needs_check=False, consecutive_failures=0, available_at=0.0)
+                    else:
+                        state['available_at'] = time.monotonic() + self.cooldown
+                logging.info(f"代理 {proxy} 检查{'通过，恢复使用' if healthy else '未通过'}")
+            self._closed.wait(min(1.0, self.cooldown))
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {proxy: {'requests': state['requests'], 'failures': state['failures'],
+                            'throttled': state['throttled'],
+                            'available': not state['needs_check'] and state['available_at'] <= now}
+                    for proxy, state in self._state.items()}
+
+    def close(self):
+        self._closed.set()
+
+
+class TTSBackend:
+    """语音合成后端接口
+
+    子类实现 stream(text, lang)，按顺序生成 MP3 数据块；name 参与缓存键计算，
+    不同后端 (或指向不同服务器的同一后端) 的音频不会互相混用。
+    """
+
+    name = "base"
+
+    def stream(self, text, lang):
+        raise NotImplementedError
+
+    def synthesize(self, text, lang):
+        """合成整段文本，返回 MP3 字节"""
+        return b"".join(self.stream(text, lang))
+
+    def ensure_pool_size(self, size):
+        """按并发数调整连接池大小"""
+
+    def close(self):
+        """释放连接等资源"""
+
+
+class GTTSBackend(TTSBackend):
+    """Google 翻译 TTS 后端
+
+    文本切分和请求格式沿用 gTTS，但所有请求都通过同一个保持连接的
+    requests.Session 发送，连接池大小与合成并发数一致，不再每次新建连接。
+    base_url 可指向本地替身服务器 (如 http://127.0.0.1:8000)，用于测试和压测。
+    proxy 为代理地址或 ProxyPool，只作用于本后端的会话，不修改进程的环境变量；
+    为 None 时沿用环境变量中的代理。
+    """
+
+    AUDIO_PATTERN = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+    def __init__(self, pool_size=DEFAULT_MAX_WORKERS, base_url=None, timeout=DEFAULT_TTS_TIMEOUT, tld='com',
+                 proxy=None):
+        import requests
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.proxy = proxy
+        self.name = DEFAULT_BACKEND if self.base_url is None else f"{DEFAULT_BACKEND}@{self.base_url}"
+        self.timeout = timeout
+        self.tld = tld
+        self.pool_size = 0
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        # gTTS 为兼容代理和防火墙对 Google 关闭了证书校验，这里保持一致，并且只屏蔽发往该主机的请求的警告；
+        # base_url 指向的服务器照常校验证书
+        self.verify = self.base_url is not None
+        if not self.verify:
+            from urllib3.exceptions import InsecureRequestWarning
+            warnings.filterwarnings("ignore", message=rf"Unverified HTTPS request is being made to host "
+                                                      rf"'translate\.google\.{re.escape(tld)}'",
+                                    category=InsecureRequestWarning)
+        self.ensure_pool_size(pool_size)
+
+    def ensure_pool_size(self, size):
+        from requests.adapters import HTTPAdapter
+        with self._lock:
+            if size <= self.pool_size:
+                return
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.pool_size = size
+
+    def _target_url(self, url):
+        if self.base_url is None:
+            return url
+        parts = urllib.parse.urlsplit(url)
+        base = urllib.parse.urlsplit(self.base_url)
+        return urllib.parse.urlunsplit((base.scheme, base.netloc, base.path + parts.path, parts.query, ''))
+
+    def _send(self, prepared):
+        """发送一个请求；使用代理池时，某个代理连接失败或被限流后立即换下一个可用代理重发，
+        所有代理都不可用时才把错误交给上层的重试和退避"""
+        import requests
+        pool = self.proxy if isinstance(self.proxy, ProxyPool) else None
+        attempts = len(pool.proxies) if pool is not None else 1
+        for attempt in range(attempts):
+            proxy = pool.acquire() if pool is not None else self.proxy
+            proxies = {'http': proxy, 'https': proxy} if proxy else {}
+            settings = self.session.merge_environment_settings(prepared.url, proxies, None, self.verify, None)
+            can_switch = pool is not None and attempt < attempts - 1
+            try:
+                response = self.session.send(prepared, timeout=self.timeout, **settings)
+            except requests.exceptions.ConnectionError:
+                if pool is None:
+                    raise
+                pool.report_failure(proxy)
+                if can_switch and pool.has_available():
+                    continue
+                raise
+            if response.status_code in (429, 503):
+                retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                if pool is not None:
+                    pool.report_throttled(proxy, retry_after)
+                    if can_switch and pool.has_available():
+                        continue
+                raise ThrottledError(f"HTTP {response.status_code}", retry_after)
+            if pool is not None:
+                pool.report_success(proxy)
+            return response
+
+    def stream(self, text, lang):
+        from gtts import gTTS
+        tts = gTTS(text=text, lang=lang, tld=self.tld, timeout=self.timeout)
+        for prepared in tts._prepare_requests():
+            prepared.url = self._target_url(prepared.url)
+            response = self._send(prepared)
+            response.raise_for_status()
+            found = False
+            for line in response.iter_lines(chunk_size=1024):
+                decoded_line = line.decode('utf-8')
+                if "jQ1olc" in decoded_line:
+                    audio_search = self.AUDIO_PATTERN.search(decoded_line)
+                    if not audio_search:
+                        raise Exception("合成服务返回的数据中没有音频")
+                    found = True
+                    yield base64.b64decode(audio_search.group(1).encode('ascii'))
+            if not found:
+                raise Exception("合成服务返回的数据中没有音频")
+
+    def close(self):
+        self.session.close()
+        if isinstance(self.proxy, ProxyPool):
+            self.proxy.close()
+
+
+# IAST 转天城体：独立元音、元音附标、辅音 (多字符的写法在前，按最长匹配)
+_IAST_VOWELS = {
+    "ai": ("ऐ", "ै"), "au": ("औ", "ौ"), "a": ("अ", ""), "ā": ("आ", "ा"), "i": ("इ", "ि"), "ī": ("ई", "ी"),
+    "u": ("उ", "ु"), "ū": ("ऊ", "ू"), "ṛ": ("ऋ", "ृ"), "ṝ": ("ॠ", "ॄ"), "ḷ": ("ऌ", "ॢ"), "ḹ": ("ॡ", "ॣ"),
+    "e": ("ए", "े"), "o": ("ओ", "ो"),
+}
+_IAST_CONSONANTS = {
+    "kh": "ख", "gh": "घ", "ch": "छ", "jh": "झ", "ṭh": "ठ", "ḍh": "ढ", "th": "थ", "dh": "ध", "ph": "फ", "bh": "भ",
+    "k": "क", "g": "ग", "ṅ": "ङ", "c": "च", "j": "ज", "ñ": "ञ", "ṭ": "ट", "ḍ": "ड", "ṇ": "ण", "t": "त", "d": "द",
+    "n": "न", "p": "प", "b": "ब", "m": "म", "y": "य", "r": "र", "l": "ल", "v": "व", "ś": "श", "ṣ": "ष", "s": "स",
+    "h": "ह",
+}
+_IAST_MARKS = {"ṃ": "ं", "ṁ": "ं", "m̐": "ँ", "ḥ": "ः", "'": "ऽ", "’": "ऽ", "|": "।"}
+_IAST_TOKEN = re.compile("|".join(re.escape(token) for token in sorted(
+    list(_IAST_VOWELS) + list(_IAST_CONSONANTS) + list(_IAST_MARKS), key=len, reverse=True)))
+# 这些语言的 espeak-ng 语音朗读天城体文本
+DEVANAGARI_VOICES = ("sa", "hi", "mr", "ne")
+
+
+def iast_to_devanagari(text):
+    """把 IAST 转写的梵文转换为天城体，其他字符原样保留
+
+    espeak-ng 的梵语语音按天城体拼读，直接读 IAST 会被当作拉丁字母逐个念出。
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    output = []
+    pending_consonant = False
+    position = 0
+    while position < len(text):
+        match = _IAST_TOKEN.match(text, position)
+        if match is None:
+            if pending_consonant:
+                output.append("्")
+                pending_consonant = False
+            output.append(text[position])
+            position += 1
+            continue
+        token = match.group()
+        position = match.end()
+        if token in _IAST_CONSONANTS:
+            if pending_consonant:
+                output.append("्")
+            output.append(_IAST_CONSONANTS[token])
+            pending_consonant = True
+        elif token in _IAST_VOWELS:
+            independent, sign = _IAST_VOWELS[token]
+            output.append(sign if pending_consonant else independent)
+            pending_consonant = False
+        else:
+            if pending_consonant:
+                output.append("्")
+                pending_consonant = False
+            output.append(_IAST_MARKS[token])
+    if pending_consonant:
+        output.append("्")
+    return "".join(output)
+
+
+def encode_mp3(pcm, sample_rate, bitrate=DEFAULT_ESPEAK_BITRATE):
+    """把单声道 16 位 PCM 编码为 MP3：优先用 lameenc，未安装时调用 ffmpeg"""
+    try:
+        import lameenc
+    except ImportError:
+        lameenc = None
+    if lameenc is not None:
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(bitrate)
+        encoder.set_in_sample_rate(sample_rate)
+        encoder.set_channels(1)
+        encoder.set_quality(2)
+        return bytes(encoder.encode(pcm) + encoder.flush())
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise Exception("编码 MP3 需要安装 lameenc (pip install lameenc) 或 ffmpeg")
+    result = subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "s16le", "-ar", str(sample_rate),
+                             "-ac", "1", "-i", "pipe:0", "-f", "mp3", "-b:a", f"{bitrate}k", "pipe:1"],
+                            input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg 编码失败: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return result.stdout
+
+
+def _wav_pcm(data):
+    """从 WAV 数据中取出 (采样率, PCM)；espeak-ng 输出到管道时 data 块长度不可信，取到文件末尾"""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise Exception("espeak-ng 没有输出 WAV 数据")
+    sample_rate = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        chunk_size = int.from_bytes(data[position + 4:position + 8], "little")
+        if chunk_id == b"fmt ":
+            sample_rate = int.from_bytes(data[position + 12:position + 16], "little")
+        elif chunk_id == b"data":
+            return sample_rate, data[position + 8:]
+        position += 8 + chunk_size + (chunk_size & 1)
+    raise Exception("espeak-ng 输出的 WAV 数据不完整")
+
+
+class _EspeakLibrary:
+    """进程内的 libespeak-ng 引擎 (同步模式)：初始化一次，之后逐段合成，没有进程启动开销"""
+
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    POS_CHARACTER = 1
+    CHARS_UTF8 = 1
+    PARAMETER_RATE = 1
+
+    def __init__(self, library_path, voice, rate):
+        import ctypes
+        lib = ctypes.CDLL(library_path)
+        lib.espeak_Initialize.restype = ctypes.c_int
+        lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        lib.espeak_SetParameter.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.espeak_Synth.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int, ctypes.c_uint,
+                                     ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p]
+        # Windows 安装包把 espeak-ng-data 放在 DLL 旁边
+        data_dir = os.path.dirname(library_path)
+        data_path = data_dir.encode() if data_dir and os.path.isdir(os.path.join(data_dir, "espeak-ng-data")) else None
+        self.sample_rate = lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 0, data_path, 0)
+        if self.sample_rate <= 0:
+            raise Exception("espeak-ng 初始化失败")
+        if lib.espeak_SetVoiceByName(voice.encode()) != 0:
+            raise Exception(f"espeak-ng 没有语音: {voice}")
+        lib.espeak_SetParameter(self.PARAMETER_RATE, rate, 0)
+        self._chunks = []
+        callback_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+
+        def on_samples(wav, sample_count, events):
+            if sample_count > 0 and wav:
+                self._chunks.append(ctypes.string_at(wav, sample_count * 2))
+            return 0
+
+        self._callback = callback_type(on_samples)  # 保持引用，防止回调被回收
+        lib.espeak_SetSynthCallback(self._callback)
+        self._lib = lib
+
+    def synthesize(self, text):
+        self._chunks = []
+        data = text.encode("utf-8") + b"\0"
+        if self._lib.espeak_Synth(data, len(data), 0, self.POS_CHARACTER, 0, self.CHARS_UTF8, None, None) != 0:
+            raise Exception("espeak-ng 合成失败")
+        return self.sample_rate, b"".join(self._chunks)
+
+
+class _EspeakCommand:
+    """找不到 libespeak-ng 时的退路：每段调用一次 espeak-ng 命令行"""
+
+    def __init__(self, executable, voice, rate):
+        self.command = [executable, "-v", voice, "-s", str(rate), "-b", "1", "--stdout"]
+
+    def synthesize(self, text):
+        result = subprocess.run(self.command, input=text.encode("utf-8"), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise Exception(f"espeak-ng 合成失败: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return _wav_pcm(result.stdout)
+
+
+def _find_espeak_library():
+    """libespeak-ng 的位置：环境变量 ESPEAK_NG_LIBRARY，其次系统库路径和 Windows 默认安装目录"""
+    import ctypes.util
+    candidates = [os.environ.get("ESPEAK_NG_LIBRARY"), ctypes.util.find_library("espeak-ng")]
+    if sys.platform == "win32":
+        for base in (os.environ.get("ProgramFiles"), os.environ.get("ProgramFiles(x86)")):
+            if base:
+                candidates.append(os.path.join(base, "eSpeak NG", "libespeak-ng.dll"))
+    for candidate in candidates:
+        if candidate and (os.path.isfile(candidate) or not os.path.dirname(candidate)):
+            return candidate
+    return None
+
+
+def _open_espeak_engine(voice, rate):
+    """优先加载 libespeak-ng，加载失败时退回命令行"""
+    library_path = _find_espeak_library()
+    if library_path is not None:
+        try:
+            return _EspeakLibrary(library_path, voice, rate)
+        except OSError as e:
+            logging.warning(f"加载 libespeak-ng 失败，改用命令行: {str(e)}")
+    executable = shutil.which("espeak-ng") or shutil.which("espeak")
+    if executable is None:
+        raise Exception("未找到 espeak-ng，请先安装 (https://github.com/espeak-ng/espeak-ng)")
+    return _EspeakCommand(executable, voice, rate)
+
+
+# 每个 espeak 工作进程各自持有一个引擎；初始化失败的原因留到合成时报告
+_espeak_engine = None
+_espeak_engine_error = None
+
+
+def _espeak_worker_init(voice, rate):
+    global _espeak_engine, _espeak_engine_error
+    try:
+        _espeak_engine = _open_espeak_engine(voice, rate)
+    except Exception as e:
+        _espeak_engine_error = str(e)
+
+
+def _espeak_worker_synthesize(text, bitrate):
+    """在工作进程中合成一段文本并编码为 MP3"""
+    if _espeak_engine is None:
+        raise Exception(_espeak_engine_error or "espeak-ng 未初始化")
+    sample_rate, pcm = _espeak_engine.synthesize(text)
+    if not pcm:
+        raise Exception("espeak-ng 没有生成音频")
+    return encode_mp3(pcm, sample_rate, bitrate)
+
+
+class EspeakBackend(TTSBackend):
+    """本地 espeak-ng 后端，不需要网络
+
+    合成在常驻的工作进程池中进行：每个进程只初始化一次引擎 (libespeak-ng，找不到时退回命令行)，
+    之后逐段合成并编码为 MP3，不为每段咒语启动新进程。libespeak-ng 不是线程安全的，所以用进程而不是线程。
+    语音是梵语 (sa) 等天城体语言时，IAST 转写的文本先转换为天城体再朗读。
+    合成时传入的 lang 不起作用，语音由 voice 决定；缓存键包含语音和语速。
+    """
+
+    def __init__(self, voice=DEFAULT_ESPEAK_VOICE, rate=DEFAULT_ESPEAK_RATE, processes=None,
+                 bitrate=DEFAULT_ESPEAK_BITRATE):
+        self.voice = voice
+        self.rate = rate
+        self.bitrate = bitrate
+        self.processes = processes or os.cpu_count() or 1
+        self.name = f"espeak-ng:{voice}:{rate}"
+        self.transliterate = voice.split("+")[0] in DEVANAGARI_VOICES
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_espeak_worker_init,
+                                                     initargs=(self.voice, self.rate))
+            return self._executor
+
+    def stream(self, text, lang):
+        if self.transliterate:
+            text = iast_to_devanagari(text)
+        yield self._pool().submit(_espeak_worker_synthesize, text, self.bitrate).result()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def create_backend(name=DEFAULT_BACKEND, pool_size=DEFAULT_MAX_WORKERS, tts_url=None, voice=None, processes=None,
+                   proxy=None):
+    """按名称创建合成后端；在线后端未指定 tts_url 和 proxy 时返回 None，由调用方使用进程内共享的默认后端
+
+    proxy 为代理地址、地址列表 (多于一个时组成 ProxyPool) 或 ProxyPool。
+    """
+    if name == "espeak":
+        return EspeakBackend(voice=voice or DEFAULT_ESPEAK_VOICE, processes=processes)
+    if name != "gtts":
+        raise ValueError(f"未知的合成后端: {name}")
+    if isinstance(proxy, (list, tuple)):
+        if len(proxy) > 1:
+            proxy = ProxyPool(proxy, check_url=tts_url or DEFAULT_PROXY_CHECK_URL)
+        else:
+            proxy = proxy[0] if proxy else None
+    if tts_url is None and proxy is None:
+        return None
+    return GTTSBackend(pool_size=pool_size, base_url=tts_url, proxy=proxy)
+
+
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+
+def get_default_backend():
+    """进程内共享的默认后端，保持连接在多次转换之间复用"""
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = GTTSBackend()
+        return _default_backend
+
+
+def _synthesize_with_retries(text, lang, backend, limiter=None, max_retries=3, retry_delay=2, label=""):
+    """合成一段文本并返回 MP3 字节；失败时按退避策略重试，重试受 limiter 的重试预算约束
+
+    带 Retry-After 的限流不算失败：按其等待后重试，不占 max_retries 和重试预算 (最多 MAX_THROTTLE_RETRIES 次)，
+    降速由 limiter 负责。
+    """
+    import requests
+
+    attempt = 0
+    throttle_retries = 0
+    while True:
+        retry_after = None
+        tries = attempt + throttle_retries + 1
+        try:
+            logging.debug("尝试生成音频 %s (第 %d 次尝试)，文本: %.100s", label, tries, text)
+
+            if not text.strip():
+                raise ValueError("文本内容为空")
+
+            with limiter.slot() if limiter is not None else contextlib.nullcontext():
+                with metrics.timer("synthesis_seconds", backend=backend.name):
+                    audio = backend.synthesize(text, lang)
+            if not audio:
+                raise Exception("生成的音频文件大小为0")
+            metrics.inc("synthesis_requests_total", backend=backend.name, outcome="ok")
+            return audio
+
+        except ThrottledError as e:
+            metrics.inc("synthesis_requests_total", backend=backend.name, outcome="throttled")
+            error_msg = f"合成服务限流 (第 {tries} 次尝试): {str(e)}"
+            logging.warning(error_msg)
+            retry_after = e.retry_after
+
+        except requests.exceptions.RequestException as e:
+            metrics.inc("synthesis_requests_total", backend=backend.name, outcome="network_error")
+            error_msg = f"网络请求错误 (第 {tries} 次尝试): {str(e)}"
+            logging.error(error_msg)
+            logging.debug("网络错误详情: %s", e.__class__.__name__)
+
+        except Exception as e:
+            metrics.inc("synthesis_requests_total", backend=backend.name, outcome="error")
+            error_msg = f"音频生成错误 (第 {tries} 次尝试): {str(e)}"
+            logging.error(error_msg)
+            logging.debug("错误类型: %s, 错误详情: %s", e.__class__.__name__, e)
+
+        if retry_after is not None and throttle_retries < MAX_THROTTLE_RETRIES:
+            throttle_retries += 1
+            retry_delay_adjusted = _backoff_delay(0, retry_delay, retry_after)
+        else:
+            if attempt == max_retries - 1:
+                raise Exception(f"音频生成失败: {error_msg}")
+            if limiter is not None and not limiter.take_retry():
+                raise Exception(f"音频生成失败: 本次运行的重试预算已用完 ({error_msg})")
+            retry_delay_adjusted = _backoff_delay(attempt, retry_delay, retry_after)
+            attempt += 1
+
+        metrics.inc("synthesis_retries_total", backend=backend.name)
+        logging.info(f"等待 {retry_delay_adjusted:.1f} 秒后重试...")
+        time.sleep(retry_delay_adjusted)
+
+
+def _synthesize_chunked(text, lang, backend, limiter=None, max_retries=3, retry_delay=2, label="",
+                        chunk_workers=DEFAULT_CHUNK_WORKERS, chunk_cache=None):
+    """长文本切分后并行合成各段，再在帧级别拼接；总耗时取决于最慢的一段而不是各段之和
+
+    chunk_cache 为 ChunkCache 时按短语切分，已缓存的短语直接取用，只合成其余短语。
+    """
+    chunks = split_text_chunks(text, pack=chunk_cache is None)
+    # 只有一个短语时也要查写分段缓存，这样常用短语单独成段时也能与更长的咒语共用
+    if not chunks or (len(chunks) == 1 and chunk_cache is None):
+        return _synthesize_with_retries(text, lang, backend, limiter, max_retries, retry_delay, label)
+    segments = [None] * len(chunks)
+    # 同一文本中重复的短语只查一次缓存、合成一次、写一次缓存，结果填入它出现的每个位置
+    positions = collections.defaultdict(list)
+    for index, chunk in enumerate(chunks):
+        positions[AudioCache.make_key(chunk, lang, backend.name)].append(index)
+    if chunk_cache is not None:
+        for indices in positions.values():
+            segment = chunk_cache.get_bytes(chunks[indices[0]], lang, backend.name)
+            for index in indices:
+                segments[index] = segment
+    missing = [indices for indices in positions.values() if segments[indices[0]] is None]
+    logging.debug("%s 切分为 %d 段，合成其中 %d 段", label, len(chunks), len(missing))
+
+    if missing:
+        parallel = min(len(missing), chunk_workers)
+        backend.ensure_pool_size(parallel)
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="chunk") as executor:
+            futures = [(indices, executor.submit(_synthesize_with_retries, chunks[indices[0]], lang, backend, limiter,
+                                                 max_retries, retry_delay,
+                                                 f"{label} [{indices[0] + 1}/{len(chunks)}]"))
+                       for indices in missing]
+            try:
+                for indices, future in futures:
+                    segment = future.result()
+                    for index in indices:
+                        segments[index] = segment
+            except Exception:
+                for _, future in futures:
+                    future.cancel()
+                raise
+        if chunk_cache is not None:
+            for indices in missing:
+                frames = b"".join(iter_mp3_frames(segments[indices[0]]))
+                if frames:
+                    chunk_cache.put_bytes(chunks[indices[0]], lang, backend.name, frames)
+    return concat_mp3(segments)
+
+
+def convert_to_audio(text, audio_path, lang='ro', max_retries=3, retry_delay=2, cache=None, backend=None,
+                     limiter=None, chunk_cache=None):
+    """转换文本为音频，支持指定语言；传入 cache 时先查缓存，合成成功后写入缓存
+
+    超过 CHUNK_MAX_CHARS 的长文本在标点或空白处切分后并行合成，再在帧级别拼接为一个 MP3。
+    传入 chunk_cache 时整段缓存未命中的文本按短语查分段缓存，只合成未缓存的短语。
+    limiter 为多个线程共享的 RateLimiter：每次请求前取得许可，重试受其重试预算约束。
+    """
+    backend = backend or get_default_backend()
+    if cache is not None and text.strip() and cache.fetch(text, lang, backend.name, audio_path):
+        logging.debug("缓存命中: %s", audio_path)
+        return
+
+    audio = _synthesize_chunked(text, lang, backend, limiter, max_retries, retry_delay, audio_path,
+                                chunk_cache=chunk_cache)
+
+    os.makedirs(os.path.dirname(audio_path) or '.', exist_ok=True)
+    # 先写临时文件再原子替换：写了一半的文件永远不会出现在目标路径，
+    # 目标若是指向缓存的硬链接也不会被原地改写
+    tmp_path = _temp_path(audio_path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, audio_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    metrics.inc("bytes_written_total", len(audio), target="audio")
+    logging.debug("成功生成音频文件: %s (大小: %d 字节)", audio_path, len(audio))
+    if cache is not None:
+        cache.store(text, lang, backend.name, audio_path)
+
+
+# 后处理的默认目标响度和静音门限 (dBFS)、保留的首尾静音和峰值上限、重新编码的码率和每批片段数
+DEFAULT_TARGET_LOUDNESS = -18.0
+DEFAULT_SILENCE_THRESHOLD = -45.0
+DEFAULT_SILENCE_PADDING = 0.05
+DEFAULT_PEAK_CEILING = -1.0
+DEFAULT_POSTPROCESS_BITRATE = 48
+DEFAULT_POSTPROCESS_BATCH = 16
+# 静音检测窗口，以及响度测量的块长和步长 (秒，与 ITU-R BS.1770 一致)
+SILENCE_WINDOW = 0.01
+LOUDNESS_BLOCK = 0.4
+LOUDNESS_STEP = 0.1
 
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
 
-    texts = []
-    titles = []
+def decode_mp3(data):
+    """用 ffmpeg 把 MP3 解码为单声道 16 位 PCM，返回 (采样率, PCM)；采样率与原始音频相同"""
+    first = next(iter_mp3_frames(data), None)
+    if first is None:
+        raise Exception("不是有效的 MP3 数据")
+    sample_rate = _mp3_frame_info(first)[1]
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise Exception("解码 MP3 需要安装 ffmpeg")
+    result = subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "mp3", "-i", "pipe:0",
+                             "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"],
+                            input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg 解码失败: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return sample_rate, result.stdout
 
-    total_progress = 0
-    current_progress = 0
 
-    try:
-        if file_path.lower().endswith('.pdf'):
-            pdf_document = fitz.open(file_path)
-            total_progress = len(pdf_document)
-            logging.info(f"开始处理PDF文件: {file_path}")
+def measure_loudness(samples, sample_rate):
+    """门限均方响度 (dBFS)
 
-            for page_index, page in enumerate(pdf_document):
-                # Get detailed font information
-                page_text_blocks = page.get_text("dict")["blocks"] # Get dict for more details
-                logging.info(f"处理第 {page_index + 1} 页")
+    按 BS.1770 把信号分成 400 毫秒、重叠 75% 的块，去掉低于 -70 的块和低于平均值 10 dB 的块后求平均；
+    没有做 K 加权，对语音与 LUFS 相差不大。samples 为 [-1, 1] 的 NumPy 数组，全为静音时返回 -70。
+    """
+    import numpy as np
+    squares = np.square(samples, dtype=np.float64)
+    block = int(sample_rate * LOUDNESS_BLOCK)
+    if len(samples) <= block:
+        powers = np.array([squares.mean() if len(samples) else 0.0])
+    else:
+        cumulative = np.concatenate(([0.0], np.cumsum(squares)))
+        starts = np.arange(0, len(samples) - block + 1, int(sample_rate * LOUDNESS_STEP))
+        powers = (cumulative[starts + block] - cumulative[starts]) / block
+    with np.errstate(divide="ignore"):
+        levels = 10 * np.log10(powers)
+    gated = powers[levels > -70.0]
+    if gated.size == 0:
+        return -70.0
+    gated = gated[levels[levels > -70.0] > 10 * np.log10(gated.mean()) - 10.0]
+    return float(10 * np.log10(gated.mean()))
 
-                current_title = None
-                text_to_convert = ""
-
-                for block_index, block in enumerate(page_text_blocks):
-                    logging.debug(f"  Block {block_index}: {block}")  # 打印整个 block
-                    if "lines" in block:
-                        for line_index, line in enumerate(block["lines"]):
-                            logging.debug(f"    Line {line_index}: {line}") # 打印整个 line
-                            for span_index, span in enumerate(line["spans"]):
-                                font_name = span["font"]
-                                # font_size = span["size"] # Size is less critical now
-                                text = span["text"].strip()
-                                logging.info(f"      Span {span_index}: Font={font_name}, Text='{text}'") # 关键：打印字体和文本
-                                logging.debug(f"        current_title: {current_title}, text_to_convert: {text_to_convert}") #打印状态
-
-                                if "YaHei" in font_name :
-                                    if text_to_convert and current_title:  # Previous mantra is complete
-                                        logging.info(f"        Adding to texts: title='{current_title}', text='{text_to_convert}'")
-                                        texts.append(text_to_convert.strip())
-                                        titles.append(current_title.strip())
-                                    # 提取标题 (处理编号和卍字符)
-                                    match = re.match(r"^(M\d+\.\d+)?\s*(卍\s*)*(.*)$", text)
-                                    if match:
-                                        title_text = match.group(3).strip()  # 提取标题文本
-                                        if title_text:  # 仅当提取到有效标题时才更新
-                                            current_title = title_text
-                                    text_to_convert = "" #Reset
-                                elif (font_name.startswith("Arial") or font_name.startswith("Times")) and current_title:
-                                    # 罗马音译咒语, 且已有标题
-                                    text_to_convert += text + " "  # 累加咒语文本, 用空格分隔
 
-                    else:
-                        logging.debug("    Block has no lines.")
+def process_pcm(pcm, sample_rate, target_loudness=DEFAULT_TARGET_LOUDNESS, silence_threshold=DEFAULT_SILENCE_THRESHOLD,
+                padding=DEFAULT_SILENCE_PADDING, peak_ceiling=DEFAULT_PEAK_CEILING):
+    """裁掉首尾静音并把响度调整到 target_loudness，返回 (PCM, 统计信息)
 
-                #Check remaining
-                if text_to_convert and current_title:
-                    logging.info(f"  Adding remaining text: title='{current_title}', text='{text_to_convert}'")
-                    texts.append(text_to_convert.strip())
-                    titles.append(current_title.strip())
+    静音按 10 毫秒窗口的 RMS 判断，首尾各保留 padding 秒；增益受 peak_ceiling 限制，不会削波。
+    整段都低于静音门限时原样返回。
+    """
+    import numpy as np
+    samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+    stats = {"input_seconds": len(samples) / sample_rate}
+    window = max(1, int(sample_rate * SILENCE_WINDOW))
+    count = len(samples) // window
+    rms = np.sqrt(np.mean(np.square(samples[:count * window]).reshape(count, window), axis=1))
+    voiced = np.flatnonzero(rms > 10 ** (silence_threshold / 20))
+    if voiced.size == 0:
+        stats.update(output_seconds=stats["input_seconds"], loudness=None, gain_db=0.0)
+        return pcm, stats
 
-                current_progress += 1
-                if progress_callback:
-                    progress_callback(current_progress, total_progress)
+    keep = int(padding * sample_rate)
+    samples = samples[max(0, voiced[0] * window - keep):min(len(samples), (voiced[-1] + 1) * window + keep)]
+    loudness = measure_loudness(samples, sample_rate)
+    gain_db = target_loudness - loudness
+    peak = float(np.max(np.abs(samples)))
+    if peak > 0:
+        gain_db = min(gain_db, peak_ceiling - 20 * np.log10(peak))
+    samples = np.clip(samples * np.float32(10 ** (gain_db / 20)), -1.0, 32767 / 32768)
+    stats.update(output_seconds=len(samples) / sample_rate, loudness=loudness, gain_db=float(gain_db))
+    return np.round(samples * 32768).astype("<i2").tobytes(), stats
 
-            pdf_document.close()
 
+def _postprocess_worker(src_path, settings):
+    """在工作进程中处理一个片段，返回 (MP3 数据, 统计信息)；失败时返回 (None, 错误信息)，不影响同批其他片段"""
+    try:
+        with open(src_path, "rb") as f:
+            sample_rate, pcm = decode_mp3(f.read())
+        pcm, stats = process_pcm(pcm, sample_rate, settings["target_loudness"], settings["silence_threshold"],
+                                 settings["padding"], settings["peak_ceiling"])
+        return encode_mp3(pcm, sample_rate, settings["bitrate"]), stats
+    except Exception as e:
+        return None, str(e)
 
-        elif file_path.lower().endswith('.docx'):
-            doc = Document(file_path)
-            total_progress = len(doc.paragraphs)
-            logging.info(f"开始处理Word文件: {file_path}")
 
+class AudioPostProcessor:
+    """批量后处理：裁掉首尾静音、把响度统一到目标值后重新编码 (需要 numpy 和 ffmpeg)
 
-            current_title = None
-            text_to_convert = ""
+    解码、NumPy 计算和编码都在常驻的进程池中进行，片段按 batch_size 个一批分发，减少进程间往返；
+    cache 为 ProcessedCache 时，原始音频和参数都未变的片段直接取用上次的结果。
+    """
 
-            for para in doc.paragraphs:
-                for run in para.runs:
-                    font_name = run.font.name
-                    text = run.text.strip()
+    def __init__(self, processes=None, batch_size=DEFAULT_POSTPROCESS_BATCH, target_loudness=DEFAULT_TARGET_LOUDNESS,
+                 silence_threshold=DEFAULT_SILENCE_THRESHOLD, padding=DEFAULT_SILENCE_PADDING,
+                 peak_ceiling=DEFAULT_PEAK_CEILING, bitrate=DEFAULT_POSTPROCESS_BITRATE, cache=None):
+        if importlib.util.find_spec("numpy") is None:
+            raise Exception("音频后处理需要安装 numpy (pip install numpy)")
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.cache = cache
+        self.settings = {"target_loudness": target_loudness, "silence_threshold": silence_threshold,
+                         "padding": padding, "peak_ceiling": peak_ceiling, "bitrate": bitrate}
+        self.settings_key = json.dumps(self.settings, sort_keys=True)
+        self._executor = None
+        self._lock = threading.Lock()
 
-                    if "YaHei" in font_name : # 标题
-                        if text_to_convert and current_title:
-                            texts.append(text_to_convert.strip())
-                            titles.append(current_title.strip())
-                            text_to_convert = ""
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            return self._executor
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = _temp_path(path)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-                        match = re.match(r"^(M\d+\.\d+)?\s*(卍\s*)*(.*)$", text)
-                        if match:
-                            title_text = match.group(3).strip()
-                            if title_text:
-                                current_title = title_text
-                    elif (font_name and font_name.startswith("Arial") or font_name and font_name.startswith("Times")) and current_title :
-                         text_to_convert += text + " "
+    def process_files(self, pairs, progress_callback=None):
+        """处理 [(源文件, 目标文件)]，返回 {源文件: 目标文件}，失败的片段不在其中
 
-            if text_to_convert and current_title:
-                texts.append(text_to_convert.strip())
-                titles.append(current_title.strip())
+        progress_callback(current, total) 报告已完成的片段数。
+        """
+        pairs = list(pairs)
+        results = {}
+        pending = []
+        done = 0
+        for src_path, dst_path in pairs:
+            with open(src_path, "rb") as f:
+                audio_hash = hashlib.sha256(f.read()).hexdigest()
+            cached = self.cache.get_processed(audio_hash, self.settings_key) if self.cache is not None else None
+            if cached is None:
+                pending.append((src_path, dst_path, audio_hash))
+                continue
+            self._write(dst_path, cached)
+            results[src_path] = dst_path
+            metrics.inc("postprocess_total", status="cached")
+            done += 1
+        if progress_callback and done:
+            progress_callback(done, len(pairs))
 
-            current_progress = 0 # reset
-            for para_index, para in enumerate(doc.paragraphs):
-                current_progress += 1
+        if pending:
+            outputs = self._pool().map(_postprocess_worker, [src_path for src_path, _, _ in pending],
+                                       itertools.repeat(self.settings), chunksize=self.batch_size)
+            for (src_path, dst_path, audio_hash), (data, stats) in zip(pending, outputs):
+                done += 1
+                if data is None:
+                    metrics.inc("postprocess_total", status="failed")
+                    logging.error(f"后处理失败 '{src_path}': {stats}")
+                else:
+                    self._write(dst_path, data)
+                    if self.cache is not None:
+                        self.cache.put_processed(audio_hash, self.settings_key, data)
+                    results[src_path] = dst_path
+                    metrics.inc("postprocess_total", status="done")
+                    metrics.inc("postprocess_trimmed_seconds_total", stats["input_seconds"] - stats["output_seconds"])
+                    logging.debug("后处理: %s 响度 %s dBFS，增益 %.1f dB", src_path, stats["loudness"],
+                                  stats["gain_db"])
                 if progress_callback:
-                    progress_callback(current_progress, total_progress)
+                    progress_callback(done, len(pairs))
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
 
+
+def postprocess_paths(input_paths, output_dir, processes=None, batch_size=DEFAULT_POSTPROCESS_BATCH,
+                      cache_dir=DEFAULT_CACHE_DIR, progress_callback=None, **settings):
+    """库接口：后处理已生成的 MP3 (文件或目录)，结果按相对路径写入 output_dir，返回 {源文件: 目标文件}
+
+    settings 为 AudioPostProcessor 的处理参数 (target_loudness 等)。
+    """
+    pairs = []
+    for input_path in input_paths:
+        if os.path.isdir(input_path):
+            for root, _, names in os.walk(input_path):
+                for name in sorted(names):
+                    if name.lower().endswith(".mp3"):
+                        src_path = os.path.join(root, name)
+                        pairs.append((src_path, os.path.join(output_dir, os.path.relpath(src_path, input_path))))
         else:
-            error_msg = "不支持的文件类型，请提供 .docx 或 .pdf 文件"
-            logging.error(error_msg)
-            raise ValueError(error_msg)
+            pairs.append((input_path, os.path.join(output_dir, os.path.basename(input_path))))
+    cache = ProcessedCache(os.path.join(cache_dir, ProcessedCache.DIR_NAME)) if cache_dir else None
+    processor = AudioPostProcessor(processes=processes, batch_size=batch_size, cache=cache, **settings)
+    try:
+        results = processor.process_files(pairs, progress_callback)
+    finally:
+        processor.close()
+    if cache is not None:
+        logging.info(f"后处理缓存统计: {cache.stats()}")
+    return results
 
-        audio_paths = []
-        total_progress = len(texts)
-        current_progress = 0
 
-        record_path = os.path.join(folder_path, "audio_record.txt")
+# 试听音频的内存缓存上限 (字节) 和试听时同时合成的分段数
+DEFAULT_PREVIEW_CACHE_BYTES = 32 * 1024 * 1024
+# 没有流式播放器时试听文件写入的目录 (系统临时目录下) 和保留的文件数，更早的文件在写新文件时删除
+PREVIEW_DIR_NAME = "fanyin_preview"
+PREVIEW_FILES_KEPT = 8
+PREVIEW_PREFETCH = 4
+
+
+class PreviewCache:
+    """试听音频的内存 LRU 缓存：重复试听同一段文本时直接从内存播放，不读磁盘也不重新合成"""
+
+    def __init__(self, max_bytes=DEFAULT_PREVIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
 
-        for text, title in zip(texts, titles):
+def _open_with_default_app(path):
+    """用系统默认程序打开文件"""
+    if sys.platform == "win32":
+        os.startfile(path)
+    elif sys.platform == "darwin":
+        subprocess.Popen(["open", path])
+    else:
+        subprocess.Popen(["xdg-open", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class PipePlayer:
+    """把 MP3 数据写入外部播放器的标准输入：收到第一段数据就开始播放，不写临时文件"""
+
+    # 能从标准输入播放 MP3 的播放器，按优先顺序
+    COMMANDS = (
+        ("ffplay", ["-nodisp", "-autoexit", "-loglevel", "quiet", "-i", "pipe:0"]),
+        ("mpv", ["--no-video", "--really-quiet", "-"]),
+        ("mpg123", ["-q", "-"]),
+    )
+
+    def __init__(self, command):
+        self.command = command
+        self.stopped = False
+        self._process = None
+        self._lock = threading.Lock()
+
+    def feed(self, data):
+        with self._lock:
+            if self.stopped:
+                return
+            if self._process is None:
+                self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                                 stderr=subprocess.DEVNULL)
             try:
-                if not text.strip():
-                    logging.warning(f"跳过空文本，标题: {title}")
-                    continue
+                self._process.stdin.write(data)
+                self._process.stdin.flush()
+            except OSError:
+                self.stopped = True  # 播放器被关闭
 
-                audio_name = title.replace("/", "-").replace("\\", "-")  # Sanitize filename
-                audio_path = os.path.join(folder_path, f"{audio_name}.mp3")
+    def finish(self):
+        """数据已全部送出：关闭标准输入，播放器播完后自行退出"""
+        with self._lock:
+            if self._process is not None and not self._process.stdin.closed:
+                try:
+                    self._process.stdin.close()
+                except OSError:
+                    pass
 
-                with open(record_path, "a", encoding='utf-8') as f:
-                    f.write(f"音频文件: {audio_name}.mp3\n标题: {title}\n内容: {text}\n{'='*50}\n")
+    def wait(self):
+        if self._process is not None:
+            self._process.wait()
 
-                logging.info(f"开始转换音频: {audio_name}.mp3")
-                logging.info(f"文本长度: {len(text)} 字符")
-                convert_to_audio(text, audio_path, lang='ro') # Romanian!
+    def stop(self):
+        with self._lock:
+            self.stopped = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
 
-                if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
-                    audio_paths.append(audio_path)
-                    logging.info(f"成功转换: {audio_name}.mp3 (大小: {os.path.getsize(audio_path)} 字节)")
 
-                else:
-                    logging.error(f"音频文件生成失败或为空: {audio_name}.mp3")
+class FilePlayer:
+    """找不到能从标准输入播放的播放器时的退路：数据收齐后写入临时文件，交给系统默认程序打开
 
-                current_progress += 1
-                if progress_callback:
-                    progress_callback(current_progress, total_progress)
+    文件写在 temp_dir (默认为系统临时目录下的 PREVIEW_DIR_NAME) 中，只保留最近的 keep 个，
+    默认程序可能还在读取刚打开的文件，所以不在打开后立即删除，而是在之后的试听中清理。
+    """
 
-            except Exception as e:
-                logging.error(f"转换失败 '{title}': {str(e)}")
-                logging.error(f"错误详情: {e.__class__.__name__}")
-                continue
+    def __init__(self, temp_dir=None, keep=PREVIEW_FILES_KEPT):
+        self.temp_dir = temp_dir or os.path.join(tempfile.gettempdir(), PREVIEW_DIR_NAME)
+        self.keep = keep
+        self.stopped = False
+        self._buffer = bytearray()
 
-        return audio_paths
+    def feed(self, data):
+        if not self.stopped:
+            self._buffer += data
 
-    except Exception as e:
-        logging.error(f"处理文件时发生错误: {str(e)}")
-        raise
-    finally:
+    def _prune(self):
+        """删除最早的试听文件，只留下 keep - 1 个给即将写入的新文件腾出位置"""
+        try:
+            files = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.temp_dir)
+                           if entry.name.startswith("preview_") and entry.name.endswith(".mp3"))
+        except OSError:
+            return
+        for _, path in files[:max(0, len(files) - self.keep + 1)]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows 上仍在播放的文件无法删除，留到下一次试听再清理
+                pass
+
+    def finish(self):
+        if self.stopped or not self._buffer:
+            return
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._prune()
+        fd, path = tempfile.mkstemp(prefix="preview_", suffix=".mp3", dir=self.temp_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._buffer)
+        _open_with_default_app(path)
+
+    def wait(self):
         pass
 
-def convert_to_audio(text, audio_path, lang='ro', max_retries=3, retry_delay=2):
-    """转换文本为音频，支持指定语言"""
-    for attempt in range(max_retries):
+    def stop(self):
+        self.stopped = True
+        self._buffer.clear()
+
+
+def find_audio_player():
+    """优先使用能边收边播的播放器 (ffplay、mpv、mpg123)，都没有时用系统默认程序打开临时文件"""
+    for name, arguments in PipePlayer.COMMANDS:
+        executable = shutil.which(name)
+        if executable:
+            return PipePlayer([executable] + arguments)
+    return FilePlayer()
+
+
+def preview_text(text, lang='ro', backend=None, player=None, preview_cache=None, cache=None, chunk_cache=None,
+                 limiter=None, stop_event=None, max_retries=3, retry_delay=2):
+    """试听：分段合成并按顺序送入播放器，第一段合成完就开始播放；返回完整的 MP3 字节
+
+    命中 preview_cache (内存) 或 cache (磁盘) 时直接播放缓存的音频；播放前一段时后面的分段已在合成。
+    合成的各短语写入 chunk_cache，完整音频只写入 preview_cache：cache 中的整段音频只由 convert_to_audio
+    写入，同一个键总是对应同样的字节。stop_event 置位时停止合成并返回 None。
+    """
+    backend = backend or get_default_backend()
+    player = player or find_audio_player()
+    key = AudioCache.make_key(text, lang, backend.name)
+    audio = preview_cache.get(key) if preview_cache is not None else None
+    if audio is None and cache is not None:
+        audio = cache.get_bytes(text, lang, backend.name)
+    if audio is not None:
+        player.feed(audio)
+        player.finish()
+        if preview_cache is not None:
+            preview_cache.put(key, audio)
+        return audio
+
+    def synthesize(chunk, label):
+        segment = chunk_cache.get_bytes(chunk, lang, backend.name) if chunk_cache is not None else None
+        if segment is None:
+            segment = b"".join(iter_mp3_frames(
+                _synthesize_with_retries(chunk, lang, backend, limiter, max_retries, retry_delay, label)))
+            if chunk_cache is not None and segment:
+                chunk_cache.put_bytes(chunk, lang, backend.name, segment)
+        return segment
+
+    chunks = split_text_chunks(text, pack=chunk_cache is None)
+    segments = []
+    backend.ensure_pool_size(PREVIEW_PREFETCH)
+    with ThreadPoolExecutor(max_workers=PREVIEW_PREFETCH, thread_name_prefix="preview") as executor:
+        futures = [executor.submit(synthesize, chunk, f"试听 [{index + 1}/{len(chunks)}]")
+                   for index, chunk in enumerate(chunks)]
         try:
-            logging.info(f"尝试生成音频文件 {audio_path} (第 {attempt + 1} 次尝试)")
-            logging.debug(f"文本内容: {text[:100]}...")
+            for future in futures:
+                if (stop_event is not None and stop_event.is_set()) or player.stopped:
+                    return None
+                segment = future.result()
+                player.feed(segment)
+                segments.append(segment)
+        finally:
+            for future in futures:
+                future.cancel()
+            player.finish()
+    audio = b"".join(segments)
+    if not audio:
+        raise Exception("生成的音频文件大小为0")
+    if preview_cache is not None:
+        preview_cache.put(key, audio)
+    return audio
+
+
+def convert_files(input_paths, output_dir, lang='ro', max_workers=DEFAULT_MAX_WORKERS, proxy=None,
+                  cache_dir=DEFAULT_CACHE_DIR, extract_processes=1, progress_callback=None, tts_url=None,
+                  rate_limit=None, font_classifier=None, backend_name=DEFAULT_BACKEND, voice=None, album=False,
+                  album_gap=0.0, album_max_bytes=None, postprocess=False, postprocess_options=None):
+    """库接口：批量转换多个 PDF/Word 文件，不依赖图形界面
+
+    proxy 形如 "http://host:port"，也可以是地址列表 (轮流使用，见 ProxyPool)；
+    cache_dir 为 None 时不使用音频缓存和解析缓存。
+    tts_url 指定时合成请求发往该地址 (本地替身服务器)，而不是 Google。
+    backend_name 为 "espeak" 时用本地 espeak-ng 离线合成，voice 为其语音 (默认 sa)。
+    rate_limit 为每秒请求数上限，所有文件共享同一个限流器和重试预算。
+    font_classifier 为 FontClassifier，用于字体约定不同的文档。
+    progress_callback(input_path, current, total, stage) 报告每个文件的进度。
+    album 为 True 时每个文件另外生成一张专辑 (见 batch_text_to_speech)。
+    postprocess 为 True 时裁掉首尾静音并统一响度，postprocess_options 为 AudioPostProcessor 的参数。
+    返回 {输入文件: [生成的音频路径]}。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cache = AudioCache(cache_dir) if cache_dir else None
+    chunk_cache = ChunkCache(os.path.join(cache_dir, ChunkCache.DIR_NAME)) if cache_dir else None
+    extraction_cache = ExtractionCache(os.path.join(cache_dir, ExtractionCache.FILE_NAME)) if cache_dir else None
+    backend = create_backend(backend_name, pool_size=max_workers, tts_url=tts_url, voice=voice, proxy=proxy)
+    limiter = RateLimiter(max_concurrency=max_workers, rate=rate_limit)
+    postprocessor = None
+    if postprocess:
+        postprocessor = AudioPostProcessor(
+            cache=ProcessedCache(os.path.join(cache_dir, ProcessedCache.DIR_NAME)) if cache_dir else None,
+            **(postprocess_options or {}))
+    try:
+        results = {}
+        for input_path in input_paths:
+            callback = functools.partial(progress_callback, input_path) if progress_callback else None
+            results[input_path] = batch_text_to_speech(input_path, output_dir, callback, max_workers=max_workers,
+                                                       cache=cache, extract_processes=extract_processes, lang=lang,
+                                                       backend=backend, limiter=limiter,
+                                                       extraction_cache=extraction_cache,
+                                                       font_classifier=font_classifier, chunk_cache=chunk_cache,
+                                                       album=album, album_gap=album_gap,
+                                                       album_max_bytes=album_max_bytes, postprocessor=postprocessor)
+        if chunk_cache is not None:
+            logging.info(f"分段缓存 (全部文件): {chunk_cache.stats()}")
+        if isinstance(getattr(backend, 'proxy', None), ProxyPool):
+            logging.info(f"代理池统计: {backend.proxy.stats()}")
+        return results
+    finally:
+        if extraction_cache is not None:
+            extraction_cache.close()
+        if backend is not None:
+            backend.close()
+        if postprocessor is not None:
+            postprocessor.close()
 
-            if not text.strip():
-                raise ValueError("文本内容为空")
 
+# 任务队列数据库的默认位置、任务租约时长 (秒) 和每段咒语的最大尝试次数
+DEFAULT_QUEUE_DB = "jobs.sqlite3"
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    """持久化的多文件任务队列 (SQLite)
+
+    每个输入文件是一个 job，加入队列时解析为逐段咒语的 task。工作进程以租约方式领取 task，
+    处理期间定期续约；租约到期仍未完成 (进程崩溃、机器掉线) 的 task 会被其他工作进程重新领取。
+    只有持有当前租约的进程能把 task 标记为完成，因此每段咒语恰好记录一次；输出文件经临时文件
+    原子替换写入，租约过期后被重复合成也不会留下损坏的文件。
+    多台机器共享数据库文件时依赖文件系统的文件锁，因此使用 SQLite 默认的回滚日志而不是 WAL；
+    租约按各机器的系统时间计算，机器间的时钟应大致同步。
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_DB, timeout=30):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None：由 _transaction 显式开启写事务
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, input_path TEXT, output_dir TEXT, "
+                         "lang TEXT, file_hash TEXT, created_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, job_id INTEGER, item_index INTEGER, "
+                         "title TEXT, text TEXT, audio_path TEXT, status TEXT, attempts INTEGER DEFAULT 0, "
+                         "lease_owner TEXT, lease_expires REAL, size INTEGER, error TEXT, updated_at REAL, "
+                         "UNIQUE (job_id, item_index))")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, job_id, item_index)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 写事务：开始时即取得写锁，多个进程同时领取 task 时不会拿到同一条"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
             try:
-                socket.create_connection(("translate.google.com", 80), timeout=10)
-            except (requests.exceptions.RequestException, socket.error) as e:
-                raise requests.exceptions.RequestException(f"无法连接到Google服务: {str(e)}")
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
 
-            tts = gTTS(text=text, lang=lang)  # Use specified language
+    def add_job(self, input_path, output_dir, lang='ro', extraction_cache=None, font_classifier=None, force=False):
+        """解析输入文件并加入队列，返回 (job_id, task 数, 是否新建)
 
-            os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-            tts.save(audio_path)
+        同一文件 (内容未变) 以相同的输出目录和语言已在队列中时不重复加入，除非 force 为 True。
+        """
+        input_path = os.path.abspath(input_path)
+        output_dir = os.path.abspath(output_dir)
+        file_hash = ExtractionCache.file_digest(input_path)
+        if not force:
+            with self._lock:
+                row = self._conn.execute("SELECT id, (SELECT COUNT(*) FROM tasks WHERE job_id = jobs.id) FROM jobs "
+                                         "WHERE input_path = ? AND output_dir = ? AND lang = ? AND file_hash = ?",
+                                         (input_path, output_dir, lang, file_hash)).fetchone()
+            if row is not None:
+                return row[0], row[1], False
 
-            if not os.path.exists(audio_path):
-                raise Exception("音频文件未生成")
+        folder_path = os.path.join(output_dir, os.path.splitext(os.path.basename(input_path))[0])
+        used_names = set()
+        rows = []
+        now = time.time()
+        for index, (title, text) in enumerate(iter_document_items(input_path, extraction_cache=extraction_cache,
+                                                                  font_classifier=font_classifier)):
+            if not text.strip():
+                continue
+            audio_name = _unique_audio_name(_sanitize_audio_name(title), used_names)
+            rows.append((index, title, text, os.path.join(folder_path, f"{audio_name}.mp3"), now))
+        with self._transaction() as conn:
+            job_id = conn.execute("INSERT INTO jobs (input_path, output_dir, lang, file_hash, created_at) "
+                                  "VALUES (?, ?, ?, ?, ?)", (input_path, output_dir, lang, file_hash, now)).lastrowid
+            conn.executemany("INSERT INTO tasks (job_id, item_index, title, text, audio_path, status, updated_at) "
+                             "VALUES (?, ?, ?, ?, ?, 'pending', ?)", [(job_id,) + row for row in rows])
+        return job_id, len(rows), True
 
-            file_size = os.path.getsize(audio_path)
-            if file_size == 0:
-                os.remove(audio_path)
-                raise Exception("生成的音频文件大小为0")
+    def lease(self, worker_id, limit, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """领取最多 limit 个待处理或租约已过期的 task，返回 [(task_id, job_id, 标题, 文本, 音频路径, 语言)]"""
+        now = time.time()
+        with self._transaction() as conn:
+            # 已用完尝试次数、租约又过期的 task (多半每次都让工作进程崩溃) 不再分配
+            conn.execute("UPDATE tasks SET status = 'failed', lease_owner = NULL, updated_at = ?, "
+                         "error = COALESCE(error, '租约多次过期，工作进程可能在处理时崩溃') "
+                         "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, max_attempts))
+            tasks = conn.execute("SELECT tasks.id, job_id, title, text, audio_path, lang FROM tasks "
+                                 "JOIN jobs ON jobs.id = tasks.job_id "
+                                 "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                                 "ORDER BY job_id, item_index LIMIT ?", (now, limit)).fetchall()
+            conn.executemany("UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                             "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                             [(worker_id, now + lease_seconds, now, task[0]) for task in tasks])
+        return tasks
+
+    def renew(self, task_ids, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """为仍在处理的 task 续约"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                             "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                             [(now + lease_seconds, now, task_id, worker_id) for task_id in task_ids])
+
+    def complete(self, task_id, worker_id, size):
+        """标记完成；租约已被其他进程接手时返回 False (结果由持有租约的进程记录)"""
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET status = 'done', size = ?, error = NULL, lease_owner = NULL, "
+                                  "lease_expires = NULL, updated_at = ? "
+                                  "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                                  (size, time.time(), task_id, worker_id))
+            return cursor.rowcount == 1
+
+    def fail(self, task_id, worker_id, error, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """记录失败：未用完尝试次数的 task 放回队列，否则标记为失败"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                         "error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                         "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                         (max_attempts, error, time.time(), task_id, worker_id))
+
+    def release(self, worker_id):
+        """工作进程正常退出时交还未完成的租约，不计入尝试次数"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE tasks SET status = 'pending', attempts = MAX(attempts - 1, 0), lease_owner = NULL, "
+                         "lease_expires = NULL, updated_at = ? WHERE lease_owner = ? AND status = 'leased'",
+                         (time.time(), worker_id))
+
+    def retry_failed(self, job_id=None):
+        """把失败的 task 放回队列并清零尝试次数，返回放回的数量"""
+        with self._transaction() as conn:
+            query = "UPDATE tasks SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'"
+            params = [time.time()]
+            if job_id is not None:
+                query += " AND job_id = ?"
+                params.append(job_id)
+            return conn.execute(query, params).rowcount
+
+    def has_unfinished(self, job_id=None):
+        """是否还有待处理或处理中的 task"""
+        query = "SELECT 1 FROM tasks WHERE status IN ('pending', 'leased')"
+        params = []
+        if job_id is not None:
+            query += " AND job_id = ?"
+            params.append(job_id)
+        with self._lock:
+            return self._conn.execute(query + " LIMIT 1", params).fetchone() is not None
+
+    def job_status(self, job_id=None):
+        """各 job 的 task 状态统计"""
+        query = ("SELECT jobs.id, input_path, lang, COUNT(tasks.id), "
+                 "SUM(status = 'pending'), SUM(status = 'leased'), SUM(status = 'done'), SUM(status = 'failed') "
+                 "FROM jobs LEFT JOIN tasks ON tasks.job_id = jobs.id")
+        params = []
+        if job_id is not None:
+            query += " WHERE jobs.id = ?"
+            params.append(job_id)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY jobs.id ORDER BY jobs.id", params).fetchall()
+        return [{
+            'job_id': row[0], 'input_path': row[1], 'lang': row[2], 'tasks': row[3],
+            'pending': row[4] or 0, 'leased': row[5] or 0, 'done': row[6] or 0, 'failed': row[7] or 0,
+        } for row in rows]
+
+    def list_tasks(self, job_id=None, status=None):
+        """按文档顺序列出 task"""
+        query = ("SELECT id, job_id, item_index, title, text, audio_path, status, attempts, lease_owner, size, error "
+                 "FROM tasks WHERE 1 = 1")
+        params = []
+        if job_id is not None:
+            query += " AND job_id = ?"
+            params.append(job_id)
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY job_id, item_index", params).fetchall()
+        keys = ('task_id', 'job_id', 'item_index', 'title', 'text', 'audio_path', 'status', 'attempts',
+                'lease_owner', 'size', 'error')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _write_job_record(job_queue, job_id):
+    """job 全部完成后按文档顺序写出 audio_record.txt，格式与单文件转换相同"""
+    tasks = job_queue.list_tasks(job_id)
+    if not tasks:
+        return
+    record_path = os.path.join(os.path.dirname(tasks[0]['audio_path']), "audio_record.txt")
+    tmp_path = _temp_path(record_path)
+    try:
+        with open(tmp_path, "w", encoding='utf-8') as record_file:
+            for task in tasks:
+                if task['status'] == 'done':
+                    record_file.write(f"音频文件: {os.path.basename(task['audio_path'])}\n标题: {task['title']}\n"
+                                      f"内容: {task['text']}\n{'='*50}\n")
+        os.replace(tmp_path, record_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def run_queue_worker(db_path=DEFAULT_QUEUE_DB, threads=DEFAULT_MAX_WORKERS, lease_seconds=DEFAULT_LEASE_SECONDS,
+                     max_attempts=DEFAULT_MAX_ATTEMPTS, exit_when_idle=True, poll_interval=2.0,
+                     cache_dir=DEFAULT_CACHE_DIR, tts_url=None, rate_limit=None, stop_event=None, worker_id=None,
+                     backend_name=DEFAULT_BACKEND, voice=None, proxy=None, metrics_port=None, metrics_path=None):
+    """工作进程主循环：从队列领取 task 并用 threads 个线程合成，返回本进程完成的 task 数
+
+    exit_when_idle 为 True 时队列中没有待处理和处理中的 task 后退出，否则持续等待新任务，
+    直到 stop_event 置位 (此时等在途合成结束，交还其余租约后退出)。
+    metrics_port 指定时在该端口提供 Prometheus 指标；metrics_path 指定时退出前写入 JSON 指标摘要。
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    job_queue = JobQueue(db_path)
+    cache = AudioCache(cache_dir) if cache_dir else None
+    chunk_cache = ChunkCache(os.path.join(cache_dir, ChunkCache.DIR_NAME)) if cache_dir else None
+    backend = create_backend(backend_name, pool_size=threads, tts_url=tts_url, voice=voice, proxy=proxy)
+    owns_backend = backend is not None
+    backend = backend or get_default_backend()
+    backend.ensure_pool_size(threads)
+    limiter = RateLimiter(max_concurrency=threads, rate=rate_limit)
+    stop_event = stop_event or threading.Event()
+    metrics_server = serve_metrics(metrics_port) if metrics_port is not None else None
+    active = {}
+    completed = 0
+    renewed_at = time.monotonic()
+    logging.info(f"工作进程 {worker_id} 启动，并发数 {threads}")
 
-            logging.info(f"成功生成音频文件: {audio_path} (大小: {file_size} 字节)")
+    def finish(task, future):
+        nonlocal completed
+        task_id, job_id, title, _, audio_path, _ = task
+        try:
+            future.result()
+            if job_queue.complete(task_id, worker_id, os.path.getsize(audio_path)):
+                completed += 1
+                metrics.inc("items_total", status="done")
+                logging.debug("完成: %s", os.path.basename(audio_path))
+                if not job_queue.has_unfinished(job_id):
+                    _write_job_record(job_queue, job_id)
+            else:
+                logging.warning(f"租约已失效，结果由其他工作进程记录: {os.path.basename(audio_path)}")
+        except Exception as e:
+            metrics.inc("items_total", status="failed")
+            logging.error(f"转换失败 '{title}': {str(e)}")
+            job_queue.fail(task_id, worker_id, str(e), max_attempts)
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            while True:
+                for task_id, (task, future) in list(active.items()):
+                    if future.done():
+                        del active[task_id]
+                        finish(task, future)
+                if active and time.monotonic() - renewed_at > lease_seconds / 3:
+                    job_queue.renew(list(active), worker_id, lease_seconds)
+                    renewed_at = time.monotonic()
+                if stop_event.is_set():
+                    if not active:
+                        break
+                elif len(active) < threads:
+                    for task in job_queue.lease(worker_id, threads - len(active), lease_seconds, max_attempts):
+                        task_id, _, _, text, audio_path, lang = task
+                        active[task_id] = (task, executor.submit(convert_to_audio, text, audio_path, lang=lang,
+                                                                 cache=cache, backend=backend, limiter=limiter,
+                                                                 chunk_cache=chunk_cache))
+                    if not active:
+                        if exit_when_idle and not job_queue.has_unfinished():
+                            break
+                        stop_event.wait(poll_interval)
+                        continue
+                wait([future for _, future in active.values()], timeout=1.0, return_when='FIRST_COMPLETED')
+    finally:
+        job_queue.release(worker_id)
+        job_queue.close()
+        if owns_backend:
+            backend.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if metrics_path:
+            metrics.write_json(metrics_path)
+    logging.info(f"工作进程 {worker_id} 退出，完成 {completed} 段")
+    return completed
+
+
+def run_queue_workers(db_path=DEFAULT_QUEUE_DB, processes=1, **worker_options):
+    """启动 processes 个工作进程处理队列，返回完成的 task 总数
+
+    多进程时各进程的指标分开：第 i 个进程使用端口 metrics_port + i，JSON 摘要文件名加上 ".i"。
+    """
+    if processes <= 1:
+        return run_queue_worker(db_path, **worker_options)
+    metrics_port = worker_options.pop('metrics_port', None)
+    metrics_path = worker_options.pop('metrics_path', None)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = []
+        for index in range(processes):
+            options = dict(worker_options)
+            if metrics_port is not None:
+                options['metrics_port'] = metrics_port + index
+            if metrics_path:
+                root, ext = os.path.splitext(metrics_path)
+                options['metrics_path'] = f"{root}.{index}{ext}"
+            futures.append(executor.submit(run_queue_worker, db_path, **options))
+        return sum(future.result() for future in futures)
+
+
+def _expand_inputs(paths):
+    """展开输入路径：目录递归查找其中的 .pdf/.docx 文件"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(('.pdf', '.docx')))
+        else:
+            files.append(path)
+    return files
+
+
+# 守护进程的默认端口、同时运行的任务数、保留的已结束任务数和进度事件的最短间隔 (秒)
+DEFAULT_DAEMON_PORT = 8765
+DAEMON_JOB_WORKERS = 2
+DAEMON_MAX_FINISHED_JOBS = 200
+DAEMON_PROGRESS_INTERVAL = 0.1
+# 未指定令牌时守护进程生成随机令牌并写入该文件 (仅本人可读)，submit 默认从这里读取
+DEFAULT_DAEMON_TOKEN_FILE = "daemon.token"
+# 守护进程接受的 Host 头 (防止 DNS 重绑定)；监听其他地址时该地址也被接受
+DAEMON_LOOPBACK_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+class DaemonJob:
+    """守护进程中的一个任务：状态、进度事件和结果
+
+    kind 为 "file" (转换 PDF/Word 文件) 或 "text" (合成一段文本)。事件按发生顺序保存，
+    iter_events() 从头回放并等待新事件，直到任务结束。
+    """
+
+    FINISHED = ("done", "failed", "cancelled")
+
+    def __init__(self, job_id, kind, request):
+        self.id = job_id
+        self.kind = kind
+        self.request = request
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {}
+        self.results = []
+        self.audio = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.events = []
+        self._condition = threading.Condition()
+        self._progress_emitted = {}
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED
+
+    def emit(self, event, **fields):
+        with self._condition:
+            self.events.append(dict(event=event, job=self.id, time=time.time(), **fields))
+            self._condition.notify_all()
+
+    def finish(self, status, **fields):
+        """记录结束状态并发出最后一个事件"""
+        with self._condition:
+            self.status = status
+            self.finished_at = time.time()
+            self.events.append(dict(event=status, job=self.id, time=self.finished_at, **fields))
+            self._condition.notify_all()
+
+    def on_progress(self, current, total, stage):
+        """进度回调：同一阶段的进度事件最多每 DAEMON_PROGRESS_INTERVAL 秒一条，最后一条总会发出"""
+        self.progress[stage] = {"current": current, "total": total}
+        now = time.monotonic()
+        if current < total and now - self._progress_emitted.get(stage, 0.0) < DAEMON_PROGRESS_INTERVAL:
             return
+        self._progress_emitted[stage] = now
+        self.emit("progress", stage=stage, current=current, total=total)
 
-        except requests.exceptions.RequestException as e:
-            error_msg = f"网络请求错误 (第 {attempt + 1} 次尝试): {str(e)}"
-            logging.error(error_msg)
-            logging.debug(f"网络错误详情: {e.__class__.__name__}")
+    def iter_events(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.events) and not self.finished:
+                    self._condition.wait()
+                pending = self.events[index:]
+                index = len(self.events)
+                done = self.finished
+            yield from pending
+            if done:
+                return
 
-            if attempt == max_retries - 1:
-                raise Exception(f"音频生成失败: {error_msg}")
+    def describe(self):
+        return {
+            "id": self.id, "kind": self.kind, "status": self.status, "request": self.request,
+            "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "progress": self.progress, "results": self.results, "error": self.error,
+            "audio_bytes": len(self.audio) if self.audio is not None else None,
+        }
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix 套接字上的 HTTP 服务 (只有本机用户可访问，权限由套接字文件控制)"""
+
+    daemon_threads = True
 
-            retry_delay_adjusted = retry_delay * (2 ** attempt)
-            logging.info(f"等待 {retry_delay_adjusted} 秒后重试...")
-            time.sleep(retry_delay_adjusted)
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("local", 0)
 
+
+class ConversionDaemon:
+    """常驻的转换服务：解析器、合成后端的连接和各级缓存一直保持预热
+
+    通过本机 HTTP (或 Unix 套接字) 接收任务，在内部线程池中执行，不再为每次转换启动新进程：
+
+        POST   /jobs               提交任务，JSON 为 {"input_path", "output_dir"} 或 {"text", "output_path"}，
+                                   可选 "lang"；返回任务状态 (202)
+        GET    /jobs               所有任务
+        GET    /jobs/<id>          任务状态和进度
+        GET    /jobs/<id>/events   进度事件 (每行一个 JSON，任务结束时连接关闭)
+        GET    /jobs/<id>/result   结果 (生成的音频路径)
+        GET    /jobs/<id>/audio    文本任务的 MP3
+        DELETE /jobs/<id>          取消任务
+        GET    /health、/metrics   健康检查和 Prometheus 指标
+
+    文件任务按路径提交，由守护进程直接读取本机文件并写入请求指定的位置，因此每个请求都须带
+    "Authorization: Bearer <token>"：未指定 token 时生成随机令牌并写入 token_file (权限 0600)。
+    此外 POST 的 Content-Type 必须是 application/json，HTTP 请求的 Host 必须是本机地址，
+    使网页无法用简单请求或 DNS 重绑定访问本服务。
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, job_workers=DAEMON_JOB_WORKERS, cache_dir=DEFAULT_CACHE_DIR,
+                 backend_name=DEFAULT_BACKEND, tts_url=None, voice=None, proxy=None, rate_limit=None, token=None,
+                 font_classifier=None, token_file=DEFAULT_DAEMON_TOKEN_FILE):
+        self.max_workers = max_workers
+        self.token = token or secrets.token_urlsafe(32)
+        if not token and token_file:
+            fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.token)
+            logging.info(f"守护进程令牌已写入 {os.path.abspath(token_file)}")
+        self.allowed_hosts = set(DAEMON_LOOPBACK_HOSTS)
+        self.font_classifier = font_classifier
+        self.backend = create_backend(backend_name, pool_size=max_workers, tts_url=tts_url, voice=voice,
+                                      proxy=proxy) or get_default_backend()
+        self.backend.ensure_pool_size(max_workers)
+        self.cache = AudioCache(cache_dir) if cache_dir else None
+        self.chunk_cache = ChunkCache(os.path.join(cache_dir, ChunkCache.DIR_NAME)) if cache_dir else None
+        self.extraction_cache = (ExtractionCache(os.path.join(cache_dir, ExtractionCache.FILE_NAME))
+                                 if cache_dir else None)
+        self.limiter = RateLimiter(max_concurrency=max_workers, rate=rate_limit)
+        self.executor = ThreadPoolExecutor(max_workers=job_workers, thread_name_prefix="daemon-job")
+        self.jobs = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._servers = []
+        self._warm_up()
+
+    def _warm_up(self):
+        """启动时导入解析和合成用到的库，第一个任务不再承担导入开销"""
+        for module in ("fitz", "gtts", "requests"):
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+
+    def submit(self, request):
+        """校验并提交任务，返回 DaemonJob；请求不合法时抛出 ValueError"""
+        if not isinstance(request, dict):
+            raise ValueError("请求应为 JSON 对象")
+        for field in ("text", "input_path", "output_dir", "output_path", "lang"):
+            if request.get(field) is not None and not isinstance(request[field], str):
+                raise ValueError(f"{field} 应为字符串")
+        if request.get("text"):
+            kind = "text"
+        elif request.get("input_path"):
+            kind = "file"
+            input_path = request["input_path"]
+            if not input_path.lower().endswith(('.pdf', '.docx')):
+                raise ValueError("不支持的文件类型，请提供 .docx 或 .pdf 文件")
+            if not os.path.isfile(input_path):
+                raise ValueError(f"输入文件不存在: {input_path}")
+            if not request.get("output_dir"):
+                raise ValueError("文件任务需要 output_dir")
+        else:
+            raise ValueError("请求需要 text 或 input_path")
+        with self._lock:
+            job = DaemonJob(next(self._ids), kind, request)
+            self.jobs[job.id] = job
+        job.emit("queued")
+        self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.finish("cancelled")
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        job.emit("started")
+        try:
+            if job.kind == "text":
+                self._run_text(job)
+            else:
+                self._run_file(job)
+            job.finish("done", results=job.results)
+        except ConversionCancelled as e:
+            job.results = e.audio_paths
+            job.finish("cancelled", results=job.results)
         except Exception as e:
-            error_msg = f"音频生成错误 (第 {attempt + 1} 次尝试): {str(e)}"
-            logging.error(error_msg)
-            logging.debug(f"错误类型: {e.__class__.__name__}, 错误详情: {str(e)}")
+            job.error = str(e)
+            logging.error(f"任务 {job.id} 失败: {str(e)}")
+            job.finish("failed", error=job.error)
+        finally:
+            self._prune()
+
+    def _run_text(self, job):
+        text = job.request["text"]
+        lang = job.request.get("lang", "ro")
+        audio = self.cache.get_bytes(text, lang, self.backend.name) if self.cache is not None else None
+        if audio is None:
+            audio = _synthesize_chunked(text, lang, self.backend, self.limiter, label=f"任务 {job.id}",
+                                        chunk_cache=self.chunk_cache)
+            if self.cache is not None:
+                self.cache.put_bytes(text, lang, self.backend.name, audio)
+        job.audio = audio
+        output_path = job.request.get("output_path")
+        if output_path:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            tmp_path = _temp_path(output_path)
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(audio)
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            job.results = [output_path]
+
+    def _run_file(self, job):
+        request = job.request
+        job.results = batch_text_to_speech(request["input_path"], request["output_dir"], job.on_progress,
+                                           max_workers=self.max_workers, cache=self.cache,
+                                           lang=request.get("lang", "ro"), backend=self.backend,
+                                           limiter=self.limiter, cancel_event=job.cancel_event,
+                                           extraction_cache=self.extraction_cache,
+                                           font_classifier=self.font_classifier, chunk_cache=self.chunk_cache)
+
+    def _prune(self):
+        """只保留最近 DAEMON_MAX_FINISHED_JOBS 个已结束的任务"""
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+            for job_id in finished[:max(0, len(finished) - DAEMON_MAX_FINISHED_JOBS)]:
+                del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+        return job
+
+    def _make_handler(self):
+        from http.server import BaseHTTPRequestHandler
+        service = self
+
+        class DaemonRequestHandler(BaseHTTPRequestHandler):
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self):
+                """检查 Host、鉴权并解析路径，返回 (路径段列表, 任务)；出错时已发送响应并返回 None"""
+                if not isinstance(self.server, _UnixHTTPServer):
+                    host = urllib.parse.urlsplit("//" + self.headers.get("Host", "")).hostname
+                    if host not in service.allowed_hosts:
+                        self._send_json(403, {"error": "不允许的 Host"})
+                        return None
+                if not hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"),
+                                           f"Bearer {service.token}".encode("utf-8")):
+                    self._send_json(401, {"error": "未授权"})
+                    return None
+                parts = [part for part in urllib.parse.urlsplit(self.path).path.split("/") if part]
+                job = None
+                if len(parts) >= 2 and parts[0] == "jobs":
+                    job = service.get(int(parts[1])) if parts[1].isdigit() else None
+                    if job is None:
+                        self._send_json(404, {"error": "任务不存在"})
+                        return None
+                return parts, job
 
-            if os.path.exists(audio_path):
+            def do_GET(self):
+                routed = self._route()
+                if routed is None:
+                    return
+                parts, job = routed
+                if parts == ["health"]:
+                    self._send_json(200, {"status": "ok", "jobs": len(service.jobs)})
+                elif parts == ["metrics"]:
+                    data = metrics.to_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                elif parts == ["jobs"]:
+                    with service._lock:
+                        jobs = list(service.jobs.values())
+                    self._send_json(200, [job.describe() for job in jobs])
+                elif len(parts) == 2 and job is not None:
+                    self._send_json(200, job.describe())
+                elif len(parts) == 3 and parts[2] == "result":
+                    self._send_json(200 if job.finished else 409,
+                                    {"status": job.status, "results": job.results, "error": job.error})
+                elif len(parts) == 3 and parts[2] == "audio":
+                    if job.audio is None:
+                        self._send_json(409 if not job.finished else 404, {"status": job.status, "error": "没有音频"})
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "audio/mpeg")
+                    self.send_header("Content-Length", str(len(job.audio)))
+                    self.end_headers()
+                    self.wfile.write(job.audio)
+                elif len(parts) == 3 and parts[2] == "events":
+                    # HTTP/1.0 响应，以关闭连接表示事件流结束
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Cache-Control", "no-cache")
+                    self.end_headers()
+                    for event in job.iter_events():
+                        self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8'))
+                        self.wfile.flush()
+                else:
+                    self._send_json(404, {"error": "未知路径"})
+
+            def do_POST(self):
+                routed = self._route()
+                if routed is None:
+                    return
+                parts, _ = routed
+                if parts != ["jobs"]:
+                    self._send_json(404, {"error": "未知路径"})
+                    return
+                content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if content_type != "application/json":
+                    self._send_json(415, {"error": "Content-Type 应为 application/json"})
+                    return
                 try:
-                    os.remove(audio_path)
-                except Exception as remove_error:
-                    logging.warning(f"无法删除损坏的音频文件: {str(remove_error)}")
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+                    job = service.submit(request)
+                except ValueError as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                self._send_json(202, job.describe())
 
-            if attempt == max_retries - 1:
-                raise Exception(f"音频生成失败: {error_msg}")
+            def do_DELETE(self):
+                routed = self._route()
+                if routed is None:
+                    return
+                parts, job = routed
+                if len(parts) != 2 or job is None:
+                    self._send_json(404, {"error": "未知路径"})
+                    return
+                service.cancel(job.id)
+                self._send_json(202, job.describe())
+
+            def log_message(self, format, *args):
+                logging.debug("守护进程请求: " + format, *args)
+
+        return DaemonRequestHandler
+
+    def serve(self, host="127.0.0.1", port=DEFAULT_DAEMON_PORT, unix_path=None):
+        """在后台线程中监听 HTTP 端口 (port 为 None 时不监听) 和 Unix 套接字，返回服务器列表"""
+        from http.server import ThreadingHTTPServer
+        handler = self._make_handler()
+        if host not in ("", "0.0.0.0", "::"):
+            self.allowed_hosts.add(host)
+        if port is not None:
+            self._servers.append(ThreadingHTTPServer((host, port), handler))
+            logging.info(f"守护进程监听 http://{host}:{self._servers[-1].server_address[1]}")
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            self._servers.append(_UnixHTTPServer(unix_path, handler))
+            logging.info(f"守护进程监听 Unix 套接字 {unix_path}")
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, name="daemon-http", daemon=True).start()
+        return self._servers
+
+    def shutdown(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+            if isinstance(server, _UnixHTTPServer) and os.path.exists(server.server_address):
+                os.remove(server.server_address)
+        with self._lock:
+            for job in self.jobs.values():
+                job.cancel_event.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.extraction_cache is not None:
+            self.extraction_cache.close()
+        self.backend.close()
 
-            retry_delay_adjusted = retry_delay * (2 ** attempt)
-            logging.info(f"等待 {retry_delay_adjusted} 秒后重试...")
-            time.sleep(retry_delay_adjusted)
+
+def run_daemon(host="127.0.0.1", port=DEFAULT_DAEMON_PORT, unix_path=None, **options):
+    """启动守护进程并阻塞，直到收到 Ctrl+C 或 SIGTERM"""
+    service = ConversionDaemon(**options)
+    service.serve(host, port, unix_path)
+    stop_event = threading.Event()
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    except ValueError:  # 不在主线程中时无法设置信号处理
+        pass
+    try:
+        while not stop_event.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    logging.info("守护进程退出，等待进行中的任务取消")
+    service.shutdown()
+    return 0
+
+
+def _daemon_request(url, method="GET", payload=None, token=None, timeout=30):
+    """向守护进程发送请求，返回响应对象"""
+    import urllib.request
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method)
+    if data is not None:
+        request.add_header("Content-Type", "application/json")
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    return urllib.request.urlopen(request, timeout=timeout)
 
 
+def _run_submit_command(args):
+    """submit 子命令：把文件或文本提交给守护进程，--wait 时跟随进度直到完成"""
+    import urllib.error
+    base_url = args.url.rstrip('/')
+    token = args.token
+    if not token and os.path.exists(args.token_file):
+        with open(args.token_file, encoding="utf-8") as f:
+            token = f.read().strip()
+    requests_to_send = [{"text": args.text, "lang": args.lang, "output_path": args.save}] if args.text else []
+    for input_path in _expand_inputs(args.inputs):
+        if not args.output:
+            logging.error("提交文件任务需要 -o/--output")
+            return 2
+        requests_to_send.append({"input_path": os.path.abspath(input_path), "output_dir": os.path.abspath(args.output),
+                                 "lang": args.lang})
+    if not requests_to_send:
+        logging.error("请提供输入文件或 --text")
+        return 2
+    exit_code = 0
+    for payload in requests_to_send:
+        if payload.get("output_path"):
+            payload["output_path"] = os.path.abspath(payload["output_path"])
+        try:
+            with _daemon_request(f"{base_url}/jobs", "POST", payload, token) as response:
+                job = json.load(response)
+        except urllib.error.HTTPError as e:
+            logging.error(f"提交失败: {e.read().decode('utf-8', 'replace')}")
+            exit_code = 1
+            continue
+        print(json.dumps({"job": job["id"], "status": job["status"]}, ensure_ascii=False))
+        if not args.wait:
+            continue
+        with _daemon_request(f"{base_url}/jobs/{job['id']}/events", token=token, timeout=None) as response:
+            for line in response:
+                event = json.loads(line)
+                if event["event"] == "progress":
+                    _print_progress(payload.get("input_path", "文本"), event["current"], event["total"],
+                                    event["stage"])
+                elif event["event"] in DaemonJob.FINISHED:
+                    sys.stderr.write("\n")
+                    print(json.dumps(event, ensure_ascii=False))
+                    if event["event"] != "done":
+                        exit_code = 1
+    return exit_code
+
+
+# 没有 tkinter 时仍可导入本模块，只是不能创建窗口
+_TkBase = tk.Tk if tk is not None else object
+
+
+class SanskritAudioConverterGUI(_TkBase):
+    # 界面刷新间隔 (毫秒)：后台线程发来的进度事件按此频率合并显示
+    REFRESH_INTERVAL_MS = 100
 
-class SanskritAudioConverterGUI(tk.Tk):
     def __init__(self):
         super().__init__()
 
@@ -293,8 +4023,70 @@ class SanskritAudioConverterGUI(tk.Tk):
         self.create_progress_frame(main_frame)
         self.toggle_proxy_fields()
         self.load_config()
+        self.audio_cache = AudioCache(DEFAULT_CACHE_DIR)
+        self.chunk_cache = ChunkCache(os.path.join(DEFAULT_CACHE_DIR, ChunkCache.DIR_NAME))
+        self.extraction_cache = ExtractionCache(os.path.join(DEFAULT_CACHE_DIR, ExtractionCache.FILE_NAME))
+        self.backends = {}
+        self.backends_lock = threading.Lock()
+        self.preview_cache = PreviewCache()
+        self.preview_player = None
+        self.preview_stop = threading.Event()
+        self.events = queue.Queue()
+        self.conversion_thread = None
+        self.cancel_event = threading.Event()
+        self.pause_event = threading.Event()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(self.REFRESH_INTERVAL_MS, self.poll_events)
         self.check_single_instance()
 
+    def run_on_ui(self, func, *args):
+        """供后台线程调用：把 func(*args) 交给主线程执行"""
+        self.events.put(('call', func, args))
+
+    def poll_events(self):
+        """在主线程中处理后台线程发来的事件，同一轮内的进度事件只显示每个阶段最新的一条"""
+        latest_progress = {}
+        calls = []
+        try:
+            while True:
+                event = self.events.get_nowait()
+                if event[0] == 'progress':
+                    _, current, total, stage = event
+                    latest_progress[stage] = (current, total)
+                else:
+                    calls.append(event)
+        except queue.Empty:
+            pass
+        for stage, (current, total) in latest_progress.items():
+            self.update_progress(current, total, stage)
+        for _, func, args in calls:
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"处理界面事件失败: {str(e)}")
+        self.after(self.REFRESH_INTERVAL_MS, self.poll_events)
+
+    def on_close(self):
+        """关闭窗口时取消正在进行的转换"""
+        if self.conversion_thread is not None and self.conversion_thread.is_alive():
+            if not messagebox.askokcancel("退出", "转换仍在进行，确定要取消并退出吗？"):
+                return
+            self.cancel_event.set()
+            self.pause_event.clear()
+        self.stop_preview()
+        with self.backends_lock:
+            for backend in self.backends.values():
+                backend.close()
+        self.destroy()
+
+    def get_backend(self, name, proxy=None):
+        """按名称和代理取合成后端；同一设置的后端 (连接池、离线引擎进程) 在窗口生命周期内常驻复用"""
+        key = (name, proxy if name == "gtts" else None)
+        with self.backends_lock:
+            if key not in self.backends:
+                self.backends[key] = create_backend(name, proxy=key[1]) or get_default_backend()
+            return self.backends[key]
+
     def create_text_input_frame(self, main_frame):
         """创建文本输入和播放框架"""
         text_frame = ttk.LabelFrame(main_frame, text="文本播放", padding="5")
@@ -307,60 +4099,82 @@ class SanskritAudioConverterGUI(tk.Tk):
         self.lang_var = tk.StringVar(value="ro")  # Default to Romanian
         lang_combo = ttk.Combobox(lang_frame, textvariable=self.lang_var, values=["sa", "hi", "en", "ro", "id"])
         lang_combo.pack(side=tk.LEFT, padx=5)
+        ttk.Label(lang_frame, text="合成引擎:").pack(side=tk.LEFT, padx=(10, 0))
+        self.backend_var = tk.StringVar(value=DEFAULT_BACKEND)
+        backend_combo = ttk.Combobox(lang_frame, textvariable=self.backend_var, values=list(BACKEND_CHOICES),
+                                     state="readonly", width=8)
+        backend_combo.pack(side=tk.LEFT, padx=5)
         button_frame = ttk.Frame(text_frame)
         button_frame.pack(fill=tk.X, padx=5, pady=5)
         ttk.Button(button_frame, text="播放", command=self.play_text).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="下载", command=self.download_text).pack(side=tk.LEFT, padx=5)
 
     def play_text(self):
-        """播放输入的文本"""
+        """播放输入的文本：在后台线程分段合成，第一段合成完即开始播放；再次播放时停止上一次试听"""
         text = self.text_input.get("1.0", tk.END).strip()
         if not text:
             messagebox.showwarning("警告", "请输入要播放的文本")
             return
+        self.stop_preview()
+        self.preview_stop = threading.Event()
+        self.preview_player = find_audio_player()
+        self.status_var.set("正在合成试听音频...")
+        threading.Thread(target=self._play_worker,
+                         args=(text, self.lang_var.get(), self.get_current_proxy(), self.backend_var.get(),
+                               self.preview_player, self.preview_stop),
+                         daemon=True).start()
+
+    def stop_preview(self):
+        """停止正在进行的试听"""
+        self.preview_stop.set()
+        if self.preview_player is not None:
+            self.preview_player.stop()
+            self.preview_player = None
+
+    def _play_worker(self, text, lang, proxy, backend_name, player, stop_event):
+        """后台线程：边合成边播放试听音频"""
         try:
-            proxy = self.get_current_proxy()
-            if proxy:
-                os.environ['HTTP_PROXY'] = proxy['http']
-                os.environ['HTTPS_PROXY'] = proxy['https']
-            temp_dir = "temp"
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-            temp_audio = os.path.join(temp_dir, "temp_audio.mp3")
-            tts = gTTS(text=text, lang=self.lang_var.get())
-            tts.save(temp_audio)
-            os.startfile(temp_audio)
+            preview_text(text, lang=lang, backend=self.get_backend(backend_name, proxy), player=player,
+                         preview_cache=self.preview_cache, cache=self.audio_cache, chunk_cache=self.chunk_cache,
+                         stop_event=stop_event)
+            if not stop_event.is_set():
+                self.run_on_ui(self.status_var.set, "就绪")
         except Exception as e:
-            messagebox.showerror("错误", f"播放失败: {str(e)}")
-        finally:
-            os.environ.pop('HTTP_PROXY', None)
-            os.environ.pop('HTTPS_PROXY', None)
+            self.run_on_ui(self._show_task_error, "播放失败", str(e))
 
     def download_text(self):
-        """下载文本的音频文件"""
+        """下载文本的音频文件 (在后台线程合成，不阻塞界面)"""
         text = self.text_input.get("1.0", tk.END).strip()
         if not text:
             messagebox.showwarning("警告", "请输入要转换的文本")
             return
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".mp3",
+            filetypes=[("MP3文件", "*.mp3")]
+        )
+        if not file_path:
+            return
+        self.status_var.set("正在合成音频...")
+        threading.Thread(target=self._download_worker,
+                         args=(text, file_path, self.lang_var.get(), self.get_current_proxy(), self.backend_var.get()),
+                         daemon=True).start()
+
+    def _download_worker(self, text, file_path, lang, proxy, backend_name):
+        """后台线程：合成音频并保存到指定文件"""
         try:
-            proxy = self.get_current_proxy()
-            if proxy:
-                os.environ['HTTP_PROXY'] = proxy['http']
-                os.environ['HTTPS_PROXY'] = proxy['https']
-            file_path = filedialog.asksaveasfilename(
-                defaultextension=".mp3",
-                filetypes=[("MP3文件", "*.mp3")]
-            )
-            if not file_path:
-                return
-            tts = gTTS(text=text, lang=self.lang_var.get())
-            tts.save(file_path)
-            messagebox.showinfo("成功", "音频文件已保存")
+            convert_to_audio(text, file_path, lang=lang, cache=self.audio_cache, chunk_cache=self.chunk_cache,
+                             backend=self.get_backend(backend_name, proxy))
+            self.run_on_ui(self._show_download_done)
         except Exception as e:
-            messagebox.showerror("错误", f"下载失败: {str(e)}")
-        finally:
-            os.environ.pop('HTTP_PROXY', None)
-            os.environ.pop('HTTPS_PROXY', None)
+            self.run_on_ui(self._show_task_error, "下载失败", str(e))
+
+    def _show_download_done(self):
+        self.status_var.set("就绪")
+        messagebox.showinfo("成功", "音频文件已保存")
+
+    def _show_task_error(self, title, message):
+        self.status_var.set(title)
+        messagebox.showerror("错误", f"{title}: {message}")
 
     def create_proxy_frame(self, main_frame):
         """创建代理设置框架"""
@@ -395,6 +4209,9 @@ class SanskritAudioConverterGUI(tk.Tk):
                     self.auto_proxy_var.set(config.get('auto_proxy', True))
                     self.proxy_host_var.set(config.get('proxy_host', '127.0.0.1'))
                     self.proxy_port_var.set(config.get('proxy_port', '7890'))
+                    self.max_workers_var.set(config.get('max_workers', DEFAULT_MAX_WORKERS))
+                    if config.get('backend') in BACKEND_CHOICES:
+                        self.backend_var.set(config['backend'])
         except Exception as e:
             logging.warning(f"加载配置文件失败: {str(e)}")
 
@@ -403,7 +4220,9 @@ class SanskritAudioConverterGUI(tk.Tk):
         config = {
             'auto_proxy': self.auto_proxy_var.get(),
             'proxy_host': self.proxy_host_var.get(),
-            'proxy_port': self.proxy_port_var.get()
+            'proxy_port': self.proxy_port_var.get(),
+            'max_workers': self.max_workers_var.get(),
+            'backend': self.backend_var.get()
         }
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
@@ -465,6 +4284,13 @@ class SanskritAudioConverterGUI(tk.Tk):
         output_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
         output_button = ttk.Button(output_frame, text="浏览", command=self.select_output_folder)
         output_button.pack(side=tk.LEFT)
+        workers_frame = ttk.Frame(file_frame)
+        workers_frame.pack(fill=tk.X, pady=2)
+        workers_label = ttk.Label(workers_frame, text="并发数:")
+        workers_label.pack(side=tk.LEFT)
+        self.max_workers_var = tk.IntVar(value=DEFAULT_MAX_WORKERS)
+        workers_spinbox = ttk.Spinbox(workers_frame, from_=1, to=16, width=5, textvariable=self.max_workers_var)
+        workers_spinbox.pack(side=tk.LEFT, padx=5)
 
     def create_progress_frame(self, main_frame):
         """创建进度显示框架"""
@@ -476,8 +4302,14 @@ class SanskritAudioConverterGUI(tk.Tk):
         self.status_var = tk.StringVar(value="就绪")
         status_label = ttk.Label(progress_frame, textvariable=self.status_var)
         status_label.pack(pady=2)
-        self.convert_button = ttk.Button(progress_frame, text="开始转换", command=self.start_conversion)
-        self.convert_button.pack(pady=5)
+        button_frame = ttk.Frame(progress_frame)
+        button_frame.pack(pady=5)
+        self.convert_button = ttk.Button(button_frame, text="开始转换", command=self.start_conversion)
+        self.convert_button.pack(side=tk.LEFT, padx=5)
+        self.pause_button = ttk.Button(button_frame, text="暂停", command=self.toggle_pause, state='disabled')
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="取消", command=self.cancel_conversion, state='disabled')
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
 
     def select_input_file(self):
         """选择输入文件"""
@@ -492,12 +4324,40 @@ class SanskritAudioConverterGUI(tk.Tk):
         if folder_path:
             self.output_path_var.set(folder_path)
 
-    def update_progress(self, current, total):
-        """更新进度条"""
-        progress = (current / total * 100) if total > 0 else 0
-        self.progress_var.set(progress)
-        self.status_var.set(f"处理中... {current}/{total}")
-        self.update()
+    def update_progress(self, current, total, stage="synthesize"):
+        """更新进度条：进度条显示合成进度，状态栏同时显示解析、合成进度、速度和预计剩余时间"""
+        if stage == "extract":
+            self.extract_status = f"解析 {current * 100 // total if total else 0}%"
+        else:
+            progress = (current / total * 100) if total > 0 else 0
+            self.progress_var.set(progress)
+            self.synthesize_status = f"转换 {current}/{total}"
+            elapsed = time.monotonic() - getattr(self, 'conversion_started', time.monotonic())
+            if current and elapsed > 0:
+                rate = current / elapsed
+                remaining = (total - current) / rate
+                self.synthesize_status += f"  {rate:.2f} 段/秒  预计剩余 {int(remaining // 60)}:{int(remaining % 60):02d}"
+        parts = [part for part in (getattr(self, 'extract_status', ''), getattr(self, 'synthesize_status', '')) if part]
+        prefix = "已暂停" if self.pause_event.is_set() else "处理中..."
+        self.status_var.set(f"{prefix} {' | '.join(parts)}")
+
+    def toggle_pause(self):
+        """暂停/继续提交新的合成任务"""
+        if self.pause_event.is_set():
+            self.pause_event.clear()
+            self.pause_button.configure(text="暂停")
+        else:
+            self.pause_event.set()
+            self.pause_button.configure(text="继续")
+            self.status_var.set("正在暂停，等待在途任务结束...")
+
+    def cancel_conversion(self):
+        """取消转换：已完成的音频保留，下次转换同一文件时跳过"""
+        self.cancel_event.set()
+        self.pause_event.clear()
+        self.pause_button.configure(state='disabled', text="暂停")
+        self.cancel_button.configure(state='disabled')
+        self.status_var.set("正在取消，等待在途任务结束...")
 
     def toggle_proxy_fields(self):
         """切换代理字段的可用状态"""
@@ -510,6 +4370,7 @@ class SanskritAudioConverterGUI(tk.Tk):
     def update_proxy_settings(self):
         """更新代理设置"""
         if self.auto_proxy_var.get():
+            system_proxy_resolver.invalidate()  # 用户切换到自动代理时重新读取一次
             host, port = get_system_proxy()
             if host and port:
                 self.proxy_host_var.set(host)
@@ -519,21 +4380,15 @@ class SanskritAudioConverterGUI(tk.Tk):
                 self.proxy_port_var.set("7890")
 
     def get_current_proxy(self):
-        """获取当前代理设置"""
+        """获取当前代理地址；系统代理取自 system_proxy_resolver 的缓存，不每次读取注册表"""
         if self.auto_proxy_var.get():
-            host, port = get_system_proxy()
-            if host and port:
-                return {
-                    'http': f'http://{host}:{port}',
-                    'https': f'http://{host}:{port}'
-                }
+            proxy = system_proxy_resolver.resolve()
+            if proxy:
+                return proxy
         host = self.proxy_host_var.get()
         port = self.proxy_port_var.get()
         if host and port:
-            return {
-                'http': f'http://{host}:{port}',
-                'https': f'http://{host}:{port}'
-            }
+            return f'http://{host}:{port}'
         return None
 
     def start_conversion(self):
@@ -552,47 +4407,376 @@ class SanskritAudioConverterGUI(tk.Tk):
             except Exception as e:
                 messagebox.showerror("错误", f"创建输出目录失败: {str(e)}")
                 return
+        try:
+            max_workers = self.max_workers_var.get()
+        except tk.TclError:
+            max_workers = DEFAULT_MAX_WORKERS
+        proxy = self.get_current_proxy()
+
         self.convert_button.configure(state='disabled')
-        self.status_var.set("准备转换...")
+        self.pause_button.configure(state='normal', text="暂停")
+        self.cancel_button.configure(state='normal')
+        self.status_var.set("正在转换...")
         self.progress_var.set(0)
+        self.extract_status = ""
+        self.synthesize_status = ""
+        self.conversion_started = time.monotonic()
+        self.cancel_event.clear()
+        self.pause_event.clear()
+        self.conversion_thread = threading.Thread(target=self._conversion_worker, name="conversion",
+                                                  args=(input_path, output_path, max_workers, proxy,
+                                                        self.backend_var.get()), daemon=True)
+        self.conversion_thread.start()
+
+    def _conversion_worker(self, input_path, output_path, max_workers, proxy, backend_name):
+        """后台线程：执行批量转换，进度和结果通过事件队列交给主线程"""
         try:
-            proxy = self.get_current_proxy()
-            if proxy:
-                os.environ['HTTP_PROXY'] = proxy['http']
-                os.environ['HTTPS_PROXY'] = proxy['https']
-            else:
-                os.environ.pop('HTTP_PROXY', None)
-                os.environ.pop('HTTPS_PROXY', None)
-            self.status_var.set("正在转换...")
-            audio_paths = batch_text_to_speech(input_path, output_path, self.update_progress)
-
-            if audio_paths:
-                self.status_var.set(f"转换完成，共生成 {len(audio_paths)} 个音频文件")
-                messagebox.showinfo("完成", f"成功生成 {len(audio_paths)} 个音频文件")
-            else:
-                self.status_var.set("转换完成，但未生成音频文件")
-                messagebox.showwarning("警告", "未找到可转换的梵文内容")
+            audio_paths = batch_text_to_speech(
+                input_path, output_path,
+                lambda current, total, stage: self.events.put(('progress', current, total, stage)),
+                max_workers=max_workers, cache=self.audio_cache, extraction_cache=self.extraction_cache,
+                chunk_cache=self.chunk_cache, backend=self.get_backend(backend_name, proxy),
+                cancel_event=self.cancel_event, pause_event=self.pause_event)
+            self.run_on_ui(self._on_conversion_finished, audio_paths)
+        except ConversionCancelled as e:
+            self.run_on_ui(self._on_conversion_cancelled, e.audio_paths)
         except Exception as e:
-            self.status_var.set("转换失败")
-            messagebox.showerror("错误", f"转换过程中发生错误: {str(e)}")
             logging.error(f"转换失败: {str(e)}")
+            self.run_on_ui(self._on_conversion_failed, str(e))
+
+    def _reset_conversion_buttons(self):
+        self.convert_button.configure(state='normal')
+        self.pause_button.configure(state='disabled', text="暂停")
+        self.cancel_button.configure(state='disabled')
+
+    def _on_conversion_finished(self, audio_paths):
+        self._reset_conversion_buttons()
+        if audio_paths:
+            self.status_var.set(f"转换完成，共生成 {len(audio_paths)} 个音频文件")
+            messagebox.showinfo("完成", f"成功生成 {len(audio_paths)} 个音频文件")
+        else:
+            self.status_var.set("转换完成，但未生成音频文件")
+            messagebox.showwarning("警告", "未找到可转换的梵文内容")
+
+    def _on_conversion_cancelled(self, audio_paths):
+        self._reset_conversion_buttons()
+        self.status_var.set(f"转换已取消，已生成 {len(audio_paths)} 个音频文件")
+
+    def _on_conversion_failed(self, message):
+        self._reset_conversion_buttons()
+        self.status_var.set("转换失败")
+        messagebox.showerror("错误", f"转换过程中发生错误: {message}")
+
+
+def _print_progress(input_path, current, total, stage):
+    """命令行进度输出"""
+    if stage == "extract":
+        status = f"解析 {current * 100 // total if total else 0}%"
+    elif stage == "postprocess":
+        status = f"后处理 {current}/{total}"
+    else:
+        status = f"转换 {current}/{total}"
+    sys.stderr.write(f"\r{os.path.basename(input_path)} {status}   ")
+    sys.stderr.flush()
+
+
+def _add_postprocess_arguments(parser):
+    """后处理参数 (convert --postprocess 和 postprocess 子命令共用)"""
+    parser.add_argument("--target-loudness", type=float, default=DEFAULT_TARGET_LOUDNESS, metavar="DBFS",
+                        help=f"目标响度 (默认 {DEFAULT_TARGET_LOUDNESS})")
+    parser.add_argument("--silence-threshold", type=float, default=DEFAULT_SILENCE_THRESHOLD, metavar="DBFS",
+                        help=f"低于该电平视为静音 (默认 {DEFAULT_SILENCE_THRESHOLD})")
+    parser.add_argument("--postprocess-processes", type=int, help="后处理进程数 (默认 CPU 核数)")
+    parser.add_argument("--postprocess-batch", type=int, default=DEFAULT_POSTPROCESS_BATCH,
+                        help="每次分发给进程的片段数")
+
+
+def _postprocess_options(args):
+    return {"processes": args.postprocess_processes, "batch_size": args.postprocess_batch,
+            "target_loudness": args.target_loudness, "silence_threshold": args.silence_threshold}
+
+
+def build_arg_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(description="梵文音频批量转换工具 (不带参数运行时打开图形界面)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper,
+                        help="日志级别 (默认 INFO，或环境变量 AUDIO_CONVERTER_LOG_LEVEL)")
+    parser.add_argument("--log-file", help="同时写入日志文件 (按大小轮转)")
+    parser.add_argument("--log-json", action="store_true", help="每条日志输出一行 JSON")
+    subparsers = parser.add_subparsers(dest="command")
+
+    convert_parser = subparsers.add_parser("convert", help="批量转换 PDF/Word 文件")
+    convert_parser.add_argument("inputs", nargs="+", help="输入的 .pdf/.docx 文件")
+    convert_parser.add_argument("-o", "--output", required=True, help="输出目录")
+    convert_parser.add_argument("--lang", default="ro", help="合成语言 (默认 ro)")
+    convert_parser.add_argument("-j", "--workers", type=int, default=DEFAULT_MAX_WORKERS, help="并发合成数")
+    convert_parser.add_argument("--extract-processes", type=int, default=1, help="PDF 解析进程数")
+    convert_parser.add_argument("--proxy", action="append",
+                                help="代理地址，如 http://127.0.0.1:7890 (可重复，多个代理轮流使用)")
+    convert_parser.add_argument("--tts-url", help="合成服务地址，用于指向本地替身服务器")
+    convert_parser.add_argument("--backend", choices=BACKEND_CHOICES, default=DEFAULT_BACKEND,
+                                help="合成后端：gtts (在线) 或 espeak (离线 espeak-ng)")
+    convert_parser.add_argument("--voice", help=f"espeak-ng 语音 (默认 {DEFAULT_ESPEAK_VOICE})")
+    convert_parser.add_argument("--rate", type=float, help="每秒合成请求数上限")
+    convert_parser.add_argument("--title-font", action="append", metavar="REGEX",
+                                help="标题字体名的正则 (可重复，默认 YaHei)")
+    convert_parser.add_argument("--mantra-font", action="append", metavar="REGEX",
+                                help="罗马音译咒语字体名的正则 (可重复，默认 ^Arial 和 ^Times)")
+    convert_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="音频缓存 (含分段缓存) 和解析缓存目录")
+    convert_parser.add_argument("--no-cache", action="store_true", help="不使用音频缓存和解析缓存")
+    convert_parser.add_argument("--album", action="store_true",
+                                help="另外把每个文件的全部咒语拼接成一个带章节的 MP3 (附 .cue/.m3u8 索引)")
+    convert_parser.add_argument("--album-gap", type=float, default=0.0, metavar="SECONDS", help="专辑中段间静音秒数")
+    convert_parser.add_argument("--album-max-mb", type=float, metavar="MB", help="专辑每卷的大小上限，超出时分卷")
+    convert_parser.add_argument("--postprocess", action="store_true",
+                                help="裁掉首尾静音并统一响度，结果写入 processed 子目录 (需要 numpy 和 ffmpeg)")
+    _add_postprocess_arguments(convert_parser)
+    convert_parser.add_argument("--metrics-json", help="把本次运行的指标摘要写入该 JSON 文件")
+    convert_parser.add_argument("--quiet", action="store_true", help="不显示进度")
+
+    preview_parser = subparsers.add_parser("preview", help="试听一段文本 (边合成边播放)")
+    preview_parser.add_argument("text", nargs="+", help="要试听的文本")
+    preview_parser.add_argument("--lang", default="ro", help="合成语言 (默认 ro)")
+    preview_parser.add_argument("--backend", choices=BACKEND_CHOICES, default=DEFAULT_BACKEND,
+                                help="合成后端：gtts (在线) 或 espeak (离线 espeak-ng)")
+    preview_parser.add_argument("--voice", help=f"espeak-ng 语音 (默认 {DEFAULT_ESPEAK_VOICE})")
+    preview_parser.add_argument("--tts-url", help="合成服务地址，用于指向本地替身服务器")
+    preview_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="音频缓存目录")
+    preview_parser.add_argument("--no-cache", action="store_true", help="不使用音频缓存")
+
+    postprocess_parser = subparsers.add_parser("postprocess", help="对已生成的 MP3 裁掉首尾静音并统一响度")
+    postprocess_parser.add_argument("inputs", nargs="+", help="MP3 文件或目录 (递归处理)")
+    postprocess_parser.add_argument("-o", "--output", required=True, help="输出目录 (按相对路径保存)")
+    _add_postprocess_arguments(postprocess_parser)
+    postprocess_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="后处理结果缓存目录")
+    postprocess_parser.add_argument("--no-cache", action="store_true", help="不使用后处理缓存")
+    postprocess_parser.add_argument("--quiet", action="store_true", help="不显示进度")
+
+    serve_parser = subparsers.add_parser("serve", help="守护进程：常驻内存，通过本机 HTTP 接口接收转换任务")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认只允许本机访问)")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_DAEMON_PORT, help="监听端口")
+    serve_parser.add_argument("--unix", metavar="PATH", help="同时监听 Unix 套接字")
+    serve_parser.add_argument("--token", help="请求须带的令牌 (Authorization: Bearer <token>)，默认随机生成")
+    serve_parser.add_argument("--token-file", default=DEFAULT_DAEMON_TOKEN_FILE, help="随机生成的令牌写入该文件")
+    serve_parser.add_argument("-j", "--workers", type=int, default=DEFAULT_MAX_WORKERS, help="并发合成数")
+    serve_parser.add_argument("--jobs", type=int, default=DAEMON_JOB_WORKERS, help="同时运行的任务数")
+    serve_parser.add_argument("--backend", choices=BACKEND_CHOICES, default=DEFAULT_BACKEND,
+                              help="合成后端：gtts (在线) 或 espeak (离线 espeak-ng)")
+    serve_parser.add_argument("--voice", help=f"espeak-ng 语音 (默认 {DEFAULT_ESPEAK_VOICE})")
+    serve_parser.add_argument("--tts-url", help="合成服务地址，用于指向本地替身服务器")
+    serve_parser.add_argument("--proxy", action="append",
+                              help="代理地址，如 http://127.0.0.1:7890 (可重复，多个代理轮流使用)")
+    serve_parser.add_argument("--rate", type=float, help="每秒合成请求数上限")
+    serve_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="音频缓存 (含分段缓存) 和解析缓存目录")
+    serve_parser.add_argument("--no-cache", action="store_true", help="不使用音频缓存和解析缓存")
+
+    submit_parser = subparsers.add_parser("submit", help="把文件或文本提交给守护进程")
+    submit_parser.add_argument("inputs", nargs="*", help="输入文件或目录")
+    submit_parser.add_argument("-o", "--output", help="文件任务的输出目录")
+    submit_parser.add_argument("--text", help="合成一段文本")
+    submit_parser.add_argument("--save", help="文本任务的音频保存路径")
+    submit_parser.add_argument("--lang", default="ro", help="合成语言 (默认 ro)")
+    submit_parser.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_DAEMON_PORT}", help="守护进程地址")
+    submit_parser.add_argument("--token", help="守护进程要求的令牌 (默认读取 --token-file)")
+    submit_parser.add_argument("--token-file", default=DEFAULT_DAEMON_TOKEN_FILE, help="守护进程生成的令牌文件")
+    submit_parser.add_argument("--wait", action="store_true", help="显示进度并等待任务结束")
+
+    queue_parser = subparsers.add_parser("queue", help="多文件任务队列 (可由多个进程、多台机器共同处理)")
+    queue_parser.add_argument("--db", default=DEFAULT_QUEUE_DB, help="任务队列数据库文件")
+    queue_subparsers = queue_parser.add_subparsers(dest="queue_command", required=True)
+    add_parser = queue_subparsers.add_parser("add", help="把文件或目录中的 PDF/Word 文件加入队列")
+    add_parser.add_argument("inputs", nargs="+", help="输入文件或目录")
+    add_parser.add_argument("-o", "--output", required=True, help="输出目录")
+    add_parser.add_argument("--lang", default="ro", help="合成语言 (默认 ro)")
+    add_parser.add_argument("--force", action="store_true", help="文件已在队列中时也重新加入")
+    add_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="解析缓存目录")
+    add_parser.add_argument("--no-cache", action="store_true", help="不使用解析缓存")
+    work_parser = queue_subparsers.add_parser("work", help="启动工作进程处理队列")
+    work_parser.add_argument("-p", "--processes", type=int, default=1, help="工作进程数")
+    work_parser.add_argument("-j", "--workers", type=int, default=DEFAULT_MAX_WORKERS, help="每个进程的并发合成数")
+    work_parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help="任务租约时长 (秒)")
+    work_parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="每段咒语的最大尝试次数")
+    work_parser.add_argument("--keep-running", action="store_true", help="队列为空时继续等待新任务")
+    work_parser.add_argument("--proxy", action="append",
+                             help="代理地址，如 http://127.0.0.1:7890 (可重复，多个代理轮流使用)")
+    work_parser.add_argument("--tts-url", help="合成服务地址，用于指向本地替身服务器")
+    work_parser.add_argument("--backend", choices=BACKEND_CHOICES, default=DEFAULT_BACKEND,
+                             help="合成后端：gtts (在线) 或 espeak (离线 espeak-ng)")
+    work_parser.add_argument("--voice", help=f"espeak-ng 语音 (默认 {DEFAULT_ESPEAK_VOICE})")
+    work_parser.add_argument("--rate", type=float, help="每个进程每秒合成请求数上限")
+    work_parser.add_argument("--metrics-port", type=int, help="在该端口提供 Prometheus 指标 (/metrics)")
+    work_parser.add_argument("--metrics-json", help="退出前把指标摘要写入该 JSON 文件")
+    work_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="音频缓存目录")
+    work_parser.add_argument("--no-cache", action="store_true", help="不使用音频缓存")
+    status_parser = queue_subparsers.add_parser("status", help="查看 job 和 task 状态")
+    status_parser.add_argument("--job", type=int, help="只看指定 job")
+    status_parser.add_argument("--tasks", action="store_true", help="列出 task")
+    status_parser.add_argument("--status", choices=["pending", "leased", "done", "failed"], help="按状态筛选 task")
+    status_parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    retry_parser = queue_subparsers.add_parser("retry", help="把失败的 task 放回队列")
+    retry_parser.add_argument("--job", type=int, help="只处理指定 job")
+    return parser
+
+
+def _run_queue_command(args):
+    """queue 子命令"""
+    if args.queue_command == "add":
+        inputs = _expand_inputs(args.inputs)
+        missing = [path for path in inputs if not os.path.exists(path)]
+        if missing:
+            logging.error(f"输入文件不存在: {', '.join(missing)}")
+            return 2
+        job_queue = JobQueue(args.db)
+        extraction_cache = None
+        if not args.no_cache:
+            extraction_cache = ExtractionCache(os.path.join(args.cache_dir, ExtractionCache.FILE_NAME))
+        try:
+            for input_path in inputs:
+                job_id, task_count, created = job_queue.add_job(input_path, args.output, args.lang,
+                                                                extraction_cache=extraction_cache, force=args.force)
+                state = "已加入" if created else "已在队列中"
+                logging.info(f"{state}: job {job_id}，{task_count} 段咒语 - {input_path}")
         finally:
-            self.convert_button.configure(state='normal')
-            os.environ.pop('HTTP_PROXY', None)
-            os.environ.pop('HTTPS_PROXY', None)
+            if extraction_cache is not None:
+                extraction_cache.close()
+            job_queue.close()
+        return 0
 
-if __name__ == '__main__':
-    logging.basicConfig(
-        level=logging.DEBUG,  # 设置日志级别为 DEBUG
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('audio_converter.log', encoding='utf-8')
-        ]
-    )
+    if args.queue_command == "work":
+        completed = run_queue_workers(args.db, processes=args.processes, threads=args.workers,
+                                      lease_seconds=args.lease, max_attempts=args.max_attempts,
+                                      exit_when_idle=not args.keep_running,
+                                      cache_dir=None if args.no_cache else args.cache_dir,
+                                      tts_url=args.tts_url, rate_limit=args.rate,
+                                      backend_name=args.backend, voice=args.voice, proxy=args.proxy,
+                                      metrics_port=args.metrics_port, metrics_path=args.metrics_json)
+        logging.info(f"共完成 {completed} 段咒语")
+        job_queue = JobQueue(args.db)
+        try:
+            failed = sum(job['failed'] for job in job_queue.job_status())
+        finally:
+            job_queue.close()
+        return 1 if failed else 0
+
+    job_queue = JobQueue(args.db)
+    try:
+        if args.queue_command == "retry":
+            logging.info(f"已放回队列: {job_queue.retry_failed(args.job)} 段")
+            return 0
+        if args.tasks or args.status:
+            tasks = job_queue.list_tasks(args.job, args.status)
+            if args.json:
+                print(json.dumps(tasks, ensure_ascii=False, indent=2))
+            for task in tasks if not args.json else ():
+                error = f"  {task['error']}" if task['error'] else ""
+                print(f"{task['job_id']:>5} {task['item_index']:>6}  {task['status']:<7} {task['attempts']}  "
+                      f"{task['title']}{error}")
+            return 0
+        jobs = job_queue.job_status(args.job)
+        if args.json:
+            print(json.dumps(jobs, ensure_ascii=False, indent=2))
+            return 0
+        print(f"{'job':>5} {'总数':>6} {'待处理':>6} {'处理中':>6} {'完成':>6} {'失败':>6}  文件")
+        for job in jobs:
+            print(f"{job['job_id']:>5} {job['tasks']:>6} {job['pending']:>6} {job['leased']:>6} {job['done']:>6} "
+                  f"{job['failed']:>6}  {job['input_path']}")
+        return 0
+    finally:
+        job_queue.close()
+
+
+def run_gui():
+    """启动图形界面"""
+    if tk is None:
+        raise RuntimeError("当前环境没有 tkinter，请使用命令行模式 (convert 子命令)")
+    configure_logging(log_file=LOG_FILE)
     try:
         app = SanskritAudioConverterGUI()
         app.mainloop()
     except Exception as e:
         logging.error(f"程序运行出错: {str(e)}")
-        messagebox.showerror("错误", str(e))
\ No newline at end of file
+        messagebox.showerror("错误", str(e))
+    return 0
+
+
+def main(argv=None):
+    """程序入口：不带参数时打开图形界面，否则执行命令行子命令"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        return run_gui()
+
+    args = build_arg_parser().parse_args(argv)
+    configure_logging(args.log_level, args.log_file, args.log_json)
+    logging.info(f"启动耗时: {(time.perf_counter() - _STARTUP_STARTED) * 1000:.1f} ms")
+
+    if args.command == "convert":
+        missing = [path for path in args.inputs if not os.path.exists(path)]
+        if missing:
+            logging.error(f"输入文件不存在: {', '.join(missing)}")
+            return 2
+        font_classifier = None
+        if args.title_font or args.mantra_font:
+            font_classifier = FontClassifier(args.title_font or DEFAULT_FONT_CLASSIFIER.title_patterns,
+                                             args.mantra_font or DEFAULT_FONT_CLASSIFIER.mantra_patterns)
+        results = convert_files(args.inputs, args.output, lang=args.lang, max_workers=args.workers,
+                                proxy=args.proxy, cache_dir=None if args.no_cache else args.cache_dir,
+                                extract_processes=args.extract_processes, tts_url=args.tts_url, rate_limit=args.rate,
+                                font_classifier=font_classifier, backend_name=args.backend, voice=args.voice,
+                                progress_callback=None if args.quiet else _print_progress, album=args.album,
+                                album_gap=args.album_gap,
+                                album_max_bytes=int(args.album_max_mb * 1024 * 1024) if args.album_max_mb else None,
+                                postprocess=args.postprocess, postprocess_options=_postprocess_options(args))
+        if not args.quiet:
+            sys.stderr.write("\n")
+        total = sum(len(paths) for paths in results.values())
+        logging.info(f"转换完成，共生成 {total} 个音频文件")
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        return 0 if total else 1
+
+    if args.command == "postprocess":
+        missing = [path for path in args.inputs if not os.path.exists(path)]
+        if missing:
+            logging.error(f"输入不存在: {', '.join(missing)}")
+            return 2
+        callback = None if args.quiet else functools.partial(_print_progress, args.output, stage="postprocess")
+        results = postprocess_paths(args.inputs, args.output, cache_dir=None if args.no_cache else args.cache_dir,
+                                    progress_callback=callback, **_postprocess_options(args))
+        if not args.quiet:
+            sys.stderr.write("\n")
+        logging.info(f"后处理完成，共 {len(results)} 个文件")
+        return 0 if results else 1
+
+    if args.command == "preview":
+        backend = create_backend(args.backend, tts_url=args.tts_url, voice=args.voice)
+        cache_dir = None if args.no_cache else args.cache_dir
+        player = find_audio_player()
+        try:
+            preview_text(" ".join(args.text), lang=args.lang, backend=backend, player=player,
+                         cache=AudioCache(cache_dir) if cache_dir else None,
+                         chunk_cache=ChunkCache(os.path.join(cache_dir, ChunkCache.DIR_NAME)) if cache_dir else None)
+            player.wait()
+        finally:
+            if backend is not None:
+                backend.close()
+        return 0
+
+    if args.command == "queue":
+        return _run_queue_command(args)
+
+    if args.command == "serve":
+        return run_daemon(args.host, args.port, args.unix, max_workers=args.workers, job_workers=args.jobs,
+                          cache_dir=None if args.no_cache else args.cache_dir, backend_name=args.backend,
+                          tts_url=args.tts_url, voice=args.voice, proxy=args.proxy, rate_limit=args.rate,
+                          token=args.token, token_file=args.token_file)
+
+    if args.command == "submit":
+        return _run_submit_command(args)
+
+    build_arg_parser().print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # PyInstaller 打包后子进程需要
+    sys.exit(main())